@@ -14,3 +14,10 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
 application = get_asgi_application()
+
+# Load and warm up the diagnose models in the background; other endpoints serve meanwhile.
+from django.conf import settings  # noqa: E402
+
+if settings.DIAGNOSE_WARMUP_ON_STARTUP:
+    from diagnose.views import registry  # noqa: E402
+    registry.warmup(background=True)
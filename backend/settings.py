@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -45,9 +46,150 @@ INSTALLED_APPS = [
 
 
 REST_FRAMEWORK = {
-    
+    'DEFAULT_PAGINATION_CLASS': 'diagnose.pagination.KeysetPagination',
 }
 
+# List endpoints return cursor-paginated pages of DIAGNOSE_PAGE_SIZE rows (?page_size= up to the max).
+
+DIAGNOSE_PAGE_SIZE = 50
+
+DIAGNOSE_MAX_PAGE_SIZE = 500
+
+# GET /diagnose/patients/{id}/timeline/ streams its pages, so they can be larger.
+
+DIAGNOSE_TIMELINE_PAGE_SIZE = 100
+
+DIAGNOSE_TIMELINE_MAX_PAGE_SIZE = 5000
+
+# Responses of the diagnose list/detail endpoints are cached in DIAGNOSE_RESPONSE_CACHE, keyed by
+# per-model generations kept in DIAGNOSE_GENERATION_CACHE (see diagnose/response_cache.py).
+# Responses may stay in per-process local memory, but generations must be in a cache that every
+# process writing to the database shares (the web server, run_diagnosis_worker, rediagnose, ...):
+# the file cache below for one machine, Redis or Memcached for several.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'diagnose',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    'generations': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'generations',
+    },
+}
+
+DIAGNOSE_RESPONSE_CACHE = 'default'
+
+DIAGNOSE_GENERATION_CACHE = 'generations'
+
+DIAGNOSE_RESPONSE_CACHE_TIMEOUT = 300
+
+
+# Diagnose inference
+# Models load lazily; when DIAGNOSE_WARMUP_ON_STARTUP is set, the WSGI/ASGI entry points load and
+# warm them up in a background thread. GET /diagnose/ready/ reports progress.
+
+DIAGNOSE_WARMUP_ON_STARTUP = True
+
+# Concurrent exams are micro-batched per model: a batch is flushed when it reaches
+# DIAGNOSE_BATCH_MAX_SIZE exams or its oldest exam has waited DIAGNOSE_BATCH_MAX_WAIT_MS.
+
+DIAGNOSE_BATCH_MAX_SIZE = 8
+
+DIAGNOSE_BATCH_MAX_WAIT_MS = 5
+
+# Per-model predictions are cached by image content and model version: an in-memory LRU of
+# DIAGNOSE_CACHE_MAX_ENTRIES eye results, backed by a SQLite file when DIAGNOSE_CACHE_PATH is set.
+
+DIAGNOSE_CACHE_MAX_ENTRIES = 4096
+
+DIAGNOSE_CACHE_PATH = None
+
+# "thread" runs the models inside the web process; "process" runs them in DIAGNOSE_PROCESS_WORKERS
+# worker processes that each hold their own models and receive images through shared memory.
+# A worker that has not answered an exam within DIAGNOSE_PROCESS_TASK_TIMEOUT seconds is restarted.
+
+DIAGNOSE_EXECUTION_MODE = 'thread'
+
+DIAGNOSE_PROCESS_WORKERS = 2
+
+DIAGNOSE_PROCESS_TASK_TIMEOUT = 60
+
+# Thread mode sizing. The scheduler runs batches on the Diagnoser's executor of DIAGNOSE_MAX_WORKERS
+# threads (models listed in DIAGNOSE_DEDICATED_THREADS get their own pool of that many threads), and
+# at most DIAGNOSE_MODEL_CONCURRENCY forward passes run on one model at a time. TensorFlow's own
+# thread pools are split so that all workers together do not oversubscribe the CPU. Fused mode makes
+# one call per exam and uses none of these executors.
+
+DIAGNOSE_MAX_WORKERS = 6
+
+DIAGNOSE_DEDICATED_THREADS = {}
+
+DIAGNOSE_MODEL_CONCURRENCY = 2
+
+DIAGNOSE_TF_INTRA_OP_THREADS = max(1, (os.cpu_count() or 1) // DIAGNOSE_MAX_WORKERS)
+
+DIAGNOSE_TF_INTER_OP_THREADS = 1
+
+# Per-model file overrides, e.g. {'glaucoma': 'glaucoma.onnx'}; the extension selects the backend
+# (.h5/.pb TensorFlow, .tflite TFLite, .onnx ONNX Runtime, see requirements-onnx.txt). Unlisted models use <name>.h5.
+
+DIAGNOSE_MODEL_PATHS = {}
+
+# ONNX Runtime sessions: graph optimization level ('disable', 'basic', 'extended', 'all') and threads.
+
+DIAGNOSE_ONNX_OPTIMIZATION_LEVEL = 'all'
+
+DIAGNOSE_ONNX_INTRA_OP_THREADS = DIAGNOSE_TF_INTRA_OP_THREADS
+
+DIAGNOSE_ONNX_INTER_OP_THREADS = 1
+
+# Fused mode runs all six models as one compiled TensorFlow graph per exam. With DIAGNOSE_FUSED_PATH
+# set, the graph is read from a SavedModel written by `manage.py export_fused_model`, which must have
+# been exported from the same models in the same order. Fused mode takes precedence over
+# DIAGNOSE_EXECUTION_MODE: requests call the diagnoser directly, without the batching scheduler.
+
+DIAGNOSE_FUSED = False
+
+DIAGNOSE_FUSED_PATH = None
+
+# Async diagnosis jobs. When DIAGNOSE_ASYNC_JOBS is on (or a request passes ?async=1), medical-data
+# uploads return 202 with a job id and `manage.py run_diagnosis_worker` runs the models.
+# GET /diagnose/async/jobs/{id}/?wait=N long-polls on the event loop for at most DIAGNOSE_JOB_MAX_WAIT_SECONDS;
+# GET /diagnose/jobs/{id}/?wait=N sleeps on a request thread, so it waits DIAGNOSE_JOB_SYNC_MAX_WAIT_SECONDS at most.
+# A job whose worker died DIAGNOSE_JOB_MAX_ATTEMPTS times is marked failed instead of requeued again.
+
+DIAGNOSE_ASYNC_JOBS = False
+
+DIAGNOSE_JOB_MAX_ATTEMPTS = 3
+
+DIAGNOSE_JOB_MAX_WAIT_SECONDS = 30
+
+DIAGNOSE_JOB_SYNC_MAX_WAIT_SECONDS = 2
+
+DIAGNOSE_JOB_POLL_INTERVAL = 0.25
+
+# Threads the async endpoints (diagnose/async_views.py) use for decoding and waiting on inference.
+# Keep it above DIAGNOSE_BATCH_MAX_SIZE so concurrent requests can fill a batch.
+
+DIAGNOSE_ASYNC_INFERENCE_THREADS = 32
+
+# Bulk ingestion (POST /diagnose/medical-data/bulk/): exams diagnosed together and stored per transaction.
+
+DIAGNOSE_BULK_CHUNK_SIZE = 32
+
+# Image derivatives (diagnose/derivatives.py): longest side in pixels of the thumbnail and preview
+# stored next to every fundus image and patient photo, and the threads that generate them.
+
+DIAGNOSE_THUMBNAIL_SIZE = 160
+
+DIAGNOSE_PREVIEW_SIZE = 800
+
+DIAGNOSE_DERIVATIVE_JPEG_QUALITY = 85
+
+DIAGNOSE_DERIVATIVE_WORKERS = 1
+
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
@@ -83,10 +225,36 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# SQLite is tuned for concurrent writers: WAL lets readers run alongside the single writer,
+# busy_timeout makes a writer wait for the lock instead of failing with "database is locked",
+# and transactions start with BEGIN IMMEDIATE so they take the write lock up front (a deferred
+# transaction that has to upgrade its read lock fails at once, without waiting). Connections are
+# kept for DIAGNOSE_SQLITE_CONN_MAX_AGE seconds so the pragmas are not re-run on every request.
+# `python -m benchmarks.sqlite_contention` compares this against SQLite's defaults.
+
+DIAGNOSE_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',  # safe with WAL: a power loss may lose the last commits, never corrupts
+    'cache_size': -64000,  # KiB
+    'mmap_size': 256 * 2 ** 20,
+    'busy_timeout': 5000,  # ms
+    'temp_store': 'MEMORY',
+}
+
+DIAGNOSE_SQLITE_TRANSACTION_MODE = 'IMMEDIATE'
+
+DIAGNOSE_SQLITE_CONN_MAX_AGE = 600
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'init_command': ';'.join(f'PRAGMA {name}={value}' for name, value in DIAGNOSE_SQLITE_PRAGMAS.items()),
+            'transaction_mode': DIAGNOSE_SQLITE_TRANSACTION_MODE,
+        },
+        'CONN_MAX_AGE': DIAGNOSE_SQLITE_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
@@ -0,0 +1,11 @@
+"""
+Offline benchmarks for the diagnose app.
+
+Every benchmark builds its own synthetic models and fundus images, so nothing here
+needs the real .h5 files. Run them from the project root, e.g.:
+
+    python -m benchmarks.eyes_model_batching
+
+benchmarks.suite runs the inference stages together, writes a JSON report and compares
+it against a stored baseline.
+"""
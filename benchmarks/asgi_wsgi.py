@@ -0,0 +1,200 @@
+"""
+Requests/second and tail latency for mixed upload and CRUD traffic, with the app served
+by uvicorn (ASGI) and by gunicorn with threads (WSGI).
+
+Uploads go to the async endpoint /diagnose/async/medical-data/ (decode, six-model
+inference, record insert); under gunicorn Django runs it through async_to_sync, under
+uvicorn natively on the event loop. CRUD traffic is the DRF viewsets: patient list,
+patient detail and patient create. Needs uvicorn and gunicorn installed; models
+are synthetic and the database is a throwaway SQLite file.
+
+    python -m benchmarks.asgi_wsgi --concurrency 4 16 --upload-ratio 0.2
+"""
+import argparse
+import http.client
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import textwrap
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from .models import STRATEGIES
+from .synthetic import synthetic_fundus, synthetic_model_dir
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVERS = {
+    "wsgi": lambda port, workers, threads: [
+        sys.executable, "-m", "gunicorn", "backend.wsgi:application", "--bind", f"127.0.0.1:{port}",
+        "--workers", str(workers), "--threads", str(threads), "--log-level", "warning"],
+    "asgi": lambda port, workers, threads: [
+        sys.executable, "-m", "uvicorn", "backend.asgi:application", "--host", "127.0.0.1", "--port", str(port),
+        "--workers", str(workers), "--log-level", "warning", "--no-access-log"],
+}
+
+
+def write_settings(directory, model_paths):
+    with open(os.path.join(directory, "bench_settings.py"), "w") as settings_file:
+        settings_file.write(textwrap.dedent(f"""
+            from backend.settings import *
+            DEBUG = False
+            ALLOWED_HOSTS = ["*"]
+            DATABASES = {{"default": {{"ENGINE": "django.db.backends.sqlite3",
+                                      "NAME": {os.path.join(directory, "db.sqlite3")!r}}}}}
+            MEDIA_ROOT = {os.path.join(directory, "media")!r}
+            DIAGNOSE_MODEL_PATHS = {model_paths!r}
+        """))
+
+
+def prepare(directory):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([directory, ROOT]), DJANGO_SETTINGS_MODULE="bench_settings")
+    subprocess.run([sys.executable, os.path.join(ROOT, "manage.py"), "migrate", "-v0"], env=env, check=True)
+    seed = ("from diagnose.models import Doctor, Patient;"
+            "Doctor.objects.create(doctor_id=1, first_name='D', last_name='D', specialty='eye', phone='0', email='d@x');"
+            "[Patient.objects.create(first_name='P', last_name=str(i), birthday='1970-01-01', gender='O', address='-',"
+            " phone='0', insurance_info='-', contact_info='-') for i in range(50)]")
+    subprocess.run([sys.executable, os.path.join(ROOT, "manage.py"), "shell", "-c", seed], env=env, check=True)
+    return env
+
+
+def multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    parts = [f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+             for name, value in fields.items()]
+    for name, (filename, data) in files.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: image/jpeg\r\n\r\n'.encode() + data + b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+class Client(threading.local):
+    def __init__(self, port):
+        self.port = port
+        self.connection = None
+
+    def request(self, method, path, body=None, headers=None):
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=120)
+            try:
+                self.connection.request(method, path, body=body, headers=headers or {})
+                response = self.connection.getresponse()
+                response.read()
+                return response.status
+            except (http.client.HTTPException, ConnectionError):
+                self.connection.close()
+                self.connection = None
+                if attempt:
+                    raise
+
+
+def wait_ready(client, timeout=300):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if client.request("GET", "/diagnose/ready/") == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError("server did not become ready")
+
+
+def fundus_jpeg(seed):
+    return cv2.imencode(".jpg", synthetic_fundus(seed=seed))[1].tobytes()
+
+
+def make_requests(count, upload_ratio, seed=0):
+    # Every upload gets fresh images so the prediction cache cannot answer it.
+    rng = random.Random(seed)
+    requests = []
+    for _ in range(count):
+        if rng.random() < upload_ratio:
+            body, content_type = multipart({"patient": rng.randint(1, 50)},
+                                           {"left_fundus": ("l.jpg", fundus_jpeg(rng.randrange(1 << 30))),
+                                            "right_fundus": ("r.jpg", fundus_jpeg(rng.randrange(1 << 30)))})
+            requests.append(("upload", "POST", "/diagnose/async/medical-data/", body, {"Content-Type": content_type}))
+        else:
+            kind = rng.choice(["list", "detail", "create"])
+            if kind == "list":
+                requests.append(("crud", "GET", "/diagnose/patients/", None, None))
+            elif kind == "detail":
+                requests.append(("crud", "GET", f"/diagnose/patients/{rng.randint(1, 50)}/", None, None))
+            else:
+                body, content_type = multipart({"first_name": "N", "last_name": "N", "birthday": "1980-01-01",
+                                                "gender": "F", "address": "-", "phone": "0",
+                                                "insurance_info": "-", "contact_info": "-"}, {})
+                requests.append(("crud", "POST", "/diagnose/patients/", body, {"Content-Type": content_type}))
+    return requests
+
+
+def load(client, requests, concurrency):
+    def timed(request):
+        kind, method, path, body, headers = request
+        start = time.perf_counter()
+        code = client.request(method, path, body, headers)
+        return kind, time.perf_counter() - start, code < 400
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(timed, requests))
+    elapsed = time.perf_counter() - start
+    rows = {}
+    for kind in ("upload", "crud"):
+        latencies = np.array([latency for k, latency, _ in results if k == kind])
+        if latencies.size:
+            rows[kind] = (np.percentile(latencies, 50), np.percentile(latencies, 95), np.percentile(latencies, 99))
+    errors = sum(1 for *_, ok in results if not ok)
+    return len(requests) / elapsed, rows, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--servers", nargs="+", choices=SERVERS, default=list(SERVERS))
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[4, 16])
+    parser.add_argument("--requests", type=int, default=200, help="requests per concurrency level")
+    parser.add_argument("--upload-ratio", type=float, default=0.2)
+    parser.add_argument("--workers", type=int, default=1, help="server worker processes")
+    parser.add_argument("--threads", type=int, default=16, help="gunicorn threads per worker")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="eye2-asgi-")
+    write_settings(directory, synthetic_model_dir(STRATEGIES, os.path.join(directory, "models")))
+    env = prepare(directory)
+
+    print(f"{'server':<7}{'conc':>5}{'req/s':>9}{'errors':>7}"
+          f"{'upload p50/p95/p99 ms':>26}{'crud p50/p95/p99 ms':>26}")
+    try:
+        for server in args.servers:
+            process = subprocess.Popen(SERVERS[server](args.port, args.workers, args.threads), cwd=ROOT, env=env)
+            try:
+                client = Client(args.port)
+                wait_ready(client)
+                load(client, make_requests(max(8, args.requests // 10), args.upload_ratio, seed=-1),
+                     max(args.concurrency))  # warm up connections, pools and TensorFlow
+                for level, concurrency in enumerate(args.concurrency):
+                    requests = make_requests(args.requests, args.upload_ratio, seed=level)
+                    throughput, rows, errors = load(client, requests, concurrency)
+                    cells = ["/".join(f"{value * 1000:.0f}" for value in rows[kind]) if kind in rows else "-"
+                             for kind in ("upload", "crud")]
+                    print(f"{server:<7}{concurrency:>5}{throughput:>9.1f}{errors:>7}{cells[0]:>26}{cells[1]:>26}")
+            finally:
+                process.terminate()
+                process.wait()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Per-model latency and memory of the TensorFlow (.h5) and ONNX Runtime (.onnx) backends
+behind the same EyesModel API. Each (model, backend) pair runs in a fresh process so
+resident memory is measured in isolation.
+
+    python -m benchmarks.backends --repeat 50
+"""
+import argparse
+import multiprocessing
+import os
+import statistics
+import time
+
+from .models import STRATEGIES
+from .synthetic import synthetic_fundus, synthetic_model_dir
+
+
+def resident_mb():
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+
+def measure(model_path, name, repeat):
+    from diagnose.classifier.classifier_component import EyesModel
+
+    left_image, right_image = synthetic_fundus(seed=1), synthetic_fundus(seed=2)
+    model = EyesModel(model_path, STRATEGIES[name])
+    baseline = resident_mb()
+    model.warmup()
+    batch = model.strategy.apply_batch([left_image, right_image])
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        model._infer(batch)
+        timings.append(time.perf_counter() - start)
+    return {"p50_ms": statistics.median(timings) * 1000, "load_s": model.load_seconds,
+            "rss_mb": resident_mb() - baseline}
+
+
+def export_onnx(paths, directory):
+    from diagnose.classifier.classifier_component import load_keras_model
+    from diagnose.classifier.onnx_backend import export_keras_to_onnx
+
+    onnx_paths = {}
+    for name, path in paths.items():
+        onnx_paths[name] = os.path.join(directory, f"{name}.onnx")
+        if not os.path.exists(onnx_paths[name]):
+            export_keras_to_onnx(load_keras_model(path), onnx_paths[name])
+    return onnx_paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--model-dir", help="Directory with <name>.h5 (and optionally <name>.onnx); synthetic by default.")
+    args = parser.parse_args()
+
+    if args.model_dir:
+        paths = {name: os.path.join(args.model_dir, f"{name}.h5") for name in STRATEGIES}
+    else:
+        paths = synthetic_model_dir(STRATEGIES)
+    directory = os.path.dirname(next(iter(paths.values())))
+    with multiprocessing.get_context("spawn").Pool(1) as exporter:
+        onnx_paths = exporter.apply(export_onnx, (paths, directory))
+
+    context = multiprocessing.get_context("spawn")
+    print(f"{'model':<14}{'backend':<10}{'p50 ms':>10}{'load s':>10}{'RSS MB':>10}")
+    for name in STRATEGIES:
+        for backend, model_path in (("tensorflow", paths[name]), ("onnx", onnx_paths[name])):
+            with context.Pool(1, maxtasksperchild=1) as pool:
+                result = pool.apply(measure, (model_path, name, args.repeat))
+            print(f"{name:<14}{backend:<10}{result['p50_ms']:>10.2f}{result['load_s']:>10.2f}{result['rss_mb']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Diagnoser.predict latency under concurrent callers: a fresh ThreadPoolExecutor per
+call (the old behaviour) against the Diagnoser's long-lived executor with per-model
+concurrency caps and TensorFlow thread pools sized to match.
+
+    python -m benchmarks.diagnoser_load --callers 1 4 16
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from diagnose.classifier.classifier_component import Diagnoser, EyesModel, configure_tensorflow_threads
+
+from .models import STRATEGIES
+from .synthetic import synthetic_fundus, synthetic_model_dir
+
+
+def predict_with_fresh_executor(diagnoser, left_image, right_image):
+    # The pre-change Diagnoser.predict: a new, default-sized executor for every exam.
+    strategies = [model.strategy for model in diagnoser.models]
+    left_inputs = diagnoser.preprocessing.run(left_image, strategies)
+    right_inputs = diagnoser.preprocessing.run(right_image, strategies)
+    with ThreadPoolExecutor() as executor:
+        return list(executor.map(lambda args: args[0].diagnose_preprocessed(args[1], args[2]),
+                                 zip(diagnoser.models, left_inputs, right_inputs)))
+
+
+def load(predict, exams, callers):
+    def timed(exam):
+        start = time.perf_counter()
+        predict(*exam)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=callers) as executor:
+        latencies = np.array(list(executor.map(timed, exams)))
+    elapsed = time.perf_counter() - start
+    return len(exams) / elapsed, np.percentile(latencies, 50), np.percentile(latencies, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--callers", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--exams", type=int, default=32, help="exams per concurrency level")
+    parser.add_argument("--max-workers", type=int, default=len(STRATEGIES))
+    parser.add_argument("--model-concurrency", type=int, default=2)
+    args = parser.parse_args()
+
+    configure_tensorflow_threads(intra_op=max(1, (os.cpu_count() or 1) // args.max_workers), inter_op=1)
+    paths = synthetic_model_dir(STRATEGIES)
+    diagnoser = Diagnoser(max_workers=args.max_workers)
+    for name, strategy in STRATEGIES.items():
+        diagnoser.add_model(EyesModel(paths[name], strategy, max_concurrency=args.model_concurrency))
+    pool = [(synthetic_fundus(seed=2 * i), synthetic_fundus(seed=2 * i + 1)) for i in range(8)]
+    exams = [pool[i % len(pool)] for i in range(args.exams)]
+
+    cases = (
+        ("executor per call", lambda left, right: predict_with_fresh_executor(diagnoser, left, right)),
+        ("long-lived executor", diagnoser.predict),
+    )
+    print(f"{'mode':<22}{'callers':>8}{'exams/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for label, predict in cases:
+        predict(*pool[0])
+        for callers in args.callers:
+            throughput, p50, p99 = load(predict, exams, callers)
+            print(f"{label:<22}{callers:>8}{throughput:>10.2f}{p50 * 1000:>10.1f}{p99 * 1000:>10.1f}")
+    diagnoser.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Exam throughput with concurrent callers: Diagnoser.predict in threads (thread mode)
+against ProcessPoolDiagnoser (process mode). Process mode only pays off with more
+than one core.
+
+    python -m benchmarks.execution_modes --callers 4 --workers 4
+"""
+import argparse
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from diagnose.classifier.classifier_component import Diagnoser, EyesModel
+from diagnose.classifier.process_pool import ProcessPoolDiagnoser
+
+from .models import STRATEGIES
+from .synthetic import synthetic_fundus, synthetic_model_dir
+
+
+def run(predict, exams, callers):
+    def timed(exam):
+        start = time.perf_counter()
+        predict(*exam)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=callers) as executor:
+        latencies = list(executor.map(timed, exams))
+    return len(exams) / (time.perf_counter() - start), statistics.median(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--exams", type=int, default=32)
+    parser.add_argument("--callers", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    paths = synthetic_model_dir(STRATEGIES)
+    diagnoser = Diagnoser()
+    for name, strategy in STRATEGIES.items():
+        diagnoser.add_model(EyesModel(paths[name], strategy))
+    # Distinct images per exam so no cache could short-circuit the models.
+    exams = [(synthetic_fundus(seed=2 * i), synthetic_fundus(seed=2 * i + 1)) for i in range(args.exams)]
+
+    pool = ProcessPoolDiagnoser(diagnoser, workers=args.workers)
+    try:
+        for label, predict in (("thread", diagnoser.predict), (f"process x{args.workers}", pool.predict)):
+            run(predict, exams[:2], 1)
+            throughput, p50 = run(predict, exams, args.callers)
+            print(f"{label:<12} {throughput:8.2f} exams/s   p50 {p50 * 1000:8.2f} ms   ({args.callers} callers)")
+    finally:
+        pool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Per-exam latency of EyesModel.diagnose: two predict() calls per model (old path)
+against one batched direct call per model (current path).
+
+    python -m benchmarks.eyes_model_batching --exams 20
+"""
+import argparse
+import statistics
+import time
+
+import numpy as np
+
+from diagnose.classifier.classifier_component import EyesModel
+
+from .models import STRATEGIES
+from .synthetic import synthetic_fundus, synthetic_model_dir
+
+
+def predict_per_eye(model, left_image, right_image):
+    # The pre-batching implementation of EyesModel.diagnose.
+    left_processed = model.strategy.apply(left_image)
+    right_processed = model.strategy.apply(right_image)
+    left_result = model.model.predict(np.expand_dims(left_processed, axis=0), verbose=0)[0]
+    right_result = model.model.predict(np.expand_dims(right_processed, axis=0), verbose=0)[0]
+    return left_result, right_result
+
+
+def measure(fn, exams, repeat):
+    fn(*exams[0])
+    timings = []
+    for _ in range(repeat):
+        for exam in exams:
+            start = time.perf_counter()
+            fn(*exam)
+            timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--exams", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--batch", type=int, default=8, help="exams per diagnose_batch call")
+    args = parser.parse_args()
+
+    paths = synthetic_model_dir(STRATEGIES)
+    models = [EyesModel(paths[name], strategy) for name, strategy in STRATEGIES.items()]
+    exams = [(synthetic_fundus(seed=2 * i), synthetic_fundus(seed=2 * i + 1)) for i in range(args.exams)]
+
+    def old_path(left, right):
+        for model in models:
+            predict_per_eye(model, left, right)
+
+    def new_path(left, right):
+        for model in models:
+            model.diagnose(left, right)
+
+    for label, fn in (("predict() x2 per model", old_path), ("batched direct call", new_path)):
+        timings = measure(fn, exams, args.repeat)
+        print(f"{label:<24} p50 {statistics.median(timings) * 1000:8.2f} ms/exam   "
+              f"mean {statistics.mean(timings) * 1000:8.2f} ms/exam")
+
+    batches = [exams[i:i + args.batch] for i in range(0, len(exams), args.batch)]
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        for batch in batches:
+            for model in models:
+                model.diagnose_batch(batch)
+    elapsed = time.perf_counter() - start
+    print(f"{'diagnose_batch(' + str(args.batch) + ')':<24} mean {elapsed / (args.repeat * len(exams)) * 1000:8.2f} ms/exam")
+
+
+if __name__ == "__main__":
+    main()
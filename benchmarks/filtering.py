@@ -0,0 +1,158 @@
+"""
+Server-side filtering and search at scale: each filtered list request of the diagnose API,
+timed with the composite indexes of migration 0005 and again with them dropped, and each
+?search= through the FTS5 index against the LIKE '%...%' scan of DRF's SearchFilter.
+
+Every table (patients, appointments, medical data, bills) is filled to --rows. Requests go
+through the real viewsets and JSON renderer in-process, with the response cache disabled.
+
+    python -m benchmarks.filtering --rows 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import textwrap
+import time
+from datetime import datetime, timedelta
+
+DOCTORS = 50
+SYLLABLES = ["an", "bel", "cor", "da", "el", "fin", "gar", "hol", "is", "jan", "kel", "lor", "mar", "nor",
+             "ol", "per", "quin", "ros", "sil", "tor", "ul", "van", "wil", "xan", "yor", "zel"]
+WORDS = ("retina cataract glaucoma pressure intraocular lens fundus macula edema drusen referral follow-up "
+         "screening bilateral vision acuity blurred diabetic hypertensive hemorrhage exudate optic disc cup "
+         "ratio myopia laser routine stable worsening improved dilated photo quality poor good repeat").split()
+STATUSES = ["paid"] * 85 + ["pending"] * 10 + ["overdue"] * 4 + ["refunded"]
+START = datetime(2021, 1, 1)
+
+
+def setup_django(directory):
+    with open(os.path.join(directory, "bench_settings.py"), "w") as settings_file:
+        settings_file.write(textwrap.dedent(f"""
+            from backend.settings import *
+            ALLOWED_HOSTS = ["*"]
+            DATABASES = {{"default": {{**DATABASES["default"], "NAME": {os.path.join(directory, "db.sqlite3")!r}}}}}
+            CACHES = {{alias: {{"BACKEND": "django.core.cache.backends.dummy.DummyCache"}} for alias in CACHES}}
+        """))
+    sys.path.insert(0, directory)
+    os.environ["DJANGO_SETTINGS_MODULE"] = "bench_settings"
+    import django
+    from django.core.management import call_command
+
+    django.setup()
+    call_command("migrate", verbosity=0)
+
+
+def name(rng):
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3))).capitalize()
+
+
+def fill(rows, rng, batch=10000):
+    from django.db import transaction
+    from django.utils import timezone
+    from diagnose.models import Doctor, Patient, Appointment, MedicalData, Diagnose, Bill
+
+    Doctor.objects.bulk_create([Doctor(first_name=name(rng), last_name=name(rng), specialty="eye", phone="0",
+                                       email=f"d{i}@example.com") for i in range(DOCTORS)])
+    doctor_ids = list(Doctor.objects.values_list("pk", flat=True))
+    span = int((datetime(2026, 1, 1) - START).total_seconds())
+    for offset in range(0, rows, batch):
+        count = min(batch, rows - offset)
+        with transaction.atomic():
+            patients = Patient.objects.bulk_create([
+                Patient(first_name=name(rng), last_name=name(rng), birthday="1970-01-01", gender="O", address="-",
+                        phone=f"06{rng.randrange(10 ** 8):08d}", insurance_info="-", contact_info="-")
+                for _ in range(count)])
+            appointments = Appointment.objects.bulk_create([
+                Appointment(patient=rng.choice(patients), doctor_id=rng.choice(doctor_ids),
+                            appointment_datetime=timezone.make_aware(START + timedelta(seconds=rng.randrange(span),
+                                                                                     microseconds=i)))
+                for i in range(count)])
+            diagnoses = Diagnose.objects.bulk_create([Diagnose(complete_diagnosis="Normal", confidence_score=0.9)
+                                                      for _ in range(count)])
+            MedicalData.objects.bulk_create([
+                MedicalData(patient_id=appointment.patient_id, doctor_id=appointment.doctor_id,
+                            appointment_date=appointment, diagnose=diagnose, left_diagnostic="Normal",
+                            right_diagnostic="Normal", medical_notes=" ".join(rng.choices(WORDS, k=rng.randint(6, 14))))
+                for appointment, diagnose in zip(appointments, diagnoses)])
+            Bill.objects.bulk_create([Bill(appointment=appointment, amount=40, payment_status=rng.choice(STATUSES),
+                                           payment_method="card") for appointment in appointments])
+        print(f"\r{offset + count} rows", end="", file=sys.stderr, flush=True)
+    print(file=sys.stderr)
+    return appointments[-1].patient
+
+
+def measure(view, factory, path, repeat):
+    def call():
+        response = view(factory.get(path))
+        response.render()
+        return response
+
+    response = call()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        call()
+    return (time.perf_counter() - start) / repeat, len(response.data["results"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    setup_django(tempfile.mkdtemp(prefix="eye2-filtering-"))
+    from django.db import connection
+    from rest_framework import filters
+    from rest_framework.test import APIRequestFactory
+    from diagnose.models import Appointment, Bill
+    from diagnose.views import PatientViewSet, AppointmentViewSet, MedicalDataViewSet, BillViewSet
+
+    class PatientLikeViewSet(PatientViewSet):
+        filter_backends = [filters.SearchFilter]
+        search_fields = ["first_name", "last_name", "phone"]
+
+    class MedicalDataLikeViewSet(MedicalDataViewSet):
+        filter_backends = [filters.SearchFilter]
+        search_fields = ["medical_notes"]
+
+    patient = fill(args.rows, random.Random(args.seed))
+    factory = APIRequestFactory()
+    views = {cls: cls.as_view({"get": "list"}) for cls in (PatientViewSet, AppointmentViewSet, MedicalDataViewSet,
+                                                           BillViewSet, PatientLikeViewSet, MedicalDataLikeViewSet)}
+    filtered = [
+        (AppointmentViewSet, "/diagnose/appointments/?doctor=7&after=2024-01-01&before=2024-02-01"),
+        (AppointmentViewSet, "/diagnose/appointments/?after=2024-05-06T10:00&before=2024-05-06T12:00"),
+        (MedicalDataViewSet, f"/diagnose/medical-data/?patient={patient.pk}"),
+        (MedicalDataViewSet, "/diagnose/medical-data/?date=2024-05-06"),
+        (BillViewSet, "/diagnose/bills/?payment_status=overdue"),
+        (BillViewSet, "/diagnose/bills/?payment_status=refunded"),
+    ]
+    searches = [
+        (PatientViewSet, PatientLikeViewSet, f"/diagnose/patients/?search={patient.last_name[:4]}"),
+        (PatientViewSet, PatientLikeViewSet, f"/diagnose/patients/?search={patient.last_name} {patient.phone}"),
+        (MedicalDataViewSet, MedicalDataLikeViewSet, "/diagnose/medical-data/?search=hemorrhage exudate"),
+    ]
+
+    print(f"{args.rows} rows per table\n")
+    print(f"{'request':<82}{'rows':>6}{'indexed ms':>12}{'scan ms':>10}")
+    timings = {}
+    for viewset, path in filtered:
+        timings[path] = measure(views[viewset], factory, path, args.repeat)
+    with connection.schema_editor() as schema_editor:
+        for model in (Appointment, Bill):
+            for index in model._meta.indexes:
+                schema_editor.remove_index(model, index)
+    for viewset, path in filtered:
+        (indexed, found), (scanned, _) = timings[path], measure(views[viewset], factory, path, args.repeat)
+        print(f"{path:<82}{found:>6}{indexed * 1000:>12.1f}{scanned * 1000:>10.1f}")
+    for viewset, like_viewset, path in searches:
+        indexed, found = measure(views[viewset], factory, path, args.repeat)
+        scanned, _ = measure(views[like_viewset], factory, path, args.repeat)
+        print(f"{path:<82}{found:>6}{indexed * 1000:>12.1f}{scanned * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
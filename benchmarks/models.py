@@ -0,0 +1,13 @@
+from diagnose.classifier.preprocessingStrategy import (
+    CataractPreprocessing, DiabetesPreprocessing, GlaucomaPreprocessing,
+    HypertensionPreprocessing, PathologicalMyopiaPreprocessing, AgeIssuesPreprocessing)
+
+# Same model names and strategies as the registry in diagnose/views.py.
+STRATEGIES = {
+    "cataract": CataractPreprocessing(),
+    "diabetes": DiabetesPreprocessing(),
+    "glaucoma": GlaucomaPreprocessing(),
+    "hypertension": HypertensionPreprocessing(),
+    "myopia": PathologicalMyopiaPreprocessing(),
+    "age": AgeIssuesPreprocessing(),
+}
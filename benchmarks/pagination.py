@@ -0,0 +1,120 @@
+"""
+Response time and memory of GET /diagnose/medical-data/ as the table grows: the old
+unpaginated list, cursor pages (first page, a page in the middle of the table, and a sparse
+?fields= page), and for contrast an offset page at the same depth.
+
+Requests go through the real viewset and JSON renderer in-process; memory is the
+tracemalloc peak of one request, with the response cache disabled. The unpaginated list is
+skipped above --unpaginated-max.
+
+    python -m benchmarks.pagination --rows 10000 100000 1000000
+"""
+import argparse
+import base64
+import os
+import sys
+import tempfile
+import textwrap
+import time
+import tracemalloc
+from urllib.parse import urlencode
+
+PATIENTS = 1000
+
+
+def setup_django(directory):
+    with open(os.path.join(directory, "bench_settings.py"), "w") as settings_file:
+        settings_file.write(textwrap.dedent(f"""
+            from backend.settings import *
+            ALLOWED_HOSTS = ["*"]
+            DATABASES = {{"default": {{"ENGINE": "django.db.backends.sqlite3",
+                                      "NAME": {os.path.join(directory, "db.sqlite3")!r}}}}}
+            CACHES = {{alias: {{"BACKEND": "django.core.cache.backends.dummy.DummyCache"}} for alias in CACHES}}
+        """))
+    sys.path.insert(0, directory)
+    os.environ["DJANGO_SETTINGS_MODULE"] = "bench_settings"
+    import django
+    from django.core.management import call_command
+
+    django.setup()
+    call_command("migrate", verbosity=0)
+
+
+def grow(total):
+    """Insert MedicalData rows until the table holds `total`."""
+    from diagnose.models import Doctor, Patient, MedicalData
+
+    doctor, _ = Doctor.objects.get_or_create(doctor_id=1, defaults=dict(
+        first_name="D", last_name="D", specialty="eye", phone="0", email="d@example.com"))
+    if not Patient.objects.exists():
+        Patient.objects.bulk_create([Patient(first_name="P", last_name=str(i), birthday="1970-01-01", gender="O",
+                                             address="-", phone="0", insurance_info="-", contact_info="-")
+                                     for i in range(PATIENTS)])
+    patient_ids = list(Patient.objects.values_list("pk", flat=True))
+    count = MedicalData.objects.count()
+    while count < total:
+        batch = min(10000, total - count)
+        MedicalData.objects.bulk_create([
+            MedicalData(patient_id=patient_ids[(count + i) % len(patient_ids)], doctor=doctor,
+                        left_diagnostic="Normal", right_diagnostic="cataract",
+                        medical_notes="Routine screening, no referral needed.")
+            for i in range(batch)])
+        count += batch
+
+
+def cursor_at(position):
+    return base64.b64encode(urlencode({"p": position}).encode()).decode()
+
+
+def measure(view, factory, path, repeat):
+    def call():
+        response = view(factory.get(path))
+        response.render()
+        return response
+
+    call()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        response = call()
+    elapsed = (time.perf_counter() - start) / repeat
+    tracemalloc.start()
+    call()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, len(response.content)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--unpaginated-max", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    setup_django(tempfile.mkdtemp(prefix="eye2-pagination-"))
+    from rest_framework.pagination import LimitOffsetPagination
+    from rest_framework.test import APIRequestFactory
+    from diagnose.views import MedicalDataViewSet
+
+    factory = APIRequestFactory()
+    paginated = MedicalDataViewSet.as_view({"get": "list"})
+    unpaginated = MedicalDataViewSet.as_view({"get": "list"}, pagination_class=None)
+    offset = MedicalDataViewSet.as_view({"get": "list"}, pagination_class=LimitOffsetPagination)
+
+    print(f"{'rows':>9}  {'request':<22}{'ms':>10}{'peak MB':>10}{'body KB':>10}")
+    for rows in sorted(args.rows):
+        grow(rows)
+        cases = [("cursor, first page", paginated, "/diagnose/medical-data/"),
+                 ("cursor, middle page", paginated, f"/diagnose/medical-data/?cursor={cursor_at(rows // 2)}"),
+                 ("cursor, ?fields=", paginated,
+                  "/diagnose/medical-data/?fields=record_id,left_diagnostic,right_diagnostic"),
+                 ("offset, middle page", offset, f"/diagnose/medical-data/?limit=50&offset={rows // 2}")]
+        if rows <= args.unpaginated_max:
+            cases.insert(0, ("unpaginated", unpaginated, "/diagnose/medical-data/"))
+        for label, view, path in cases:
+            elapsed, peak, size = measure(view, factory, path, 1 if label == "unpaginated" else args.repeat)
+            print(f"{rows:>9}  {label:<22}{elapsed * 1000:>10.1f}{peak / 2 ** 20:>10.1f}{size / 1024:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+Preprocessing throughput per strategy: apply() on each image against apply_batch()
+into a reused NHWC buffer, at several batch sizes.
+
+    python -m benchmarks.preprocessing_batch --batch-sizes 1 8 32
+"""
+import argparse
+import time
+
+import numpy as np
+
+from .models import STRATEGIES
+from .synthetic import synthetic_fundus
+
+
+def throughput(fn, images, repeat):
+    fn(images)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(images)
+    return repeat * len(images) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--height", type=int, default=1536)
+    parser.add_argument("--width", type=int, default=2048)
+    args = parser.parse_args()
+
+    pool = [synthetic_fundus(args.height, args.width, seed=seed) for seed in range(8)]
+    print(f"{'strategy':<14}{'batch':>6}{'apply img/s':>14}{'apply_batch img/s':>20}{'speedup':>9}")
+    for name, strategy in STRATEGIES.items():
+        for batch_size in args.batch_sizes:
+            images = [pool[i % len(pool)] for i in range(batch_size)]
+            out = strategy.allocate(batch_size)
+            assert np.array_equal(strategy.apply_batch(images, out), np.stack([strategy.apply(image) for image in images]))
+            looped = throughput(lambda batch: [strategy.apply(image) for image in batch], images, args.repeat)
+            batched = throughput(lambda batch: strategy.apply_batch(batch, out), images, args.repeat)
+            print(f"{name:<14}{batch_size:>6}{looped:>14.1f}{batched:>20.1f}{batched / looped:>8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Preprocessing cost per eye: the six strategies' apply() called one by one against
+one PreprocessingGraph.run() that shares resize/green-channel/Canny steps.
+
+    python -m benchmarks.preprocessing_graph --repeat 50
+"""
+import argparse
+import statistics
+import time
+
+import numpy as np
+
+from diagnose.classifier.preprocessing_graph import PreprocessingGraph
+
+from .models import STRATEGIES
+from .synthetic import synthetic_fundus
+
+
+def measure(fn, image, repeat):
+    fn(image)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(image)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--height", type=int, default=1536)
+    parser.add_argument("--width", type=int, default=2048)
+    args = parser.parse_args()
+
+    image = synthetic_fundus(args.height, args.width)
+    strategies = list(STRATEGIES.values())
+    graph = PreprocessingGraph()
+
+    separate = [strategy.apply(image) for strategy in strategies]
+    shared = graph.run(image, strategies)
+    assert all(np.array_equal(a, b) and a.dtype == b.dtype for a, b in zip(separate, shared))
+
+    cases = (
+        ("six apply() calls", lambda img: [strategy.apply(img) for strategy in strategies]),
+        ("PreprocessingGraph.run", lambda img: graph.run(img, strategies)),
+    )
+    for label, fn in cases:
+        timings = measure(fn, image, args.repeat)
+        print(f"{label:<24} p50 {statistics.median(timings) * 1000:8.2f} ms/eye   "
+              f"mean {statistics.mean(timings) * 1000:8.2f} ms/eye")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Concurrent writes against SQLite: several processes each saving MedicalData records (an
+Appointment, a Diagnose and the record, in one transaction, as an upload does) while reader
+processes page through the table, once with SQLite's defaults (rollback journal, deferred
+transactions, a new connection per request) and once with the tuned DATABASES of
+backend/settings.py (WAL, pragmas, BEGIN IMMEDIATE, persistent connections).
+
+Lock wait is the time a write transaction spends obtaining the write lock: the BEGIN IMMEDIATE
+statement, or with deferred transactions the first INSERT. Failed writes are the ones that
+gave up with "database is locked".
+
+    python -m benchmarks.sqlite_contention --writers 4 --readers 2 --seconds 10
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import textwrap
+import time
+
+PATIENTS = 100
+
+CONFIGS = {
+    "default": """
+        DATABASES = {{"default": {{"ENGINE": "django.db.backends.sqlite3", "NAME": {name!r}}}}}
+    """,
+    "tuned": """
+        DATABASES = {{"default": {{**DATABASES["default"], "NAME": {name!r}}}}}
+    """,
+}
+
+WRITE_STATEMENTS = ("BEGIN IMMEDIATE", "INSERT", "UPDATE", "DELETE")
+
+
+def setup_django(directory, config):
+    settings_path = os.path.join(directory, f"bench_{config}.py")
+    if not os.path.exists(settings_path):
+        with open(settings_path, "w") as settings_file:
+            settings_file.write("from backend.settings import *\n")
+            settings_file.write(textwrap.dedent(CONFIGS[config].format(name=os.path.join(directory, "db.sqlite3"))))
+    sys.path.insert(0, directory)
+    os.environ["DJANGO_SETTINGS_MODULE"] = f"bench_{config}"
+    import django
+
+    django.setup()
+
+
+def prepare(directory, config):
+    setup_django(directory, config)
+    from django.core.management import call_command
+    from diagnose.models import Doctor, Patient
+
+    call_command("migrate", verbosity=0)
+    Doctor.objects.create(doctor_id=1, first_name="D", last_name="D", specialty="eye", phone="0",
+                          email="d@example.com")
+    Patient.objects.bulk_create([Patient(first_name="P", last_name=str(i), birthday="1970-01-01", gender="O",
+                                         address="-", phone="0", insurance_info="-", contact_info="-")
+                                 for i in range(PATIENTS)])
+
+
+class LockProbe:
+    """Execute wrapper timing the first write statement of each transaction."""
+
+    def __init__(self):
+        self.armed = False
+        self.waits = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if not self.armed or not sql.lstrip().upper().startswith(WRITE_STATEMENTS):
+            return execute(sql, params, many, context)
+        self.armed = False
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.waits.append(time.perf_counter() - start)
+
+
+def work(directory, config, role, start, seconds, results):
+    setup_django(directory, config)
+    from django.db import OperationalError, connection
+    from diagnose.models import Patient, MedicalData
+
+    patient_ids = list(Patient.objects.values_list("pk", flat=True))
+    connection.close()
+    probe = LockProbe()
+    latencies, errors = [], 0
+    start.wait()
+    deadline = time.perf_counter() + seconds
+    with connection.execute_wrapper(probe):
+        while time.perf_counter() < deadline:
+            begin = time.perf_counter()
+            try:
+                if role == "writer":
+                    probe.armed = True
+                    MedicalData(patient_id=random.choice(patient_ids), doctor_id=1, left_diagnostic="Normal",
+                                right_diagnostic="Normal").save()
+                else:
+                    list(MedicalData.objects.order_by("-pk").values()[:50])
+            except OperationalError:
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - begin)
+            # What the request_finished signal does between requests.
+            connection.close_if_unusable_or_obsolete()
+    results.put({"role": role, "latencies": latencies, "lock_waits": probe.waits, "errors": errors})
+
+
+def percentiles(values, points=(50, 95, 99)):
+    if not values:
+        return [float("nan")] * len(points)
+    ordered = sorted(values)
+    return [ordered[min(len(ordered) - 1, int(len(ordered) * point / 100))] for point in points]
+
+
+def run(config, args):
+    context = multiprocessing.get_context("spawn")
+    directory = tempfile.mkdtemp(prefix=f"eye2-sqlite-{config}-")
+    setup = context.Process(target=prepare, args=(directory, config))
+    setup.start()
+    setup.join()
+
+    start, results = context.Event(), context.Queue()
+    roles = ["writer"] * args.writers + ["reader"] * args.readers
+    processes = [context.Process(target=work, args=(directory, config, role, start, args.seconds, results))
+                 for role in roles]
+    for process in processes:
+        process.start()
+    time.sleep(args.startup)
+    start.set()
+    reports = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    def gather(role, key):
+        return [value for report in reports if report["role"] == role for value in report[key]]
+
+    return {
+        "writes": len(gather("writer", "latencies")),
+        "write_errors": sum(report["errors"] for report in reports if report["role"] == "writer"),
+        "write_latency": percentiles(gather("writer", "latencies")),
+        "lock_wait": percentiles(gather("writer", "lock_waits")),
+        "reads": len(gather("reader", "latencies")),
+        "read_errors": sum(report["errors"] for report in reports if report["role"] == "reader"),
+        "read_latency": percentiles(gather("reader", "latencies")),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=2)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--startup", type=float, default=3, help="Seconds to let the processes import Django.")
+    parser.add_argument("--configs", nargs="+", choices=sorted(CONFIGS), default=["default", "tuned"])
+    args = parser.parse_args()
+
+    print(f"{args.writers} writers, {args.readers} readers, {args.seconds:g} s each\n")
+    print(f"{'config':<9}{'writes/s':>9}{'failed':>8}{'write p50/p95/p99 ms':>24}"
+          f"{'lock wait p50/p95/p99 ms':>28}{'reads/s':>9}{'failed':>8}{'read p99 ms':>13}")
+    for config in args.configs:
+        result = run(config, args)
+        write = "/".join(f"{value * 1000:.1f}" for value in result["write_latency"])
+        wait = "/".join(f"{value * 1000:.1f}" for value in result["lock_wait"])
+        print(f"{config:<9}{result['writes'] / args.seconds:>9.1f}{result['write_errors']:>8}{write:>24}{wait:>28}"
+              f"{result['reads'] / args.seconds:>9.1f}{result['read_errors']:>8}"
+              f"{result['read_latency'][2] * 1000:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
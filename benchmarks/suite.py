@@ -0,0 +1,273 @@
+"""
+The inference benchmark suite: one run measures every stage an exam goes through, on
+synthetic .h5 models and fundus-sized JPEGs, and writes the numbers to a JSON file that
+later runs are compared against.
+
+    decode       diagnose.ingestion.decode_bytes per JPEG size
+    preprocess   each strategy's apply() and apply_batch() per batch size, and the shared graph
+    predict      each EyesModel per exam and per batch of exams
+    end_to_end   Diagnoser.predict per concurrency level, directly and through the
+                 InferenceScheduler at each batch size
+
+Every metric records its unit and whether lower or higher is better. `compare` flags a
+metric as a regression when it is worse than the baseline by more than --threshold, and
+exits with status 1 if any is. Baselines are only meaningful from the same machine, and
+short runs (a low --repeat) are noisy.
+
+    python -m benchmarks.suite run --output baseline.json
+    python -m benchmarks.suite run --output current.json --baseline baseline.json
+    python -m benchmarks.suite compare baseline.json current.json --threshold 0.1
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import cv2
+import numpy as np
+
+from diagnose.classifier.classifier_component import (Diagnoser, EyesModel, configure_tensorflow_threads,
+                                                       import_tensorflow)
+from diagnose.classifier.preprocessing_graph import PreprocessingGraph
+from diagnose.classifier.scheduler import InferenceScheduler
+from diagnose.ingestion import decode_bytes
+
+from .models import STRATEGIES
+from .synthetic import synthetic_fundus_jpeg, synthetic_model_dir
+
+GROUPS = ("decode", "preprocess", "predict", "end_to_end")
+
+
+class Results:
+    """Metrics by name ("group/case/metric"), printed as they are recorded."""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def add(self, name, value, unit, better):
+        self.metrics[name] = {"value": float(value), "unit": unit, "better": better}
+        print(f"{name:<52}{value:>12.2f} {unit}", flush=True)
+
+    def latency(self, name, timings):
+        self.add(f"{name}/p50", statistics.median(timings) * 1000, "ms", "lower")
+
+    def throughput(self, name, count, elapsed, unit):
+        self.add(name, count / elapsed, unit, "higher")
+
+
+def timings(fn, repeat):
+    fn()
+    result = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        result.append(time.perf_counter() - start)
+    return result
+
+
+def elapsed(fn, repeat):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return time.perf_counter() - start
+
+
+def percentile(values, point):
+    return float(np.percentile(values, point)) * 1000
+
+
+# Stages
+def bench_decode(results, jpegs, args):
+    for size, data in jpegs.items():
+        results.latency(f"decode/{size}", timings(lambda: decode_bytes(data), args.repeat))
+        results.throughput(f"decode/{size}/throughput", args.repeat,
+                           elapsed(lambda: decode_bytes(data), args.repeat), "images/s")
+
+
+def bench_preprocess(results, images, args):
+    image = images[0]
+    for name, strategy in STRATEGIES.items():
+        results.latency(f"preprocess/{name}/apply", timings(lambda: strategy.apply(image), args.repeat))
+        for batch_size in args.batch_sizes:
+            batch = [images[i % len(images)] for i in range(batch_size)]
+            out = strategy.allocate(batch_size)
+            results.throughput(f"preprocess/{name}/batch{batch_size}", batch_size * args.repeat,
+                               elapsed(lambda: strategy.apply_batch(batch, out), args.repeat), "images/s")
+    graph, strategies = PreprocessingGraph(), list(STRATEGIES.values())
+    results.latency("preprocess/graph/all_strategies", timings(lambda: graph.run(image, strategies), args.repeat))
+
+
+def bench_predict(results, models, images, args):
+    exams = list(zip(images[::2], images[1::2]))
+    for name, model in models.items():
+        left, right = (model.strategy.apply(image) for image in exams[0])
+        results.latency(f"predict/{name}/exam", timings(lambda: model.diagnose_preprocessed(left, right), args.repeat))
+        for batch_size in args.batch_sizes:
+            batch = [exams[i % len(exams)] for i in range(batch_size)]
+            results.throughput(f"predict/{name}/batch{batch_size}", batch_size * args.repeat,
+                               elapsed(lambda: model.diagnose_batch(batch), args.repeat), "exams/s")
+
+
+def load(results, name, predict, exams, callers):
+    def timed(exam):
+        start = time.perf_counter()
+        predict(*exam)
+        return time.perf_counter() - start
+
+    predict(*exams[0])
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=callers) as executor:
+        latencies = list(executor.map(timed, exams))
+    results.throughput(f"{name}/throughput", len(exams), time.perf_counter() - start, "exams/s")
+    for point in (50, 95, 99):
+        results.add(f"{name}/p{point}", percentile(latencies, point), "ms", "lower")
+
+
+def bench_end_to_end(results, diagnoser, images, args):
+    pairs = list(zip(images[::2], images[1::2]))
+    exams = [pairs[i % len(pairs)] for i in range(args.exams)]
+    for callers in args.concurrency:
+        load(results, f"end_to_end/diagnoser/c{callers}", diagnoser.predict, exams, callers)
+    for batch_size in args.batch_sizes:
+        scheduler = InferenceScheduler(diagnoser, max_batch_size=batch_size, max_wait_ms=args.max_wait_ms)
+        for callers in args.concurrency:
+            load(results, f"end_to_end/scheduler_b{batch_size}/c{callers}", scheduler.predict, exams, callers)
+        scheduler.close()
+
+
+def environment(args):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    tf = import_tensorflow()
+    return {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "tensorflow": tf.__version__,
+        "tensorflow_threads": {"intra_op": tf.config.threading.get_intra_op_parallelism_threads(),
+                               "inter_op": tf.config.threading.get_inter_op_parallelism_threads()},
+        "args": {name: value for name, value in vars(args).items() if name != "command"},
+    }
+
+
+def run(args):
+    directory = args.models_dir or tempfile.mkdtemp(prefix="eye2-suite-")
+    os.makedirs(directory, exist_ok=True)
+    jpegs = {}
+    for seed, size in enumerate(args.sizes):
+        width, height = map(int, size.split("x"))
+        path = synthetic_fundus_jpeg(os.path.join(directory, f"fundus-{size}.jpg"), height, width, seed=seed)
+        with open(path, "rb") as jpeg:
+            jpegs[size] = jpeg.read()
+    # What inference gets: uploads decoded at the reduced JPEG scale, a pair per exam.
+    images = [decode_bytes(jpegs[args.sizes[0]]), decode_bytes(jpegs[args.sizes[-1]])] * 4
+
+    configure_tensorflow_threads(intra_op=max(1, (os.cpu_count() or 1) // args.max_workers), inter_op=1)
+    results = Results()
+    groups = set(args.groups)
+    if "decode" in groups:
+        bench_decode(results, jpegs, args)
+    if "preprocess" in groups:
+        bench_preprocess(results, images, args)
+    if groups & {"predict", "end_to_end"}:
+        paths = synthetic_model_dir(STRATEGIES, directory)
+        models = {name: EyesModel(paths[name], strategy, max_concurrency=args.model_concurrency)
+                  for name, strategy in STRATEGIES.items()}
+        for model in models.values():
+            model.warmup()
+        if "predict" in groups:
+            bench_predict(results, models, images, args)
+        if "end_to_end" in groups:
+            diagnoser = Diagnoser(max_workers=args.max_workers)
+            for model in models.values():
+                diagnoser.add_model(model)
+            bench_end_to_end(results, diagnoser, images, args)
+            diagnoser.shutdown()
+
+    report = {"environment": environment(args), "results": results.metrics}
+    with open(args.output, "w") as output:
+        json.dump(report, output, indent=2)
+    print(f"\nWrote {len(results.metrics)} metrics to {args.output}")
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            return compare(json.load(baseline), report, args.threshold)
+    return 0
+
+
+# Comparison
+def compare(baseline, current, threshold):
+    """Print every metric against the baseline; the number of regressions beyond `threshold`."""
+    before, after = baseline["results"], current["results"]
+    regressions = 0
+    print(f"\n{'metric':<52}{'baseline':>12}{'current':>12}{'change':>9}")
+    for name in sorted(before.keys() | after.keys()):
+        if name not in after or name not in before:
+            old = f"{before[name]['value']:.2f}" if name in before else "-"
+            new = f"{after[name]['value']:.2f}" if name in after else "-"
+            print(f"{name:<52}{old:>12}{new:>12}{'':>9}  {'new' if name not in before else 'missing'}")
+            continue
+        old, new = before[name]["value"], after[name]["value"]
+        change = (new - old) / old if old else 0.0
+        worse = change if after[name]["better"] == "lower" else -change
+        if worse > threshold:
+            regressions += 1
+            verdict = "REGRESSION"
+        else:
+            verdict = "improved" if worse < -threshold else ""
+        print(f"{name:<52}{old:>12.2f}{new:>12.2f}{change:>+9.1%}  {verdict}")
+    for label, report in (("baseline", baseline), ("current", current)):
+        info = report["environment"]
+        print(f"{label}: {info['created']} commit {info['commit']}, {info['cpu_count']} CPUs, "
+              f"TensorFlow {info['tensorflow']}")
+    print(f"{regressions} regression(s) beyond {threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the suite and write a JSON report.")
+    run_parser.add_argument("--output", default="benchmark-results.json")
+    run_parser.add_argument("--baseline", help="Report to compare the new results against.")
+    run_parser.add_argument("--threshold", type=float, default=0.1)
+    run_parser.add_argument("--groups", nargs="+", choices=GROUPS, default=list(GROUPS))
+    run_parser.add_argument("--sizes", nargs="+", default=["2048x1536", "3888x2592"], help="JPEG sizes, WxH")
+    run_parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    run_parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    run_parser.add_argument("--repeat", type=int, default=20, help="Timed repetitions per measurement.")
+    run_parser.add_argument("--exams", type=int, default=48, help="Exams per end-to-end concurrency level.")
+    run_parser.add_argument("--max-workers", type=int, default=len(STRATEGIES))
+    run_parser.add_argument("--model-concurrency", type=int, default=2)
+    run_parser.add_argument("--max-wait-ms", type=float, default=5)
+    run_parser.add_argument("--models-dir", help="Where synthetic models and JPEGs are kept (default: a temp dir).")
+
+    compare_parser = commands.add_parser("compare", help="Compare two JSON reports.")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.1)
+
+    args = parser.parse_args()
+    if args.command == "run":
+        sys.exit(run(args))
+    with open(args.baseline) as baseline, open(args.current) as current:
+        sys.exit(compare(json.load(baseline), json.load(current), args.threshold))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import os
+import tempfile
+
+import cv2
+import numpy as np
+
+
+def synthetic_fundus(height=1536, width=2048, seed=0):
+    """Return a BGR image that looks roughly like a fundus photo (dark border, bright disc, vessels)."""
+    rng = np.random.default_rng(seed)
+    image = np.zeros((height, width, 3), dtype=np.uint8)
+    center = (width // 2, height // 2)
+    radius = min(height, width) // 2 - 10
+    cv2.circle(image, center, radius, (40, 70, 160), -1)
+    disc = (center[0] + radius // 3, center[1] - radius // 8)
+    cv2.circle(image, disc, radius // 8, (150, 200, 240), -1)
+    for _ in range(12):
+        end = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        cv2.line(image, disc, end, (20, 30, 90), int(rng.integers(2, 8)))
+    noise = rng.integers(0, 20, size=image.shape, dtype=np.uint8)
+    return cv2.add(image, noise)
+
+
+def synthetic_fundus_jpeg(path, height=1536, width=2048, seed=0, quality=90):
+    cv2.imwrite(path, synthetic_fundus(height, width, seed), [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return path
+
+
+def build_synthetic_model(path, input_shape=(224, 224, 3), outputs=1, seed=0):
+    """Save a small Keras CNN shaped like the diagnose models and return its path."""
+    # Through import_tensorflow(), so thread pools set with configure_tensorflow_threads() still apply.
+    from diagnose.classifier.classifier_component import import_tensorflow
+    tf = import_tensorflow()
+
+    tf.keras.utils.set_random_seed(seed)
+    model = tf.keras.Sequential([
+        tf.keras.Input(shape=input_shape),
+        tf.keras.layers.Conv2D(8, 3, strides=2, activation="relu"),
+        tf.keras.layers.Conv2D(16, 3, strides=2, activation="relu"),
+        tf.keras.layers.Conv2D(32, 3, strides=2, activation="relu"),
+        tf.keras.layers.GlobalAveragePooling2D(),
+        tf.keras.layers.Dense(outputs, activation="sigmoid" if outputs == 1 else "softmax"),
+    ])
+    model.save(path)
+    return path
+
+
+def synthetic_model_dir(names, directory=None):
+    """Build one synthetic .h5 model per name in `directory` (a temp dir by default)."""
+    directory = directory or tempfile.mkdtemp(prefix="eye2-bench-")
+    paths = {}
+    for seed, name in enumerate(names):
+        path = os.path.join(directory, f"{name}.h5")
+        if not os.path.exists(path):
+            build_synthetic_model(path, seed=seed)
+        paths[name] = path
+    return paths
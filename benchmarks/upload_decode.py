@@ -0,0 +1,84 @@
+"""
+Time and memory per fundus decode: the old path (read the upload into bytes, full-resolution
+cv2.imdecode, then the 224x224 resize) against diagnose.ingestion (decode from the upload's
+own buffer or an mmap, at the reduced JPEG scale chosen from the SOF header).
+
+Memory is the tracemalloc peak during one decode, which counts the bytes copy and the
+decoded array (NumPy reports its allocations to tracemalloc). `mean |diff|` compares the
+224x224 result with the full-resolution path; the reduced decode averages pixels in the
+IDCT, so it differs mostly where the plain resize of a full image aliases thin vessels.
+
+    python -m benchmarks.upload_decode --sizes 2048x1536 3888x2592 --repeat 20
+"""
+import argparse
+import io
+import os
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+from django.core.files.uploadedfile import InMemoryUploadedFile, TemporaryUploadedFile
+
+from .synthetic import synthetic_fundus
+
+
+def full_decode(upload):
+    upload.seek(0)
+    data = upload.read()
+    return cv2.resize(cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR), (224, 224))
+
+
+def reduced_decode(upload):
+    from diagnose.ingestion import decode_upload
+
+    return cv2.resize(decode_upload(upload), (224, 224))
+
+
+def measure(decode, upload, repeat):
+    decode(upload)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        decode(upload)
+    elapsed = (time.perf_counter() - start) / repeat
+    tracemalloc.start()
+    decode(upload)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def uploads(data):
+    in_memory = InMemoryUploadedFile(io.BytesIO(data), "fundus", "fundus.jpg", "image/jpeg", len(data), None)
+    on_disk = TemporaryUploadedFile("fundus.jpg", "image/jpeg", len(data), None)
+    on_disk.write(data)
+    on_disk.flush()
+    return {"in-memory": in_memory, "temporary": on_disk}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", default=["2048x1536", "3888x2592", "4928x3264"])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--quality", type=int, default=92)
+    args = parser.parse_args()
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
+    import django
+    django.setup()
+
+    print(f"{'size':<11}{'upload':<11}{'path':<9}{'ms':>8}{'peak MB':>9}{'mean |diff|':>12}")
+    for size in args.sizes:
+        width, height = map(int, size.split("x"))
+        data = cv2.imencode(".jpg", synthetic_fundus(height, width), [cv2.IMWRITE_JPEG_QUALITY, args.quality])[1]
+        for kind, upload in uploads(data.tobytes()).items():
+            reference = full_decode(upload)
+            for label, decode in (("full", full_decode), ("reduced", reduced_decode)):
+                elapsed, peak = measure(decode, upload, args.repeat)
+                diff = np.abs(decode(upload).astype(np.int16) - reference).mean()
+                print(f"{size:<11}{kind:<11}{label:<9}{elapsed * 1000:>8.1f}{peak / 2 ** 20:>9.1f}{diff:>12.2f}")
+            upload.close()
+
+
+if __name__ == "__main__":
+    main()
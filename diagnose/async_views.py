@@ -0,0 +1,148 @@
+"""
+Native async endpoints for ASGI deployments (uvicorn backend.asgi:application).
+
+Under ASGI the DRF viewsets run through Django's sync bridge, one thread-sensitive
+call per request. These views stay on the event loop instead: Django's ASGI handler has
+already read the request body without blocking, multipart parsing, validation and image
+decoding run in a thread, inference goes to `predictor` on its own executor, and database
+access uses the async ORM. Uploads are validated by MedicalDataSerializer, as in the viewset.
+
+    POST /diagnose/async/medical-data/   same fields as /diagnose/medical-data/
+    POST /diagnose/async/diagnose/       left_fundus, right_fundus -> report only, nothing stored
+    GET  /diagnose/async/jobs/{id}/      job status; ?wait=<seconds> long-polls without holding a thread
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework import status
+
+from .classifier.report import DiagnosisReport
+from .ingestion import decode_upload
+from .jobs import PENDING_DIAGNOSTIC
+from .models import MedicalData, Diagnose, DiagnosisJob, default_doctor
+from .serializers import MedicalDataSerializer, DiagnosisJobSerializer
+from .views import MODEL_NAMES, predictor, use_async_jobs
+
+# predict() blocks until its batch has run, so each request waiting on inference holds one of
+# these threads; size it above DIAGNOSE_BATCH_MAX_SIZE or concurrent requests cannot share batches.
+inference_executor = ThreadPoolExecutor(max_workers=settings.DIAGNOSE_ASYNC_INFERENCE_THREADS,
+                                        thread_name_prefix="diagnose-async")
+
+
+def parse_upload(request):
+    # Touching request.POST parses the multipart body, spooling large files to disk.
+    return request.POST, request.FILES
+
+
+def decode_pair(left_fundus, right_fundus):
+    return decode_upload(left_fundus), decode_upload(right_fundus)
+
+
+def predict(left_image, right_image):
+    return DiagnosisReport(MODEL_NAMES, predictor.predict(left_image, right_image))
+
+
+async def read_fundus_pair(request):
+    """Return (data, left_fundus, right_fundus, errors) for a multipart upload."""
+    data, files = await sync_to_async(parse_upload, thread_sensitive=False)(request)
+    left_fundus, right_fundus = files.get('left_fundus'), files.get('right_fundus')
+    errors = {field: ['This field is required.'] for field, upload in
+              (('left_fundus', left_fundus), ('right_fundus', right_fundus)) if upload is None}
+    return data, left_fundus, right_fundus, errors
+
+
+def validate_record(request):
+    """MedicalDataSerializer validation of the upload, as POST /diagnose/medical-data/ runs it."""
+    data = request.POST.copy()
+    data.update(request.FILES)
+    serializer = MedicalDataSerializer(data=data, context={'request': request})
+    serializer.is_valid()
+    return serializer
+
+
+async def run_inference(left_fundus, right_fundus):
+    loop = asyncio.get_running_loop()
+    left_image, right_image = await loop.run_in_executor(inference_executor, decode_pair, left_fundus, right_fundus)
+    return await loop.run_in_executor(inference_executor, predict, left_image, right_image)
+
+
+@csrf_exempt
+@require_POST
+async def diagnose_images(request):
+    _, left_fundus, right_fundus, errors = await read_fundus_pair(request)
+    if errors:
+        return JsonResponse(errors, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        report = await run_inference(left_fundus, right_fundus)
+    except ValueError as exc:
+        return JsonResponse({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+    return JsonResponse({'left_diagnostic': report.left_diagnostic,
+                         'right_diagnostic': report.right_diagnostic,
+                         'complete_diagnosis': report.complete_diagnosis,
+                         'confidence_score': report.confidence_score,
+                         'probabilities': report.probabilities()})
+
+
+@csrf_exempt
+@require_POST
+async def medical_data_create(request):
+    _, left_fundus, right_fundus, errors = await read_fundus_pair(request)
+    serializer = await sync_to_async(validate_record)(request)
+    errors = {**serializer.errors, **errors}
+    if errors:
+        return JsonResponse(errors, status=status.HTTP_400_BAD_REQUEST)
+
+    record = MedicalData(**serializer.validated_data, doctor=await sync_to_async(default_doctor)())
+    if use_async_jobs(request):
+        record.left_diagnostic = record.right_diagnostic = PENDING_DIAGNOSTIC
+        await record.asave()
+        job = await DiagnosisJob.objects.acreate(record=record)
+        status_url = request.build_absolute_uri(reverse('async-diagnosis-job', args=[job.job_id]))
+        response = JsonResponse({'job_id': job.job_id, 'record_id': record.record_id, 'status': job.status,
+                                 'status_url': status_url}, status=status.HTTP_202_ACCEPTED)
+        response['Location'] = status_url
+        return response
+
+    try:
+        report = await run_inference(left_fundus, right_fundus)
+    except ValueError as exc:
+        return JsonResponse({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+    record.left_diagnostic, record.right_diagnostic = report.left_diagnostic, report.right_diagnostic
+    record.diagnose = await Diagnose.objects.acreate(complete_diagnosis=report.complete_diagnosis,
+                                                     confidence_score=report.confidence_score,
+                                                     diagnosis_notes=" ")
+    try:
+        await record.asave()
+    except Exception:
+        await record.diagnose.adelete()
+        raise
+    serializer = MedicalDataSerializer(record, context={'request': request})
+    return JsonResponse(serializer.data, status=status.HTTP_201_CREATED)
+
+
+async def get_job(pk):
+    # The serializer reads only the record's columns, so select_related keeps it off the database.
+    return await DiagnosisJob.objects.select_related('record').filter(pk=pk).afirst()
+
+
+@require_GET
+async def diagnosis_job_detail(request, pk):
+    try:
+        wait = float(request.GET.get('wait', 0))
+    except ValueError:
+        return JsonResponse({'wait': ['Must be a number of seconds.']}, status=status.HTTP_400_BAD_REQUEST)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + min(max(wait, 0), settings.DIAGNOSE_JOB_MAX_WAIT_SECONDS)
+    job = await get_job(pk)
+    if job is None:
+        return JsonResponse({'detail': 'No DiagnosisJob matches the given query.'}, status=status.HTTP_404_NOT_FOUND)
+    while job.status not in DiagnosisJob.FINISHED and loop.time() < deadline:
+        await asyncio.sleep(settings.DIAGNOSE_JOB_POLL_INTERVAL)
+        job = await get_job(pk)
+    return JsonResponse(DiagnosisJobSerializer(job).data)
@@ -0,0 +1,235 @@
+"""
+Bulk exam ingestion.
+
+A screening campaign uploads one zip or tar (optionally gzipped) of fundus images plus a
+manifest naming the patient and the left/right image of each exam. The manifest is a JSON
+list of objects or a CSV with a header row, with columns `patient`, `left`, `right` and
+optionally `medical_notes`. It is sent as the `manifest` form field or stored in the
+archive as manifest.json / manifest.csv (for tar archives, as the first member, since a
+tar is read as a stream).
+
+Exams are read from the archive as it is walked, decoded and diagnosed a chunk at a time
+(concurrent predict() calls, so the scheduler batches them). Each chunk's images are
+stored first, then its Appointment, Diagnose and MedicalData rows are written with
+bulk_create in one transaction; if that fails, the chunk's images are released again.
+Every exam's appointment is the time of upload, and appointments are unique per patient,
+doctor and time, so a patient listed twice in one upload gets an error for the repeat.
+ingest() yields one result dict per exam, in manifest order within each chunk.
+"""
+import csv
+import io
+import json
+import posixpath
+import tarfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils import timezone
+
+from . import derivatives, response_cache
+from .classifier.report import DiagnosisReport
+from .ingestion import decode_bytes
+from .models import Patient, Appointment, Diagnose, MedicalData
+from .storage import content_storage, release_files
+
+MANIFEST_NAMES = ('manifest.json', 'manifest.csv')
+
+UPLOAD_TO = 'fundus_images/'
+
+
+class ManifestError(ValueError):
+    pass
+
+
+def parse_manifest(text, name='manifest.json'):
+    """Return the manifest as a list of dicts with patient, left, right and medical_notes."""
+    try:
+        if name.endswith('.csv') or not text.lstrip().startswith('['):
+            rows = list(csv.DictReader(io.StringIO(text)))
+        else:
+            rows = json.loads(text)
+    except (ValueError, csv.Error) as exc:
+        raise ManifestError(f"Cannot parse {name}: {exc}")
+    entries = []
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict) or not all(row.get(key) for key in ('patient', 'left', 'right')):
+            raise ManifestError(f"Manifest entry {index} needs patient, left and right")
+        entries.append({'patient': str(row['patient']).strip(),
+                        'left': normalize(row['left']),
+                        'right': normalize(row['right']),
+                        'medical_notes': row.get('medical_notes') or None})
+    if not entries:
+        raise ManifestError("The manifest lists no exams")
+    return entries
+
+
+def normalize(member_name):
+    return posixpath.normpath(str(member_name).strip().lstrip('/'))
+
+
+def read_manifest(manifest):
+    """`manifest` is the form field: text or an uploaded file."""
+    if hasattr(manifest, 'read'):
+        return parse_manifest(manifest.read().decode('utf-8-sig'), getattr(manifest, 'name', '') or '')
+    return parse_manifest(manifest)
+
+
+def iter_zip(archive, entries):
+    with zipfile.ZipFile(archive) as zip_file:
+        names = {normalize(name): name for name in zip_file.namelist()}
+        if entries is None:
+            manifest_name = next((name for name in MANIFEST_NAMES if name in names), None)
+            if manifest_name is None:
+                raise ManifestError("No manifest field and no manifest.json/manifest.csv in the archive")
+            entries = parse_manifest(zip_file.read(names[manifest_name]).decode('utf-8-sig'), manifest_name)
+        for index, entry in enumerate(entries):
+            missing = [entry[side] for side in ('left', 'right') if entry[side] not in names]
+            if missing:
+                yield index, entry, None, None, f"Not in archive: {', '.join(missing)}"
+            else:
+                yield index, entry, zip_file.read(names[entry['left']]), zip_file.read(names[entry['right']]), None
+
+
+def iter_tar(archive, entries):
+    """Walk the tar as a stream, holding each image only until both images of its exam arrived."""
+    with tarfile.open(fileobj=archive, mode='r|*') as tar_file:
+        wanted, images, seen, pending = None, {}, set(), None
+        for member in tar_file:
+            if not member.isfile():
+                continue
+            name = normalize(member.name)
+            if entries is None:
+                if name not in MANIFEST_NAMES:
+                    raise ManifestError("No manifest field and the tar does not start with manifest.json/manifest.csv")
+                entries = parse_manifest(tar_file.extractfile(member).read().decode('utf-8-sig'), name)
+                continue
+            if wanted is None:
+                wanted, pending = {}, set(range(len(entries)))
+                for index, entry in enumerate(entries):
+                    wanted.setdefault(entry['left'], []).append(index)
+                    wanted.setdefault(entry['right'], []).append(index)
+            if name not in wanted:
+                continue
+            images[name] = tar_file.extractfile(member).read()
+            seen.add(name)
+            for index in wanted[name]:
+                entry = entries[index]
+                if index in pending and entry['left'] in images and entry['right'] in images:
+                    pending.discard(index)
+                    yield index, entry, images[entry['left']], images[entry['right']], None
+            if all(index not in pending for index in wanted[name]):
+                del images[name]
+        if entries is None:
+            raise ManifestError("Empty archive")
+        for index in sorted(pending if pending is not None else range(len(entries))):
+            entry = entries[index]
+            missing = [entry[side] for side in ('left', 'right') if entry[side] not in seen]
+            yield index, entry, None, None, f"Not in archive: {', '.join(missing)}"
+
+
+def iter_exams(archive, entries=None):
+    """Yield (index, entry, left_bytes, right_bytes, error) for every exam in the manifest."""
+    archive.seek(0)
+    is_zip = zipfile.is_zipfile(archive)
+    archive.seek(0)
+    return iter_zip(archive, entries) if is_zip else iter_tar(archive, entries)
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def result_for(index, entry, **fields):
+    return {'index': index, 'patient': entry['patient'], 'left': entry['left'], 'right': entry['right'], **fields}
+
+
+def ingest(archive, entries, predictor, names, doctor, chunk_size=32):
+    """Diagnose and store every exam in `archive`; yields per-exam result dicts, then a summary."""
+    created = failed = 0
+    now, seen_patients = timezone.now(), set()
+    with ThreadPoolExecutor(max_workers=chunk_size, thread_name_prefix="diagnose-bulk") as executor:
+        def diagnose(exam):
+            index, entry, left_data, right_data, error = exam
+            if error:
+                return exam, None, error
+            try:
+                left_image = decode_bytes(left_data, entry['left'])
+                right_image = decode_bytes(right_data, entry['right'])
+                return exam, DiagnosisReport(names, predictor.predict(left_image, right_image)), None
+            except Exception as exc:
+                return exam, None, f"{type(exc).__name__}: {exc}"
+
+        try:
+            for chunk in chunked(iter_exams(archive, entries), chunk_size):
+                diagnosed = list(executor.map(diagnose, chunk))
+                for result in store_chunk(diagnosed, doctor, now, seen_patients):
+                    created += result['status'] == 'created'
+                    failed += result['status'] == 'error'
+                    yield result
+        except (ManifestError, tarfile.TarError, zipfile.BadZipFile) as exc:
+            yield {'status': 'error', 'error': str(exc)}
+            failed += 1
+    yield {'summary': {'created': created, 'failed': failed}}
+
+
+def store_chunk(diagnosed, doctor, now, seen_patients):
+    """Store the diagnosed exams of one chunk with appointments at `now`; `seen_patients` spans the upload."""
+    patients = Patient.objects.in_bulk([entry['patient'] for (_, entry, *_), report, _ in diagnosed
+                                        if report is not None and entry['patient'].isdigit()])
+    results, rows = [], []
+    for (index, entry, left_data, right_data, _), report, error in diagnosed:
+        patient = patients.get(int(entry['patient'])) if entry['patient'].isdigit() else None
+        if error is None and patient is None:
+            error = f"Unknown patient {entry['patient']}"
+        if error is None and patient.pk in seen_patients:
+            error = f"Duplicate exam for patient {patient.pk} in this upload"
+        if error:
+            results.append(result_for(index, entry, status='error', error=error))
+        else:
+            seen_patients.add(patient.pk)
+            rows.append((index, entry, left_data, right_data, report, patient))
+    if not rows:
+        return results
+
+    # Files first: each save takes its own reference, which is dropped again if the rows are not written.
+    storage = content_storage()
+    names = []
+    try:
+        for _, entry, left_data, right_data, *_ in rows:
+            names.append(storage.save(UPLOAD_TO + posixpath.basename(entry['left']), ContentFile(left_data)))
+            names.append(storage.save(UPLOAD_TO + posixpath.basename(entry['right']), ContentFile(right_data)))
+        with transaction.atomic():
+            appointments = Appointment.objects.bulk_create([
+                Appointment(patient=patient, doctor=doctor, appointment_datetime=now) for *_, patient in rows])
+            diagnoses = Diagnose.objects.bulk_create([
+                Diagnose(complete_diagnosis=report.complete_diagnosis, confidence_score=report.confidence_score,
+                         diagnosis_notes=" ")
+                for *_, report, _ in rows])
+            records = MedicalData.objects.bulk_create([
+                MedicalData(patient=patient, doctor=doctor, appointment_date=appointment, diagnose=diagnose,
+                            left_fundus=left_name, right_fundus=right_name,
+                            left_diagnostic=report.left_diagnostic, right_diagnostic=report.right_diagnostic,
+                            medical_notes=entry['medical_notes'])
+                for (_, entry, _, _, report, patient), appointment, diagnose, left_name, right_name
+                in zip(rows, appointments, diagnoses, names[0::2], names[1::2])])
+            transaction.on_commit(lambda: derivatives.schedule(names))
+            response_cache.bump(Appointment, Diagnose, MedicalData)
+    except Exception as exc:
+        release_files(names)
+        error = f"{type(exc).__name__}: {exc}"
+        results.extend(result_for(index, entry, status='error', error=error) for index, entry, *_ in rows)
+    else:
+        results.extend(result_for(index, entry, status='created', record_id=record.record_id,
+                                  left_diagnostic=record.left_diagnostic, right_diagnostic=record.right_diagnostic,
+                                  confidence_score=float(diagnose.confidence_score))
+                       for (index, entry, *_), record, diagnose in zip(rows, records, diagnoses))
+    return sorted(results, key=lambda result: result['index'])
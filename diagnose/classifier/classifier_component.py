@@ -1,29 +1,158 @@
 #import torch \\not supported yet
-import tensorflow as tf
+import logging
 import numpy as np
+import sys
 import threading
+import time
+from contextlib import nullcontext
 from .singleton import Singleton
+from .preprocessing_graph import PreprocessingGraph
+from .prediction_cache import CacheLookup, model_fingerprint
+
+logger = logging.getLogger(__name__)
 
 # Diagnoser (Singleton)
 class Diagnoser(metaclass=Singleton):
-    def __init__(self):
+    def __init__(self, cache=None, max_workers=None, fused=False, fused_path=None):
         self.models = []
+        self.preprocessing = PreprocessingGraph()
+        self.cache = cache
+        self.max_workers = max_workers
+        self._executors = {}
+        self._executor_lock = threading.Lock()
+        # Fused mode runs all models as one compiled graph (see FusedEnsemble), built from the
+        # loaded models or read from the SavedModel at fused_path.
+        self.fused = fused or bool(fused_path)
+        self.fused_path = fused_path
+        self._fused_ensemble = None
 
     def add_model(self, model):
         self.models.append(model)
 
-    def predict(self, left_image, right_image):
+    def lookup(self, left_image, right_image):
+        return CacheLookup(self.models, self.cache, left_image, right_image)
+
+    def executor_for(self, model):
+        """The shared executor, or the model's own when it asks for dedicated threads. Both live as long as the diagnoser."""
         from concurrent.futures import ThreadPoolExecutor
-        with ThreadPoolExecutor() as executor:
-            results = list(executor.map(lambda model: model.diagnose(left_image, right_image), self.models))
-        return results
+        key = id(model) if model.dedicated_threads else None
+        with self._executor_lock:
+            executor = self._executors.get(key)
+            if executor is None:
+                if key is None:
+                    executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="diagnose")
+                else:
+                    executor = ThreadPoolExecutor(max_workers=model.dedicated_threads,
+                                                  thread_name_prefix=f"diagnose-{model.model_path}")
+                self._executors[key] = executor
+            return executor
+
+    def shutdown(self):
+        with self._executor_lock:
+            executors, self._executors = list(self._executors.values()), {}
+        for executor in executors:
+            executor.shutdown()
+
+    def fused_ensemble(self):
+        from .fused import FusedEnsemble
+        with self._executor_lock:
+            if self._fused_ensemble is None:
+                if self.fused_path:
+                    self._fused_ensemble = FusedEnsemble.load(self.fused_path, self.models)
+                else:
+                    self._fused_ensemble = FusedEnsemble.build(self.models)
+            return self._fused_ensemble
+
+    def predict(self, left_image, right_image):
+        lookup = self.lookup(left_image, right_image)
+        missing = lookup.missing
+        if not missing:
+            return lookup.results
+        # The fused graph always runs every model, so preprocess for all of them.
+        models = self.models if self.fused else missing
+        # Preprocess once for all models so shared steps (resize, green channel, ...) run once per eye.
+        strategies = [model.strategy for model in models]
+        left_inputs = self.preprocessing.run(left_image, strategies)
+        right_inputs = self.preprocessing.run(right_image, strategies)
+        if self.fused:
+            outputs = self.fused_ensemble()([np.stack(pair) for pair in zip(left_inputs, right_inputs)])
+            results = [(output[0], output[1]) for output in outputs]
+        else:
+            futures = [self.executor_for(model).submit(model.diagnose_preprocessed, left, right)
+                       for model, left, right in zip(models, left_inputs, right_inputs)]
+            results = [future.result() for future in futures]
+        for model, result in zip(models, results):
+            lookup.store(model, result)
+        return lookup.results
+
+
+# TensorFlow threading
+_tensorflow_threads = {"intra_op": None, "inter_op": None}
+_tensorflow_lock = threading.Lock()
+_tensorflow_configured = False
+
+
+def configure_tensorflow_threads(intra_op=None, inter_op=None):
+    """
+    Set TensorFlow's intra-op/inter-op thread pools. Applied when TensorFlow is first
+    imported through import_tensorflow(); TensorFlow ignores changes after its runtime starts,
+    so call this before anything imports TensorFlow (building a model included).
+    """
+    with _tensorflow_lock:
+        if _tensorflow_configured:
+            logger.warning("TensorFlow is already configured; thread pools intra_op=%s inter_op=%s not applied.",
+                           intra_op, inter_op)
+        _tensorflow_threads.update(intra_op=intra_op, inter_op=inter_op)
+
+
+def import_tensorflow():
+    global _tensorflow_configured
+    import tensorflow as tf
+    with _tensorflow_lock:
+        if not _tensorflow_configured:
+            _tensorflow_configured = True
+            try:
+                if _tensorflow_threads["intra_op"]:
+                    tf.config.threading.set_intra_op_parallelism_threads(_tensorflow_threads["intra_op"])
+                if _tensorflow_threads["inter_op"]:
+                    tf.config.threading.set_inter_op_parallelism_threads(_tensorflow_threads["inter_op"])
+            except RuntimeError as exc:
+                # Code that imported TensorFlow directly already started its runtime, which keeps its pools.
+                logger.warning("TensorFlow thread pools intra_op=%s inter_op=%s not applied (%s); "
+                               "import TensorFlow through import_tensorflow() before anything else starts it.",
+                               _tensorflow_threads["intra_op"], _tensorflow_threads["inter_op"], exc)
+    return tf
+
+
+# TensorFlow is imported on first model load, so importing this module (and every
+# manage.py command that imports the views) stays cheap.
+def load_keras_model(path):
+    tf = import_tensorflow()
+    return tf.keras.models.load_model(path)
+
+
+def load_saved_model(path):
+    tf = import_tensorflow()
+    return tf.saved_model.load(path)
+
+
+def load_tflite_model(path):
+    from .tflite import TFLiteModel
+    return TFLiteModel(path)
+
+
+def load_onnx_model(path):
+    from .onnx_backend import OnnxModel
+    return OnnxModel(path)
 
 
 # Model Loader Factory
 class ModelLoaderFactory:
     loaders = {
-        "h5": lambda path: tf.keras.models.load_model(path),
-        "pb": lambda path: tf.saved_model.load(path),
+        "h5": load_keras_model,
+        "pb": load_saved_model,
+        "tflite": load_tflite_model,
+        "onnx": load_onnx_model,
         #"pt": lambda path: torch.jit.load(path) not supported yet please install 'torch' library
     }
 
@@ -38,15 +167,65 @@ class ModelLoaderFactory:
 # Eyes Model
 class EyesModel:
     _model_cache = {}
+    _load_locks = {}
     _cache_lock = threading.Lock()
 
-    def __init__(self, model_path, strategy):
+    def __init__(self, model_path, strategy, max_concurrency=None, dedicated_threads=0):
         self.model_path = model_path
         self.strategy = strategy
-        self.model = self._load_model()
+        # Caps how many forward passes run on this model at once, whichever thread they come from.
+        self.max_concurrency = max_concurrency
+        self._slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        # When set, the Diagnoser runs this model on its own thread pool of this size.
+        self.dedicated_threads = dedicated_threads
+        self._model = None
+        self._version = None
+        self.load_seconds = None
+        self.warmup_seconds = None
+
+    @property
+    def model(self):
+        # Loaded on first use rather than at construction.
+        if self._model is None:
+            self.load()
+        return self._model
+
+    @model.setter
+    def model(self, model):
+        self._model = model
+
+    @property
+    def loaded(self):
+        return self._model is not None
+
+    @property
+    def version(self):
+        # Fingerprint of the model file, used to key cached predictions: of the file as it was loaded,
+        # or, where the model is not loaded (the process pool's parent), of the file now on disk.
+        return self._version if self._version is not None else model_fingerprint(self.model_path)
+
+    def load(self):
+        start = time.perf_counter()
+        version = model_fingerprint(self.model_path)
+        model = self._load_model()
+        if self._model is None:
+            self._model, self._version = model, version
+            self.load_seconds = time.perf_counter() - start
+        return self._model
+
+    def warmup(self):
+        """Load the model and run one dummy exam through it so graph tracing happens before real traffic."""
+        self.load()
+        start = time.perf_counter()
+        dummy = np.zeros((224, 224, 3), dtype=np.uint8)
+        self._infer(self.strategy.apply_batch([dummy, dummy]))
+        self.warmup_seconds = time.perf_counter() - start
 
     def _load_model(self):
         with EyesModel._cache_lock:
+            lock = EyesModel._load_locks.setdefault(self.model_path, threading.Lock())
+        # One lock per file: different models load concurrently, the same file loads once.
+        with lock:
             if self.model_path not in EyesModel._model_cache:
                 extension = self.model_path.split('.')[-1]
                 loader = ModelLoaderFactory.get_loader(extension)
@@ -57,12 +236,39 @@ class EyesModel:
 
 
     def diagnose(self, left_image, right_image):
-        left_processed = self.strategy.apply(left_image)
-        right_processed = self.strategy.apply(right_image)
-        left_result = self.model.predict(np.expand_dims(left_processed, axis=0))[0]
-        right_result = self.model.predict(np.expand_dims(right_processed, axis=0))[0]
+        [(left_result, right_result)] = self.diagnose_batch([(left_image, right_image)])
         return left_result, right_result
 
+    def diagnose_batch(self, exams):
+        # Both eyes of every exam go through the model in a single NHWC batch
+        # laid out as [left_0, right_0, left_1, right_1, ...].
+        batch = self.strategy.apply_batch([image for exam in exams for image in exam])
+        results = self._infer(batch)
+        return [(results[i], results[i + 1]) for i in range(0, len(results), 2)]
+
+    def diagnose_preprocessed(self, left_processed, right_processed):
+        results = self._infer(np.stack([left_processed, right_processed]))
+        return results[0], results[1]
+
+    def diagnose_preprocessed_batch(self, exams):
+        # Same [left_0, right_0, left_1, right_1, ...] layout as diagnose_batch, for inputs already preprocessed.
+        results = self._infer(np.stack([image for exam in exams for image in exam]))
+        return [(results[i], results[i + 1]) for i in range(0, len(results), 2)]
+
+    def _infer(self, batch):
+        # Call the model directly: predict() builds a new data pipeline on every call,
+        # which costs more than the forward pass itself for batches this small.
+        batch = batch.astype(np.float32, copy=False)
+        model = self.model
+        # A Keras model implies TensorFlow is already imported; adapters (e.g. TFLite) never need it.
+        is_keras = "tensorflow" in sys.modules and isinstance(model, import_tensorflow().keras.Model)
+        with self._slots or nullcontext():
+            if is_keras:
+                outputs = model(batch, training=False)
+            else:
+                outputs = model(batch)
+            return np.asarray(outputs)
+
     # Currently, EyesModel.diagnose() applies preprocessing before expanding the dimensions:
     # But some models expect normalized input, and preprocessing should match the model’s training input shape.
 
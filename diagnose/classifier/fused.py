@@ -0,0 +1,77 @@
+import numpy as np
+
+
+# Fused Ensemble
+class FusedEnsemble:
+    """
+    Several Keras models compiled into one tf.function.
+
+    One call takes every model's preprocessed batch and returns every model's output, so
+    TensorFlow schedules the models together and Python dispatch is paid once per exam
+    instead of once per model. The graph can be saved as a single SavedModel and loaded
+    back without the original .h5 files.
+    """
+
+    SIGNATURE = "serving_default"
+
+    def __init__(self, function, count, module=None):
+        self._function = function
+        self.count = count
+        self._module = module
+
+    @staticmethod
+    def model_names(models):
+        """What output i is checked against on load: the preprocessing strategy of models[i]."""
+        return [type(model.strategy).__name__ for model in models]
+
+    @classmethod
+    def build(cls, models):
+        from .classifier_component import import_tensorflow
+        tf = import_tensorflow()
+
+        keras_models = [model.model for model in models]
+        specs = [tf.TensorSpec((None, *keras_model.input_shape[1:]), tf.float32, name=f"input_{i}")
+                 for i, keras_model in enumerate(keras_models)]
+
+        @tf.function(input_signature=specs)
+        def serve(*inputs):
+            return {f"output_{i}": keras_model(batch, training=False)
+                    for i, (keras_model, batch) in enumerate(zip(keras_models, inputs))}
+
+        module = tf.Module()
+        module.keras_models = keras_models
+        module.model_names = tf.Variable(cls.model_names(models), trainable=False)
+        module.serve = serve
+        return cls(serve, len(keras_models), module)
+
+    @classmethod
+    def load(cls, path, models):
+        """
+        Load a graph saved by save(). Its outputs must be for `models`, in order; a graph
+        exported from a different model list raises ValueError.
+        """
+        from .classifier_component import import_tensorflow
+        tf = import_tensorflow()
+
+        loaded = tf.saved_model.load(path)
+        function = loaded.signatures[cls.SIGNATURE]
+        count = len(function.structured_outputs)
+        expected = cls.model_names(models)
+        if not hasattr(loaded, "model_names"):
+            raise ValueError(f"{path} does not record which models it was exported from; export it again.")
+        saved = [name.decode() for name in loaded.model_names.numpy()]
+        if count != len(expected) or saved != expected:
+            raise ValueError(f"{path} has outputs for {saved} ({count} outputs), but the diagnoser's models "
+                             f"are {expected}; export it again.")
+        return cls(lambda *inputs: function(**{f"input_{i}": batch for i, batch in enumerate(inputs)}),
+                   count, loaded)
+
+    def save(self, path):
+        from .classifier_component import import_tensorflow
+        tf = import_tensorflow()
+        tf.saved_model.save(self._module, path, signatures={self.SIGNATURE: self._module.serve})
+
+    def __call__(self, batches):
+        """One NHWC batch per model in, one array of outputs per model out."""
+        outputs = self._function(*(np.asarray(batch, dtype=np.float32) for batch in batches))
+        return [np.asarray(outputs[f"output_{i}"]) for i in range(self.count)]
@@ -0,0 +1,69 @@
+import numpy as np
+
+# Session defaults applied to every OnnxModel, see configure_onnx_runtime().
+_session_options = {"optimization_level": "all", "intra_op_threads": None, "inter_op_threads": None}
+
+OPTIMIZATION_LEVELS = {
+    "disable": "ORT_DISABLE_ALL",
+    "basic": "ORT_ENABLE_BASIC",
+    "extended": "ORT_ENABLE_EXTENDED",
+    "all": "ORT_ENABLE_ALL",
+}
+
+
+def configure_onnx_runtime(optimization_level="all", intra_op_threads=None, inter_op_threads=None):
+    """Graph optimization level ("disable", "basic", "extended", "all") and thread counts for new sessions."""
+    if optimization_level not in OPTIMIZATION_LEVELS:
+        raise ValueError(f"Unsupported ONNX Runtime optimization level: {optimization_level}")
+    _session_options.update(optimization_level=optimization_level, intra_op_threads=intra_op_threads,
+                            inter_op_threads=inter_op_threads)
+
+
+# ONNX Model
+class OnnxModel:
+    """
+    Runs an ONNX model on ONNX Runtime's CPU execution provider with the same call
+    EyesModel uses for a Keras model: a float NHWC batch in, an array of outputs out.
+    """
+
+    def __init__(self, path, optimization_level=None, intra_op_threads=None, inter_op_threads=None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        level = optimization_level or _session_options["optimization_level"]
+        options.graph_optimization_level = getattr(ort.GraphOptimizationLevel, OPTIMIZATION_LEVELS[level])
+        intra_op_threads = intra_op_threads or _session_options["intra_op_threads"]
+        inter_op_threads = inter_op_threads or _session_options["inter_op_threads"]
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        if inter_op_threads:
+            options.inter_op_num_threads = inter_op_threads
+        self.path = path
+        self.session = ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+        self._input_name = self.session.get_inputs()[0].name
+        self._output_name = self.session.get_outputs()[0].name
+
+    @property
+    def input_shape(self):
+        return tuple(dim if isinstance(dim, int) else None for dim in self.session.get_inputs()[0].shape)
+
+    def __call__(self, batch):
+        # InferenceSession.run is thread-safe, so no lock is needed here.
+        [outputs] = self.session.run([self._output_name], {self._input_name: np.asarray(batch, dtype=np.float32)})
+        return outputs
+
+
+def export_keras_to_onnx(keras_model, path, opset=None):
+    """Write a Keras model (Keras 3 or tf.keras 2) to an ONNX file with a dynamic batch dimension."""
+    # Keras 3 only exports models that have been called at least once.
+    keras_model(np.zeros((1, *keras_model.input_shape[1:]), dtype=np.float32), training=False)
+    try:
+        keras_model.export(path, format="onnx", verbose=False)
+    except TypeError:
+        # tf.keras 2 has no ONNX export of its own.
+        import tensorflow as tf
+        import tf2onnx
+
+        spec = [tf.TensorSpec((None, *keras_model.input_shape[1:]), tf.float32, name="input")]
+        tf2onnx.convert.from_keras(keras_model, input_signature=spec, opset=opset, output_path=path)
+    return path
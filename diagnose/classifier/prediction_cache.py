@@ -0,0 +1,152 @@
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def image_digest(image):
+    """SHA-256 of a decoded image's pixels, shape and dtype."""
+    image = np.ascontiguousarray(image)
+    digest = hashlib.sha256(f"{image.shape}{image.dtype}".encode())
+    digest.update(memoryview(image).cast("B"))
+    return digest.hexdigest()
+
+
+# File hashes by (path, mtime, size): asking again costs a stat() until the file is replaced.
+_fingerprints = {}
+
+
+def model_fingerprint(path, chunk_size=1 << 20):
+    """
+    Version of a model file: SHA-256 of its contents, or the newest mtime inside a SavedModel
+    directory. None when there is no such file; predictions of such models are not cached.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    if os.path.isdir(path):
+        mtimes = [os.stat(os.path.join(root, name)).st_mtime_ns
+                  for root, _, names in os.walk(path) for name in names]
+        return f"mtime-{max(mtimes, default=0)}"
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    fingerprint = _fingerprints.get(key)
+    if fingerprint is None:
+        digest = hashlib.sha256()
+        with open(path, "rb") as model_file:
+            for chunk in iter(lambda: model_file.read(chunk_size), b""):
+                digest.update(chunk)
+        fingerprint = _fingerprints[key] = digest.hexdigest()
+    return fingerprint
+
+
+# Prediction Cache
+class PredictionCache:
+    """
+    Per-eye model results keyed by (image digest, model path, model version, strategy).
+
+    A bounded in-process LRU sits in front of an optional SQLite file that survives
+    restarts; disk hits are promoted back into memory.
+    """
+
+    def __init__(self, max_entries=1024, path=None):
+        self.max_entries = max_entries
+        self.path = path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self.hits = self.misses = self.evictions = self.disk_hits = 0
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS predictions (key TEXT PRIMARY KEY, value BLOB NOT NULL)")
+            self._db.commit()
+
+    @staticmethod
+    def key(digest, model):
+        return "|".join((digest, model.model_path, model.version, type(model.strategy).__name__))
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            if self._db is not None:
+                row = self._db.execute("SELECT value FROM predictions WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    value = np.load(io.BytesIO(row[0]), allow_pickle=False)
+                    self._remember(key, value)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        value = np.asarray(value)
+        with self._lock:
+            self._remember(key, value)
+            if self._db is not None:
+                buffer = io.BytesIO()
+                np.save(buffer, value, allow_pickle=False)
+                self._db.execute("INSERT OR REPLACE INTO predictions (key, value) VALUES (?, ?)",
+                                 (key, buffer.getvalue()))
+                self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM predictions")
+                self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "disk_hits": self.disk_hits,
+            }
+
+    def _remember(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+
+class CacheLookup:
+    """Cached results for one exam: results[i] is (left, right) for diagnoser.models[i], or None on a miss."""
+
+    def __init__(self, models, cache, left_image, right_image):
+        self.models = models
+        self.cache = cache
+        self.results = [None] * len(models)
+        if cache is None:
+            return
+        self._digests = (image_digest(left_image), image_digest(right_image))
+        for i, model in enumerate(models):
+            if model.version is None:
+                continue
+            left, right = (cache.get(cache.key(digest, model)) for digest in self._digests)
+            if left is not None and right is not None:
+                self.results[i] = (left, right)
+
+    @property
+    def missing(self):
+        return [model for model, result in zip(self.models, self.results) if result is None]
+
+    def store(self, model, result):
+        self.results[self.models.index(model)] = result
+        if self.cache is not None and model.version is not None:
+            for digest, eye_result in zip(self._digests, result):
+                self.cache.put(self.cache.key(digest, model), eye_result)
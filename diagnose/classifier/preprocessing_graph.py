@@ -0,0 +1,39 @@
+# Preprocessing Graph
+class Node:
+    """
+    One step of a preprocessing pipeline.
+
+    Nodes are shared between strategies: two strategies that declare the same node
+    (e.g. the 224x224 resize) get the same intermediate array when run together.
+    Step functions must not modify their inputs in place.
+    """
+
+    def __init__(self, name, fn, *inputs):
+        self.name = name
+        self.fn = fn
+        self.inputs = inputs
+
+    def __repr__(self):
+        return f"Node({self.name!r})"
+
+
+# The decoded image every pipeline starts from.
+SOURCE = Node("source", None)
+
+
+def evaluate(node, image, cache=None):
+    """Compute `node` for `image`, reusing any intermediates already in `cache`."""
+    cache = {} if cache is None else cache
+    if node is SOURCE:
+        return image
+    if node not in cache:
+        cache[node] = node.fn(*(evaluate(dependency, image, cache) for dependency in node.inputs))
+    return cache[node]
+
+
+class PreprocessingGraph:
+    """Runs several strategies over one image, computing each shared node once."""
+
+    def run(self, image, strategies):
+        cache = {}
+        return [evaluate(strategy.output, image, cache) for strategy in strategies]
@@ -0,0 +1,219 @@
+import itertools
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import Future, wait
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+
+class WorkerCrashedError(RuntimeError):
+    pass
+
+
+class WorkerTimeoutError(WorkerCrashedError):
+    pass
+
+
+def _attach(shm, layout):
+    """NumPy views over the images packed into a shared memory block."""
+    return [np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf, offset=offset)
+            for offset, shape, dtype in layout]
+
+
+def _worker_main(specs, tasks, results):
+    from .classifier_component import EyesModel
+
+    models = [EyesModel(model_path, strategy_class()) for model_path, strategy_class in specs]
+    for model in models:
+        try:
+            model.warmup()
+        except Exception:
+            # Reported per task instead, so a missing model does not crash-loop the worker.
+            pass
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        task_id, model_index, shm_name, layout = task
+        shm = None
+        try:
+            shm = shared_memory.SharedMemory(name=shm_name)
+            left_input, right_input = _attach(shm, layout)
+            left_result, right_result = models[model_index].diagnose_preprocessed(left_input, right_input)
+            del left_input, right_input
+            results.put((task_id, (np.asarray(left_result), np.asarray(right_result)), None))
+        except Exception as exc:
+            results.put((task_id, None, f"{type(exc).__name__}: {exc}"))
+        finally:
+            if shm is not None:
+                shm.close()
+
+
+class _Worker:
+    def __init__(self, context, specs, results, index):
+        self.tasks = context.Queue()
+        self.inflight = {}
+        self.process = context.Process(target=_worker_main, args=(specs, self.tasks, results),
+                                       name=f"diagnose-worker-{index}", daemon=True)
+        self.process.start()
+
+
+# Process Pool Diagnoser
+class ProcessPoolDiagnoser:
+    """
+    Runs a Diagnoser's models in a pool of persistent worker processes.
+
+    Each worker loads its own copy of every model. An exam is preprocessed here, through the
+    diagnoser's PreprocessingGraph so shared steps run once per eye, and the models' inputs
+    are copied once into a shared memory block that the workers map instead of unpickling.
+    Each model's result comes back as a pair of small arrays. Work is split per model,
+    so one exam spreads across the pool. A worker that dies is restarted and the tasks it
+    was running fail with WorkerCrashedError. An exam not answered within `task_timeout`
+    seconds has its workers terminated and restarted, and fails with WorkerTimeoutError.
+    """
+
+    def __init__(self, diagnoser, workers=2, start_method="spawn", task_timeout=60):
+        self.diagnoser = diagnoser
+        self.workers = workers
+        self.task_timeout = task_timeout
+        self.restarts = 0
+        self._context = multiprocessing.get_context(start_method)
+        self._specs = [(model.model_path, type(model.strategy)) for model in diagnoser.models]
+        self._pool = []
+        self._task_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._results = None
+        self._collector = None
+
+    def start(self):
+        with self._lock:
+            if self._pool:
+                return
+            # Workers must share this process's resource tracker: one they started themselves would
+            # never see the parent unlink a block and would report it as leaked at exit.
+            resource_tracker.ensure_running()
+            self._results = self._context.Queue()
+            self._pool = [_Worker(self._context, self._specs, self._results, i) for i in range(self.workers)]
+            self._collector = threading.Thread(target=self._collect, name="diagnose-worker-results", daemon=True)
+            self._collector.start()
+
+    def predict(self, left_image, right_image):
+        self.start()
+        lookup = self.diagnoser.lookup(left_image, right_image)
+        missing = lookup.missing
+        if not missing:
+            return lookup.results
+        strategies = [model.strategy for model in missing]
+        left_inputs = self.diagnoser.preprocessing.run(left_image, strategies)
+        right_inputs = self.diagnoser.preprocessing.run(right_image, strategies)
+        # Per model, its left and right input.
+        inputs = [np.ascontiguousarray(image) for pair in zip(left_inputs, right_inputs) for image in pair]
+        layout, offset = [], 0
+        for image in inputs:
+            layout.append((offset, image.shape, image.dtype.str))
+            offset += image.nbytes
+        shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        futures = []
+        try:
+            for view, image in zip(_attach(shm, layout), inputs):
+                view[...] = image
+            futures = [(model, self._submit(self.diagnoser.models.index(model), shm.name, layout[2 * i:2 * i + 2]))
+                       for i, model in enumerate(missing)]
+        finally:
+            # Queued tasks still need the block, so it is unlinked only once every task is answered,
+            # or its worker is gone.
+            try:
+                _, not_done = wait([future for _, future in futures], timeout=self.task_timeout)
+                if not_done:
+                    self._terminate_workers_running(not_done)
+            finally:
+                shm.close()
+                shm.unlink()
+        error = None
+        for model, future in futures:
+            if future.exception() is None:
+                lookup.store(model, future.result())
+            elif error is None:
+                error = future.exception()
+        if error is not None:
+            raise error
+        return lookup.results
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": len(self._pool),
+                "alive": sum(worker.process.is_alive() for worker in self._pool),
+                "inflight": sum(len(worker.inflight) for worker in self._pool),
+                "restarts": self.restarts,
+            }
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, []
+        for worker in pool:
+            worker.tasks.put(None)
+        for worker in pool:
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+
+    def _submit(self, model_index, shm_name, layout):
+        future = Future()
+        task_id = next(self._task_ids)
+        with self._lock:
+            worker = min(self._pool, key=lambda candidate: len(candidate.inflight))
+            worker.inflight[task_id] = future
+            worker.tasks.put((task_id, model_index, shm_name, layout))
+        return future
+
+    def _collect(self, check_interval=0.5):
+        next_check = time.monotonic() + check_interval
+        while True:
+            with self._lock:
+                if not self._pool:
+                    return
+            if time.monotonic() >= next_check:
+                self._restart_dead_workers()
+                next_check = time.monotonic() + check_interval
+            try:
+                task_id, result, error = self._results.get(timeout=check_interval)
+            except queue.Empty:
+                continue
+            with self._lock:
+                future = next((worker.inflight.pop(task_id) for worker in self._pool
+                               if task_id in worker.inflight), None)
+            if future is None:
+                continue
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(RuntimeError(error))
+
+    def _terminate_workers_running(self, futures):
+        """Restart the workers holding `futures`; all their tasks fail with WorkerTimeoutError."""
+        with self._lock:
+            for i, worker in enumerate(self._pool):
+                if not any(future in futures for future in worker.inflight.values()):
+                    continue
+                worker.process.terminate()
+                worker.process.join(timeout=5)
+                for future in worker.inflight.values():
+                    future.set_exception(WorkerTimeoutError(
+                        f"{worker.process.name} did not answer within {self.task_timeout} s; restarted it"))
+                self._pool[i] = _Worker(self._context, self._specs, self._results, i)
+                self.restarts += 1
+
+    def _restart_dead_workers(self):
+        with self._lock:
+            for i, worker in enumerate(self._pool):
+                if worker.process.is_alive():
+                    continue
+                for future in worker.inflight.values():
+                    future.set_exception(WorkerCrashedError(
+                        f"{worker.process.name} exited with code {worker.process.exitcode}"))
+                self._pool[i] = _Worker(self._context, self._specs, self._results, i)
+                self.restarts += 1
@@ -0,0 +1,66 @@
+import threading
+import time
+
+
+# Model Registry
+class ModelRegistry:
+    """
+    Named EyesModels that load lazily on first use.
+
+    warmup() loads every model ahead of time and runs one dummy inference through it,
+    optionally in a background thread so the web worker can serve other endpoints meanwhile.
+    status() reports per-model load and warmup times for the readiness endpoint.
+    """
+
+    def __init__(self):
+        self._models = {}
+        self._errors = {}
+        self._warmup_thread = None
+        self.warmup_started_at = None
+
+    def register(self, name, model):
+        self._models[name] = model
+        return model
+
+    def __getitem__(self, name):
+        return self._models[name]
+
+    def __iter__(self):
+        return iter(self._models.values())
+
+    def items(self):
+        return self._models.items()
+
+    def warmup(self, background=True):
+        if self._warmup_thread is not None:
+            return self._warmup_thread
+        self.warmup_started_at = time.time()
+        self._warmup_thread = threading.Thread(target=self._warmup_all, name="model-warmup", daemon=True)
+        self._warmup_thread.start()
+        if not background:
+            self._warmup_thread.join()
+        return self._warmup_thread
+
+    @property
+    def ready(self):
+        return all(model.warmup_seconds is not None for model in self._models.values())
+
+    def status(self):
+        return {
+            name: {
+                "model_path": model.model_path,
+                "loaded": model.loaded,
+                "warmed_up": model.warmup_seconds is not None,
+                "load_seconds": model.load_seconds,
+                "warmup_seconds": model.warmup_seconds,
+                "error": self._errors.get(name),
+            }
+            for name, model in self._models.items()
+        }
+
+    def _warmup_all(self):
+        for name, model in self._models.items():
+            try:
+                model.warmup()
+            except Exception as exc:
+                self._errors[name] = f"{type(exc).__name__}: {exc}"
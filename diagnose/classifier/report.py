@@ -0,0 +1,49 @@
+import numpy as np
+
+NORMAL = "Normal"
+
+
+def disease_probability(output):
+    """
+    Probability of disease from one model's output for one eye: the value of a single
+    sigmoid unit, or 1 - P(class 0) for softmax outputs whose class 0 is "healthy".
+    """
+    output = np.ravel(output)
+    return float(output[0]) if output.size == 1 else float(1.0 - output[0])
+
+
+# Diagnosis Report
+class DiagnosisReport:
+    """Turns Diagnoser.predict() results into the text and score stored on MedicalData and Diagnose."""
+
+    def __init__(self, names, results, threshold=0.5):
+        self.threshold = threshold
+        self.left = {name: disease_probability(left) for name, (left, _) in zip(names, results)}
+        self.right = {name: disease_probability(right) for name, (_, right) in zip(names, results)}
+
+    def _findings(self, probabilities):
+        found = [name for name, probability in probabilities.items() if probability >= self.threshold]
+        return ", ".join(found) if found else NORMAL
+
+    @property
+    def left_diagnostic(self):
+        return self._findings(self.left)[:255]
+
+    @property
+    def right_diagnostic(self):
+        return self._findings(self.right)[:255]
+
+    @property
+    def complete_diagnosis(self):
+        return f"Left eye: {self._findings(self.left)}. Right eye: {self._findings(self.right)}."
+
+    @property
+    def confidence_score(self):
+        # How far, on average, each model is from undecided (0.5 -> 0.0 confidence, 0/1 -> 1.0).
+        probabilities = list(self.left.values()) + list(self.right.values())
+        if not probabilities:
+            return 0.0
+        return round(float(np.mean([abs(p - 0.5) * 2 for p in probabilities])), 2)
+
+    def probabilities(self):
+        return {"left": self.left, "right": self.right}
@@ -0,0 +1,174 @@
+import queue
+import statistics
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+
+
+# Inference Scheduler
+class InferenceScheduler:
+    """
+    Dynamic micro-batching in front of a Diagnoser.
+
+    Each predict() call preprocesses its exam through the diagnoser's PreprocessingGraph, so
+    steps shared between strategies (the resize, ...) run once per eye, then queues the inputs
+    in one queue per model. A queue is flushed as a single EyesModel.diagnose_preprocessed_batch()
+    call once it holds max_batch_size exams or its oldest exam has waited max_wait_ms, and every
+    caller gets back only its own results.
+
+    Batches run on the diagnoser's executors (executor_for(): the shared pool, or the model's
+    dedicated one), at most model.max_concurrency at a time per model; while a model is busy its
+    queue keeps filling, so the next batch is larger.
+    """
+
+    def __init__(self, diagnoser, max_batch_size=8, max_wait_ms=5):
+        self.diagnoser = diagnoser
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def predict(self, left_image, right_image):
+        lookup = self.diagnoser.lookup(left_image, right_image)
+        missing = lookup.missing
+        strategies = [model.strategy for model in missing]
+        left_inputs = self.diagnoser.preprocessing.run(left_image, strategies)
+        right_inputs = self.diagnoser.preprocessing.run(right_image, strategies)
+        futures = [(model, self._queue_for(model).submit(left, right))
+                   for model, left, right in zip(missing, left_inputs, right_inputs)]
+        for model, future in futures:
+            lookup.store(model, future.result())
+        return lookup.results
+
+    def stats(self):
+        with self._lock:
+            queues = list(self._queues.values())
+        return {model_queue.name: model_queue.stats() for model_queue in queues}
+
+    def close(self):
+        with self._lock:
+            queues, self._queues = list(self._queues.values()), {}
+        for model_queue in queues:
+            model_queue.close()
+
+    def _queue_for(self, model):
+        with self._lock:
+            model_queue = self._queues.get(id(model))
+            if model_queue is None:
+                model_queue = _ModelQueue(model, self.diagnoser.executor_for(model), self.max_batch_size,
+                                          self.max_wait)
+                self._queues[id(model)] = model_queue
+            return model_queue
+
+
+class _Request:
+    __slots__ = ("left_input", "right_input", "future", "enqueued_at")
+
+    def __init__(self, left_input, right_input):
+        self.left_input = left_input
+        self.right_input = right_input
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class _ModelQueue:
+    FLUSH_FULL = "max_batch_size"
+    FLUSH_TIMEOUT = "max_wait"
+    FLUSH_SHUTDOWN = "shutdown"
+
+    def __init__(self, model, executor, max_batch_size, max_wait, history=1000):
+        self.model = model
+        self.name = model.model_path
+        self.executor = executor
+        self.concurrency = model.max_concurrency or 1
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = deque(maxlen=history)
+        self._queue_waits = deque(maxlen=history)
+        self._flush_reasons = Counter()
+        self._batches = 0
+        self._requests = 0
+        self._thread = threading.Thread(target=self._run, name=f"scheduler-{self.name}", daemon=True)
+        self._thread.start()
+
+    def submit(self, left_input, right_input):
+        request = _Request(left_input, right_input)
+        self._queue.put(request)
+        return request.future
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        # Wait for the batches still running on the executor.
+        for _ in range(self.concurrency):
+            self._slots.acquire()
+
+    def stats(self):
+        with self._stats_lock:
+            sizes = list(self._batch_sizes)
+            waits = sorted(self._queue_waits)
+            return {
+                "batches": self._batches,
+                "requests": self._requests,
+                "mean_batch_size": statistics.mean(sizes) if sizes else 0.0,
+                "max_batch_size": max(sizes, default=0),
+                "queue_wait_ms_p50": waits[len(waits) // 2] * 1000 if waits else 0.0,
+                "queue_wait_ms_max": waits[-1] * 1000 if waits else 0.0,
+                "flush_reasons": dict(self._flush_reasons),
+            }
+
+    def _run(self):
+        running = True
+        while running:
+            first = self._queue.get()
+            if first is None:
+                break
+            # Wait for a free slot before gathering, so requests arriving meanwhile join this batch.
+            self._slots.acquire()
+            batch = [first]
+            deadline = first.enqueued_at + self.max_wait
+            reason = self.FLUSH_FULL
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    reason = self.FLUSH_TIMEOUT
+                    break
+                if request is None:
+                    reason, running = self.FLUSH_SHUTDOWN, False
+                    break
+                batch.append(request)
+            try:
+                self.executor.submit(self._flush, batch, reason)
+            except RuntimeError:
+                # The executor was shut down; run the batch here rather than strand its callers.
+                self._flush(batch, reason)
+
+    def _flush(self, batch, reason):
+        try:
+            self._run_batch(batch, reason)
+        finally:
+            self._slots.release()
+
+    def _run_batch(self, batch, reason):
+        started_at = time.monotonic()
+        with self._stats_lock:
+            self._batches += 1
+            self._requests += len(batch)
+            self._batch_sizes.append(len(batch))
+            self._queue_waits.extend(started_at - request.enqueued_at for request in batch)
+            self._flush_reasons[reason] += 1
+        try:
+            results = self.model.diagnose_preprocessed_batch([(request.left_input, request.right_input)
+                                                              for request in batch])
+        except Exception as exc:
+            for request in batch:
+                request.future.set_exception(exc)
+            return
+        for request, result in zip(batch, results):
+            request.future.set_result(result)
@@ -0,0 +1,65 @@
+import threading
+
+import numpy as np
+
+
+def _interpreter_class():
+    # The standalone runtimes are much lighter than full TensorFlow; fall back to tf.lite.
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            from .classifier_component import import_tensorflow
+            Interpreter = import_tensorflow().lite.Interpreter
+    return Interpreter
+
+
+def _quantize(values, details):
+    scale, zero_point = details["quantization"]
+    if not scale:
+        return values.astype(details["dtype"])
+    info = np.iinfo(details["dtype"])
+    return np.clip(np.round(values / scale + zero_point), info.min, info.max).astype(details["dtype"])
+
+
+def _dequantize(values, details):
+    scale, zero_point = details["quantization"]
+    if not scale:
+        return values
+    return (values.astype(np.float32) - zero_point) * scale
+
+
+# TFLite Model
+class TFLiteModel:
+    """
+    Drives a TFLite interpreter with the same call EyesModel uses for a Keras model:
+    a float NHWC batch in, a float array of outputs out. Quantized (int8/uint8) inputs
+    and outputs are converted with the scale/zero point stored in the model.
+    """
+
+    def __init__(self, path, num_threads=None):
+        self.path = path
+        self.interpreter = _interpreter_class()(model_path=path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        # An interpreter holds one set of tensors, so calls are serialized.
+        self._lock = threading.Lock()
+
+    @property
+    def input_shape(self):
+        return (None, *self._input["shape"][1:])
+
+    def __call__(self, batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        with self._lock:
+            if tuple(self._input["shape"]) != batch.shape:
+                self.interpreter.resize_tensor_input(self._input["index"], batch.shape)
+                self.interpreter.allocate_tensors()
+                self._input = self.interpreter.get_input_details()[0]
+                self._output = self.interpreter.get_output_details()[0]
+            self.interpreter.set_tensor(self._input["index"], _quantize(batch, self._input))
+            self.interpreter.invoke()
+            return _dequantize(self.interpreter.get_tensor(self._output["index"]), self._output)
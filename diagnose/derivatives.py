@@ -0,0 +1,118 @@
+"""
+Derived versions of stored fundus images and patient photos.
+
+Every original in content-addressed storage gets, next to it:
+
+    <hash>.thumbnail.jpg   longest side DIAGNOSE_THUMBNAIL_SIZE, for grids
+    <hash>.preview.jpg     longest side DIAGNOSE_PREVIEW_SIZE, for detail views
+    <hash>.224.png         the 224x224 model input, lossless, reused for inference
+                           (fundus images only; patient photos never go through a model)
+
+They are generated on a background thread after the saving transaction commits. Files
+stored before that get theirs from `manage.py generate_derivatives`; until then
+serializers list them as null and inference decodes the original. Reads never schedule
+generation, so a command that reads many old records does not queue work for each.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from django.conf import settings
+
+from . import response_cache
+from .classifier.preprocessingStrategy import INPUT_SIZE
+from .ingestion import decode_bytes, jpeg_size
+from .models import Patient, MedicalData
+from .storage import content_storage
+
+THUMBNAIL = 'thumbnail.jpg'
+PREVIEW = 'preview.jpg'
+MODEL_INPUT = '224.png'
+
+DERIVATIVES = (THUMBNAIL, PREVIEW, MODEL_INPUT)
+PHOTO_DERIVATIVES = (THUMBNAIL, PREVIEW)
+
+_executor = None
+_scheduled = set()
+_lock = threading.Lock()
+
+
+def fit(size, longest_side):
+    width, height = size
+    scale = min(1.0, longest_side / max(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def encode_jpeg(image, size):
+    resized = cv2.resize(image, size, interpolation=cv2.INTER_AREA) if image.shape[1::-1] != size else image
+    return cv2.imencode('.jpg', resized, [cv2.IMWRITE_JPEG_QUALITY, settings.DIAGNOSE_DERIVATIVE_JPEG_QUALITY])[1]
+
+
+def generate(name, suffixes=DERIVATIVES):
+    """Write whichever of the derivatives `suffixes` of stored file `name` are missing."""
+    storage = content_storage()
+    missing = [suffix for suffix in suffixes if not storage.exists(storage.derived_name(name, suffix))]
+    if not missing or not storage.exists(name):
+        return
+    with storage.open(name, 'rb') as original:
+        data = original.read()
+
+    if MODEL_INPUT in missing:
+        # Exactly what inference computes from the original: reduced decode, then the 224 resize.
+        model_input = cv2.resize(decode_bytes(data, name), INPUT_SIZE)
+        storage.save_derived(name, MODEL_INPUT, cv2.imencode('.png', model_input)[1].tobytes())
+
+    previews = [suffix for suffix in (THUMBNAIL, PREVIEW) if suffix in missing]
+    if previews:
+        header_size = jpeg_size(data)
+        preview_size = fit(header_size, settings.DIAGNOSE_PREVIEW_SIZE) if header_size else INPUT_SIZE
+        image = decode_bytes(data, name, target=preview_size)
+        size = image.shape[1::-1]
+        for suffix in previews:
+            longest = settings.DIAGNOSE_THUMBNAIL_SIZE if suffix == THUMBNAIL else settings.DIAGNOSE_PREVIEW_SIZE
+            storage.save_derived(name, suffix, encode_jpeg(image, fit(size, longest)).tobytes())
+        # Cached responses list these URLs as null until now.
+        response_cache.bump(Patient, MedicalData)
+
+
+def _generate(name, suffixes):
+    try:
+        generate(name, suffixes)
+    finally:
+        with _lock:
+            _scheduled.discard(name)
+
+
+def schedule(names, suffixes=DERIVATIVES):
+    """Generate derivatives for `names` in the background; names already queued are skipped."""
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.DIAGNOSE_DERIVATIVE_WORKERS,
+                                           thread_name_prefix="derivatives")
+        for name in names:
+            if name and name not in _scheduled:
+                _scheduled.add(name)
+                _executor.submit(_generate, name, suffixes)
+
+
+def derived_url(field_file, suffix):
+    """URL of a derivative of `field_file`, or None while it is missing."""
+    if not field_file:
+        return None
+    storage = content_storage()
+    derived = storage.derived_name(field_file.name, suffix)
+    return storage.url(derived) if storage.exists(derived) else None
+
+
+def model_input(field_file):
+    """The stored 224x224 model input for `field_file`, or None if it is not there (yet)."""
+    storage = content_storage()
+    derived = storage.derived_name(field_file.name, MODEL_INPUT)
+    try:
+        with storage.open(derived, 'rb') as derived_file:
+            data = derived_file.read()
+    except FileNotFoundError:
+        return None
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
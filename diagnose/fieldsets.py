@@ -0,0 +1,67 @@
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework.exceptions import ValidationError
+from rest_framework.serializers import ListSerializer
+
+
+def model_columns(serializer, names):
+    """
+    Model fields needed to render serializer fields `names`, or None when that cannot be
+    known (a field computed from the whole object without a declared dependency).
+    Serializers declare such dependencies in Meta.sparse_field_sources, e.g. {'age': ['birthday']}.
+    """
+    model = serializer.Meta.model
+    declared = getattr(serializer.Meta, 'sparse_field_sources', {})
+    columns = {model._meta.pk.name}
+    for name in names:
+        if name in declared:
+            columns.update(declared[name])
+            continue
+        source = serializer.fields[name].source
+        if source == '*':
+            return None
+        try:
+            field = model._meta.get_field(source.split('.')[0])
+        except FieldDoesNotExist:
+            return None
+        if not field.concrete:
+            return None
+        columns.add(field.name)
+    return sorted(columns)
+
+
+# Sparse Fieldsets
+class SparseFieldsetMixin:
+    """
+    `GET ...?fields=a,b` renders only serializer fields a and b, and loads only the columns
+    they need with .only(). Unknown names are a 400.
+    """
+
+    def requested_fields(self):
+        if not hasattr(self, '_requested_fields'):
+            self._requested_fields = None
+            value = self.request.query_params.get('fields') if self.request.method == 'GET' else None
+            if value is not None:
+                names = [name.strip() for name in value.split(',') if name.strip()]
+                unknown = [name for name in names if name not in self.get_serializer_class()().fields]
+                if unknown:
+                    raise ValidationError({'fields': [f"Unknown field(s): {', '.join(unknown)}"]})
+                self._requested_fields = names
+        return self._requested_fields
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        names = self.requested_fields()
+        if names:
+            columns = model_columns(self.get_serializer_class()(), names)
+            if columns is not None:
+                queryset = queryset.only(*columns)
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        names = self.requested_fields()
+        if names:
+            target = serializer.child if isinstance(serializer, ListSerializer) else serializer
+            for name in set(target.fields) - set(names):
+                target.fields.pop(name)
+        return serializer
@@ -0,0 +1,101 @@
+from datetime import datetime, time, timedelta
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError as DjangoValidationError
+from django.db import models
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+
+def resolve(model, lookup):
+    """The model field `lookup` ends on, and the lookup/transform names after it."""
+    parts = lookup.split(LOOKUP_SEP)
+    field = None
+    while parts:
+        try:
+            field = model._meta.get_field(parts[0])
+        except FieldDoesNotExist:
+            break
+        parts.pop(0)
+        if field.is_relation and parts:
+            model = field.related_model
+    return field, parts
+
+
+def parse_moment(value):
+    """An aware datetime from an ISO datetime, or from a date (its midnight) in the current time zone."""
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise DjangoValidationError(f"'{value}' is not a date or datetime.")
+        moment = datetime.combine(day, time.min)
+    return timezone.make_aware(moment) if timezone.is_naive(moment) else moment
+
+
+# Query Parameter Filters
+class QueryParamFilterBackend(BaseFilterBackend):
+    """
+    Filters on the query parameters a view maps to lookups in `filter_params`, e.g.
+    {'doctor': 'doctor', 'after': 'appointment_datetime__gte'}. Values are parsed by the field
+    the lookup ends on; one that does not parse is a 400.
+
+    A `__date` lookup on a DateTimeField becomes a [midnight, next midnight) range: `__date`
+    compiles to a function of the column, which no index can serve.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        for param, lookup in getattr(view, 'filter_params', {}).items():
+            value = request.query_params.get(param)
+            if value in (None, ''):
+                continue
+            try:
+                queryset = queryset.filter(**self.lookups(queryset.model, lookup, value))
+            except (DjangoValidationError, ValueError, TypeError) as exc:
+                messages = exc.messages if isinstance(exc, DjangoValidationError) else [str(exc)]
+                raise ValidationError({param: messages})
+        return queryset
+
+    def lookups(self, model, lookup, value):
+        field, transforms = resolve(model, lookup)
+        if isinstance(field, models.DateTimeField):
+            moment = parse_moment(value)
+            if transforms == ['date']:
+                column = lookup[:-len(LOOKUP_SEP + 'date')]
+                start = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+                return {f'{column}__gte': start, f'{column}__lt': start + timedelta(days=1)}
+            return {lookup: moment}
+        if field.is_relation:
+            field = field.target_field
+        return {lookup: field.to_python(value)}
+
+
+def match_expression(text):
+    """
+    An FTS5 query matching rows that contain every word of `text` as a token prefix, with
+    FTS5 syntax in `text` taken literally: "smi 0612" becomes '"smi"* "0612"*'.
+    """
+    terms = [term.replace('"', '""') for term in text.split()]
+    return ' '.join(f'"{term}"*' for term in terms if any(char.isalnum() for char in term))
+
+
+# Full-Text Search
+class FullTextSearchFilter(BaseFilterBackend):
+    """
+    `?search=` through the view's SQLite FTS5 table `search_index`, an external-content index
+    over the model's table whose rowids are its primary keys (see migration 0005).
+    """
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        index = getattr(view, 'search_index', None)
+        text = request.query_params.get(self.search_param, '')
+        if index is None or not text.strip():
+            return queryset
+        expression = match_expression(text)
+        if not expression:
+            return queryset.none()
+        return queryset.filter(pk__in=RawSQL(f'SELECT rowid FROM {index} WHERE {index} MATCH %s', [expression]))
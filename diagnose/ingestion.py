@@ -0,0 +1,109 @@
+"""
+Image decoding for uploads and stored fundus photos.
+
+The models only see 224x224 inputs, so a 3000+ px photo does not need to be decoded at
+full resolution. For JPEGs the size is read from the SOF header and libjpeg is asked for a
+1/2, 1/4 or 1/8 scale decode (IMREAD_REDUCED_COLOR_*): the smallest that still covers the
+model input on both sides. The encoded bytes are never copied: in-memory uploads are
+decoded from their BytesIO buffer and uploads spooled to disk, or stored files, from an mmap.
+Stored files that already have a 224x224 derivative (see derivatives.py) are read from it.
+"""
+import io
+import mmap
+import struct
+
+import cv2
+import numpy as np
+
+from .classifier.preprocessingStrategy import INPUT_SIZE
+
+REDUCED_FLAGS = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2,
+                 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+# Start-of-frame markers carry the image size; C4 (DHT), C8 (JPG) and CC (DAC) share the range but do not.
+SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def jpeg_size(buffer):
+    """(width, height) from a JPEG's SOF segment, or None if `buffer` is not a JPEG we can read."""
+    view = memoryview(buffer)
+    if len(view) < 4 or view[0] != 0xFF or view[1] != 0xD8:
+        return None
+    offset = 2
+    while offset + 9 <= len(view):
+        if view[offset] != 0xFF:
+            return None
+        marker = view[offset + 1]
+        if marker == 0xFF:  # fill byte
+            offset += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:  # markers without a length
+            offset += 2
+            continue
+        if marker == 0xDA:  # start of scan: no SOF seen
+            return None
+        length = struct.unpack_from(">H", view, offset + 2)[0]
+        if marker in SOF_MARKERS:
+            height, width = struct.unpack_from(">HH", view, offset + 5)
+            return width, height
+        offset += 2 + length
+    return None
+
+
+def reduction_for(size, target=INPUT_SIZE):
+    """Largest 1/2^n scale whose decoded image is still at least `target` on both sides."""
+    if size is None:
+        return 1
+    width, height = size
+    for factor in (8, 4, 2):
+        # libjpeg rounds scaled dimensions up.
+        if -(-width // factor) >= target[0] and -(-height // factor) >= target[1]:
+            return factor
+    return 1
+
+
+def decode_bytes(buffer, name=None, target=INPUT_SIZE):
+    """Decode any buffer (bytes, bytearray, memoryview, mmap) without copying it."""
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    image = cv2.imdecode(data, REDUCED_FLAGS[reduction_for(jpeg_size(buffer), target)])
+    # A raised error's traceback keeps this frame alive; drop the array so an mmap'd buffer can still close.
+    del data
+    if image is None:
+        raise ValueError(f"Cannot decode image {name or ''}".strip())
+    return image
+
+
+def decode_file(file, name=None, target=INPUT_SIZE):
+    """Decode an open file: BytesIO-backed files through their buffer, real files through an mmap."""
+    if isinstance(file, io.BytesIO):
+        return decode_bytes(file.getbuffer(), name, target)
+    try:
+        fileno = file.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        file.seek(0)
+        data = file.read()
+        file.seek(0)
+        return decode_bytes(data, name, target)
+    with mmap.mmap(fileno, 0, access=mmap.ACCESS_READ) as mapped:
+        view = memoryview(mapped)
+        try:
+            return decode_bytes(view, name, target)
+        finally:
+            view.release()
+
+
+def decode_upload(upload, target=INPUT_SIZE):
+    """Decode an InMemoryUploadedFile or TemporaryUploadedFile in place; it can still be saved afterwards."""
+    return decode_file(upload.file, upload.name, target)
+
+
+def decode_image(field_file, target=INPUT_SIZE):
+    """Decode a stored ImageField file, from its precomputed 224x224 derivative when there is one."""
+    from .derivatives import model_input
+
+    if target == INPUT_SIZE:
+        image = model_input(field_file)
+        if image is not None:
+            return image
+    with field_file.open('rb') as image_file:
+        return decode_file(getattr(image_file, 'file', image_file), field_file.name, target)
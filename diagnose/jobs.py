@@ -0,0 +1,80 @@
+"""
+DB-backed diagnosis job queue.
+
+Uploads in async mode store the images, create the MedicalData row with pending
+diagnostics and enqueue a DiagnosisJob. `manage.py run_diagnosis_worker` claims jobs
+one at a time, runs the record's images through the diagnoser and fills in the
+record's diagnostics and its Diagnose row.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import response_cache
+from .classifier.report import DiagnosisReport
+from .ingestion import decode_image
+from .models import Diagnose, DiagnosisJob
+
+PENDING_DIAGNOSTIC = 'Pending'
+
+
+def enqueue(record):
+    return DiagnosisJob.objects.create(record=record)
+
+
+def claim_next_job():
+    """Atomically move the oldest pending job to running; None when the queue is empty."""
+    while True:
+        job = DiagnosisJob.objects.filter(status=DiagnosisJob.PENDING).order_by('created_at', 'job_id').first()
+        if job is None:
+            return None
+        # Conditional update instead of SELECT ... FOR UPDATE, which SQLite does not have.
+        claimed = DiagnosisJob.objects.filter(pk=job.pk, status=DiagnosisJob.PENDING).update(
+            status=DiagnosisJob.RUNNING, started_at=timezone.now(), attempts=F('attempts') + 1)
+        if claimed:
+            job.refresh_from_db()
+            return job
+
+
+def requeue_stale_jobs(older_than):
+    """
+    Return jobs left running by a worker that died to the queue, except those already claimed
+    DIAGNOSE_JOB_MAX_ATTEMPTS times, which fail instead: they are likely what kills the worker.
+    Returns the numbers of jobs requeued and failed.
+    """
+    now = timezone.now()
+    max_attempts = settings.DIAGNOSE_JOB_MAX_ATTEMPTS
+    stale = DiagnosisJob.objects.filter(status=DiagnosisJob.RUNNING, started_at__lt=now - older_than)
+    failed = stale.filter(attempts__gte=max_attempts).update(
+        status=DiagnosisJob.FAILED, finished_at=now,
+        error=f"Abandoned after {max_attempts} attempts: the worker stopped while running it each time.")
+    requeued = stale.update(status=DiagnosisJob.PENDING)
+    return requeued, failed
+
+
+def diagnose_record(record, predictor, names):
+    """Run a record's two fundus images through `predictor` and store the result on the record and its Diagnose."""
+    results = predictor.predict(decode_image(record.left_fundus), decode_image(record.right_fundus))
+    report = DiagnosisReport(names, results)
+    with transaction.atomic():
+        record.left_diagnostic = report.left_diagnostic
+        record.right_diagnostic = report.right_diagnostic
+        record.save(update_fields=['left_diagnostic', 'right_diagnostic'])
+        if record.diagnose_id:
+            Diagnose.objects.filter(pk=record.diagnose_id).update(
+                complete_diagnosis=report.complete_diagnosis, confidence_score=report.confidence_score)
+            response_cache.bump(Diagnose)
+    return report
+
+
+def run_job(job, predictor, names):
+    try:
+        diagnose_record(job.record, predictor, names)
+    except Exception as exc:
+        job.status, job.error = DiagnosisJob.FAILED, f"{type(exc).__name__}: {exc}"
+    else:
+        job.status, job.error = DiagnosisJob.DONE, None
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'finished_at'])
+    return job
@@ -0,0 +1,124 @@
+import json
+import os
+import random
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from diagnose.classifier.classifier_component import import_tensorflow
+from diagnose.classifier.tflite import TFLiteModel
+from diagnose.ingestion import decode_file
+from diagnose.views import registry
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
+
+
+def split_images(folder, limit, holdout):
+    """Up to `limit` image paths from `folder`, shuffled reproducibly and split into (calibration, evaluation)."""
+    names = sorted(name for name in os.listdir(folder) if name.lower().endswith(IMAGE_EXTENSIONS))
+    random.Random(0).shuffle(names)
+    paths = [os.path.join(folder, name) for name in names[:limit]]
+    split = len(paths) - round(len(paths) * holdout)
+    return paths[:split], paths[split:]
+
+
+def read_images(paths):
+    """Decode `paths` one at a time at the smallest scale covering the model input, skipping unreadable files."""
+    for path in paths:
+        try:
+            with open(path, 'rb') as image_file:
+                yield decode_file(image_file, path)
+        except ValueError:
+            continue
+
+
+def predictions(model, inputs, batch_size=16):
+    return np.concatenate([np.asarray(model(inputs[i:i + batch_size]))
+                           for i in range(0, len(inputs), batch_size)])
+
+
+def labels(outputs):
+    # Single sigmoid output: thresholded; softmax outputs: argmax.
+    return outputs[:, 0] > 0.5 if outputs.shape[-1] == 1 else outputs.argmax(axis=-1)
+
+
+class Command(BaseCommand):
+    help = ("Convert the registered .h5 models to float16 and int8-quantized TFLite models and report "
+            "their accuracy drift against the original models on a folder of fundus images: int8 models "
+            "are calibrated on part of the images and drift is measured on the held-out rest. "
+            "Serve a converted model by registering its .tflite path in diagnose/views.py.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--images', help="Folder of fundus images: int8 calibration data and drift report input.")
+        parser.add_argument('--holdout', type=float, default=0.25,
+                            help="Fraction of the images kept out of calibration to measure drift on.")
+        parser.add_argument('--output-dir', help="Where to write <name>.<mode>.tflite (default: next to each model).")
+        parser.add_argument('--modes', nargs='+', choices=['float16', 'int8'], default=['float16', 'int8'])
+        parser.add_argument('--models', nargs='+', help="Registry names to convert (default: all).")
+        parser.add_argument('--samples', type=int, default=200,
+                            help="Images used for calibration and the report together.")
+        parser.add_argument('--report', help="Also write the drift report as JSON to this path.")
+
+    def handle(self, *args, **options):
+        tf = import_tensorflow()
+        if 'int8' in options['modes'] and not options['images']:
+            raise CommandError("int8 conversion needs --images for its representative dataset.")
+        if not 0 <= options['holdout'] < 1:
+            raise CommandError("--holdout must be at least 0 and below 1.")
+        calibration, evaluation = (split_images(options['images'], options['samples'], options['holdout'])
+                                   if options['images'] else ([], []))
+        if options['images'] and not calibration:
+            raise CommandError(f"No images in {options['images']}")
+        # Only the held-out images are kept, decoded at reduced scale; calibration images are read per use.
+        images = list(read_images(evaluation))
+
+        report = []
+        for name, model in registry.items():
+            if options['models'] and name not in options['models']:
+                continue
+            inputs = model.strategy.apply_batch(images).astype(np.float32) if images else None
+            reference = predictions(lambda batch: model.model(batch, training=False), inputs) if images else None
+            for mode in options['modes']:
+                converter = tf.lite.TFLiteConverter.from_keras_model(model.model)
+                converter.optimizations = [tf.lite.Optimize.DEFAULT]
+                if mode == 'float16':
+                    converter.target_spec.supported_types = [tf.float16]
+                else:
+                    # Calibrate on inputs preprocessed exactly like the model sees them in production,
+                    # decoded and resized to 224x224 one image at a time as the converter asks for them.
+                    converter.representative_dataset = lambda: (
+                        [model.strategy.apply(image)[np.newaxis].astype(np.float32)]
+                        for image in read_images(calibration))
+                    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+                    converter.inference_input_type = tf.int8
+                    converter.inference_output_type = tf.int8
+                output_dir = options['output_dir'] or os.path.dirname(os.path.abspath(model.model_path))
+                os.makedirs(output_dir, exist_ok=True)
+                path = os.path.join(output_dir, f"{name}.{mode}.tflite")
+                with open(path, 'wb') as output:
+                    output.write(converter.convert())
+
+                entry = {'model': name, 'mode': mode, 'path': path,
+                         'size_mb': round(os.path.getsize(path) / 2 ** 20, 3),
+                         'original_size_mb': round(os.path.getsize(model.model_path) / 2 ** 20, 3)}
+                if images:
+                    converted = predictions(TFLiteModel(path), inputs)
+                    drift = np.abs(converted - reference)
+                    entry.update(calibration_images=len(calibration), evaluation_images=len(images),
+                                 max_abs_drift=float(drift.max()),
+                                 mean_abs_drift=float(drift.mean()),
+                                 label_agreement=float(np.mean(labels(converted) == labels(reference))))
+                report.append(entry)
+                self.stdout.write(self._format(entry))
+
+        if options['report']:
+            with open(options['report'], 'w') as output:
+                json.dump(report, output, indent=2)
+
+    def _format(self, entry):
+        line = (f"{entry['model']:<14}{entry['mode']:<9}{entry['original_size_mb']:>8.2f} MB -> "
+                f"{entry['size_mb']:>7.2f} MB")
+        if 'max_abs_drift' in entry:
+            line += (f"   drift max {entry['max_abs_drift']:.4f} mean {entry['mean_abs_drift']:.4f}"
+                     f"   label agreement {entry['label_agreement']:.1%}")
+        return line
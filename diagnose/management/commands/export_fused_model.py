@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from diagnose.classifier.fused import FusedEnsemble
+from diagnose.views import registry
+
+
+class Command(BaseCommand):
+    help = "Compile the registered diagnose models into one fused graph and save it as a SavedModel."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Output SavedModel directory (set DIAGNOSE_FUSED_PATH to it to serve it).")
+
+    def handle(self, *args, **options):
+        models = list(registry)
+        FusedEnsemble.build(models).save(options['path'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Saved {len(models)} fused models ({', '.join(name for name, _ in registry.items())}) to {options['path']}"))
@@ -0,0 +1,32 @@
+import os
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from diagnose.classifier.onnx_backend import OnnxModel, export_keras_to_onnx
+from diagnose.views import registry
+
+
+class Command(BaseCommand):
+    help = ("Export the registered Keras models to ONNX for the ONNX Runtime backend. Serve an exported "
+            "model by pointing DIAGNOSE_MODEL_PATHS at its .onnx file. Needs the packages in "
+            "requirements-onnx.txt.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output-dir', help="Where to write <name>.onnx (default: next to each model).")
+        parser.add_argument('--models', nargs='+', help="Registry names to export (default: all).")
+        parser.add_argument('--opset', type=int, help="ONNX opset for the tf2onnx fallback.")
+
+    def handle(self, *args, **options):
+        for name, model in registry.items():
+            if options['models'] and name not in options['models']:
+                continue
+            output_dir = options['output_dir'] or os.path.dirname(os.path.abspath(model.model_path))
+            os.makedirs(output_dir, exist_ok=True)
+            path = export_keras_to_onnx(model.model, os.path.join(output_dir, f"{name}.onnx"), opset=options['opset'])
+
+            # Sanity check: both backends on the same preprocessed batch.
+            dummy = np.random.default_rng(0).integers(0, 256, (2, 512, 512, 3), dtype=np.uint8)
+            batch = model.strategy.apply_batch(list(dummy)).astype(np.float32)
+            drift = np.abs(OnnxModel(path)(batch) - np.asarray(model.model(batch, training=False))).max()
+            self.stdout.write(f"{name:<14}{path}   max abs drift vs Keras {drift:.2e}")
@@ -0,0 +1,52 @@
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from diagnose.bulk import chunked
+from diagnose.derivatives import DERIVATIVES, PHOTO_DERIVATIVES, generate
+from diagnose.models import MedicalData, Patient
+
+
+class Command(BaseCommand):
+    help = ("Generate the missing thumbnails, previews and 224x224 model inputs of stored images, "
+            "e.g. of files stored before derivatives existed. Files that already have them are skipped, "
+            "so an interrupted run can simply be started again.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=200,
+                            help="Files generated between progress lines.")
+        parser.add_argument('--workers', type=int, default=settings.DIAGNOSE_DERIVATIVE_WORKERS,
+                            help="Threads decoding and encoding images.")
+
+    def handle(self, *args, **options):
+        fundus = (
+            (name, DERIVATIVES)
+            for names in MedicalData.objects.values_list('left_fundus', 'right_fundus').iterator()
+            for name in names
+        )
+        photos = (
+            (name, PHOTO_DERIVATIVES)
+            for name in Patient.objects.values_list('personal_photo', flat=True).iterator()
+        )
+        files = ((name, suffixes) for name, suffixes in itertools.chain(fundus, photos) if name)
+
+        done = failed = 0
+        with ThreadPoolExecutor(options['workers'], thread_name_prefix='derivatives') as executor:
+            for chunk in chunked(files, options['chunk_size']):
+                for (name, _), error in zip(chunk, executor.map(self.generate, chunk)):
+                    if error is not None:
+                        failed += 1
+                        self.stderr.write(f"{name}: {error}")
+                done += len(chunk)
+                self.stdout.write(f"{done} files checked")
+        self.stdout.write(self.style.SUCCESS(f"Done: {done} files checked, {failed} failed."))
+
+    @staticmethod
+    def generate(item):
+        try:
+            generate(*item)
+        except Exception as e:
+            return e
+        return None
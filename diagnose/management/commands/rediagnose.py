@@ -0,0 +1,163 @@
+import itertools
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.dateparse import parse_date
+
+from diagnose import response_cache
+from diagnose.bulk import chunked
+from diagnose.classifier.report import DiagnosisReport
+from diagnose.ingestion import decode_image
+from diagnose.models import MedicalData, Diagnose
+from diagnose.views import predictor, registry
+
+
+def read_checkpoint(path):
+    """The last record_id reached and the ids of the records that failed up to it."""
+    if not path or not os.path.exists(path):
+        return 0, set()
+    with open(path) as checkpoint_file:
+        checkpoint = json.load(checkpoint_file)
+    return checkpoint['last_record_id'], set(checkpoint.get('failed_record_ids', []))
+
+
+def write_checkpoint(path, last_record_id, failed_record_ids):
+    # Write then rename, so a kill mid-write never leaves a truncated checkpoint behind.
+    with open(path + '.tmp', 'w') as checkpoint_file:
+        json.dump({'last_record_id': last_record_id, 'failed_record_ids': sorted(failed_record_ids)},
+                  checkpoint_file)
+    os.replace(path + '.tmp', path)
+
+
+def pages(queryset, after, size):
+    """
+    The rows of `queryset` with record_id above `after`, in record_id order, fetched with a
+    fresh query per `size` rows: no cursor stays open while the writer updates the table.
+    """
+    while True:
+        page = list(queryset.filter(record_id__gt=after)[:size])
+        yield from page
+        if len(page) < size:
+            return
+        after = page[-1].record_id
+
+
+def retries(queryset, record_ids, size):
+    """The rows of `queryset` among `record_ids`, one query per `size` ids."""
+    for ids in chunked(sorted(record_ids), size):
+        yield from queryset.filter(record_id__in=ids)
+
+
+def in_order(executor, fn, items, window):
+    """executor.map() with at most `window` items submitted ahead of the consumer."""
+    in_flight = deque()
+    for item in items:
+        in_flight.append(executor.submit(fn, item))
+        if len(in_flight) >= window:
+            yield in_flight.popleft().result()
+    while in_flight:
+        yield in_flight.popleft().result()
+
+
+class Command(BaseCommand):
+    help = ("Re-run the diagnose models over stored MedicalData records and rewrite their diagnostics, "
+            "e.g. after a model file in the registry was updated. Records are processed in record_id order; "
+            "with --checkpoint an interrupted run resumes after the last record written, retrying the records "
+            "that failed before it.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=200,
+                            help="Rows fetched per query (one query per page, after the last record_id) "
+                                 "and written per bulk_update transaction.")
+        parser.add_argument('--workers', type=int, default=8,
+                            help="Threads loading images and calling the models; concurrent calls share batches.")
+        parser.add_argument('--prefetch', type=int, default=None,
+                            help="Records loaded ahead of the writer (default: 2 x --workers).")
+        parser.add_argument('--checkpoint', help="JSON file recording the last record_id written and the records "
+                                                 "that failed; resumes from it.")
+        parser.add_argument('--since', help="Only records whose appointment is on or after this date (YYYY-MM-DD).")
+        parser.add_argument('--until', help="Only records whose appointment is on or before this date (YYYY-MM-DD).")
+        parser.add_argument('--doctor', type=int, help="Only records of this doctor_id.")
+        parser.add_argument('--limit', type=int, help="Stop after this many records.")
+
+    def get_queryset(self, options):
+        queryset = (MedicalData.objects.exclude(left_fundus='').exclude(left_fundus=None)
+                    .exclude(right_fundus='').exclude(right_fundus=None))
+        for option, lookup in (('since', 'gte'), ('until', 'lte')):
+            if options[option]:
+                day = parse_date(options[option])
+                if day is None:
+                    raise CommandError(f"--{option} must be a date (YYYY-MM-DD)")
+                queryset = queryset.filter(**{f'appointment_date__appointment_datetime__date__{lookup}': day})
+        if options['doctor']:
+            queryset = queryset.filter(doctor_id=options['doctor'])
+        return queryset.order_by('record_id').only('record_id', 'diagnose_id', 'left_fundus', 'right_fundus',
+                                                   'left_diagnostic', 'right_diagnostic')
+
+    def get_records(self, options):
+        """The records that failed before the checkpoint, then those after it."""
+        queryset = self.get_queryset(options)
+        self.last_record_id, self.failed_record_ids = read_checkpoint(options['checkpoint'])
+        if self.last_record_id:
+            self.stdout.write(f"Resuming after record {self.last_record_id}, "
+                              f"retrying {len(self.failed_record_ids)} failed")
+        records = itertools.chain(retries(queryset, set(self.failed_record_ids), options['chunk_size']),
+                                  pages(queryset, self.last_record_id, options['chunk_size']))
+        return itertools.islice(records, options['limit']) if options['limit'] else records
+
+    def handle(self, *args, **options):
+        names = [name for name, _ in registry.items()]
+        registry.warmup(background=False)
+
+        def diagnose(record):
+            try:
+                report = DiagnosisReport(names, predictor.predict(decode_image(record.left_fundus),
+                                                                  decode_image(record.right_fundus)))
+                return record, report, None
+            except Exception as exc:
+                return record, None, f"{type(exc).__name__}: {exc}"
+
+        records = self.get_records(options)
+        window = options['prefetch'] or 2 * options['workers']
+        done = failed = 0
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['workers'], thread_name_prefix="rediagnose") as executor:
+            for results in chunked(in_order(executor, diagnose, records, window), options['chunk_size']):
+                written, errors = self.write(results, options['checkpoint'])
+                done, failed = done + written, failed + errors
+                self.progress(done, failed, start)
+        if not (done or failed):
+            self.stdout.write("No records to rediagnose")
+
+    def write(self, results, checkpoint):
+        records, diagnoses = [], []
+        for record, report, error in results:
+            if error:
+                self.stderr.write(f"Record {record.record_id}: {error}")
+                self.failed_record_ids.add(record.record_id)
+                continue
+            self.failed_record_ids.discard(record.record_id)
+            record.left_diagnostic, record.right_diagnostic = report.left_diagnostic, report.right_diagnostic
+            records.append(record)
+            if record.diagnose_id:
+                diagnoses.append(Diagnose(pk=record.diagnose_id, complete_diagnosis=report.complete_diagnosis,
+                                          confidence_score=report.confidence_score))
+        with transaction.atomic():
+            MedicalData.objects.bulk_update(records, ['left_diagnostic', 'right_diagnostic'])
+            Diagnose.objects.bulk_update(diagnoses, ['complete_diagnosis', 'confidence_score'])
+            response_cache.bump(MedicalData, Diagnose)
+        # Retried records have ids below the last checkpoint, which must not move back.
+        self.last_record_id = max(self.last_record_id, results[-1][0].record_id)
+        if checkpoint:
+            write_checkpoint(checkpoint, self.last_record_id, self.failed_record_ids)
+        return len(records), len(results) - len(records)
+
+    def progress(self, done, failed, start):
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"{done} records rediagnosed, {failed} failed, "
+                          f"{2 * done / elapsed if elapsed else 0:.1f} images/s")
@@ -0,0 +1,37 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from diagnose.jobs import claim_next_job, requeue_stale_jobs, run_job
+from diagnose.views import predictor, registry
+
+
+class Command(BaseCommand):
+    help = "Process queued diagnosis jobs: run each record's fundus images through the diagnose models."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Exit when the queue is empty instead of polling.")
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds between polls of an empty queue.")
+        parser.add_argument('--stale-after', type=float, default=600,
+                            help="Requeue jobs left running longer than this many seconds (e.g. by a killed worker).")
+
+    def handle(self, *args, **options):
+        names = [name for name, _ in registry.items()]
+        registry.warmup(background=True)
+        stale_after = timedelta(seconds=options['stale_after'])
+        requeued, failed = requeue_stale_jobs(stale_after)
+        if requeued or failed:
+            self.stdout.write(f"Requeued {requeued} stale jobs, failed {failed} at the attempt limit")
+        while True:
+            job = claim_next_job()
+            if job is None:
+                if options['once']:
+                    return
+                time.sleep(options['poll_interval'])
+                requeue_stale_jobs(stale_after)
+                continue
+            start = time.perf_counter()
+            job = run_job(job, predictor, names)
+            self.stdout.write(f"Job {job.job_id} (record {job.record_id}) {job.status} "
+                              f"in {time.perf_counter() - start:.2f}s" + (f": {job.error}" if job.error else ""))
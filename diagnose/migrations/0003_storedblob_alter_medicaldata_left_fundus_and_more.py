@@ -0,0 +1,38 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:22
+
+import diagnose.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnose', '0002_alter_bill_issue_date_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredBlob',
+            fields=[
+                ('name', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('size', models.BigIntegerField()),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='medicaldata',
+            name='left_fundus',
+            field=models.ImageField(blank=True, null=True, storage=diagnose.storage.content_storage, upload_to='fundus_images/'),
+        ),
+        migrations.AlterField(
+            model_name='medicaldata',
+            name='right_fundus',
+            field=models.ImageField(blank=True, null=True, storage=diagnose.storage.content_storage, upload_to='fundus_images/'),
+        ),
+        migrations.AlterField(
+            model_name='patient',
+            name='personal_photo',
+            field=models.ImageField(blank=True, null=True, storage=diagnose.storage.content_storage, upload_to='patient_photos/'),
+        ),
+    ]
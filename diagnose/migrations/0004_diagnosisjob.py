@@ -0,0 +1,30 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnose', '0003_storedblob_alter_medicaldata_left_fundus_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DiagnosisJob',
+            fields=[
+                ('job_id', models.AutoField(primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('record', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='diagnosis_jobs', to='diagnose.medicaldata')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'created_at'], name='diagnose_di_status_37e303_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:54
+
+from django.db import migrations, models
+
+
+def fts_index(table, rowid, columns):
+    """
+    SQL creating an external-content FTS5 index `<table>_fts` over `columns` of `table`, kept in
+    sync by triggers and filled from the existing rows, and SQL dropping it again.
+    """
+    index = f'{table}_fts'
+    names = ', '.join(columns)
+    new = ', '.join(f'new.{column}' for column in columns)
+    old = ', '.join(f'old.{column}' for column in columns)
+    create = [
+        f"CREATE VIRTUAL TABLE {index} USING fts5({names}, content='{table}', content_rowid='{rowid}', "
+        f"tokenize='unicode61 remove_diacritics 2')",
+        f"CREATE TRIGGER {index}_insert AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {index}(rowid, {names}) VALUES (new.{rowid}, {new}); END",
+        f"CREATE TRIGGER {index}_delete AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {index}({index}, rowid, {names}) VALUES ('delete', old.{rowid}, {old}); END",
+        f"CREATE TRIGGER {index}_update AFTER UPDATE OF {names} ON {table} BEGIN "
+        f"INSERT INTO {index}({index}, rowid, {names}) VALUES ('delete', old.{rowid}, {old}); "
+        f"INSERT INTO {index}(rowid, {names}) VALUES (new.{rowid}, {new}); END",
+        f"INSERT INTO {index}({index}) VALUES ('rebuild')",
+    ]
+    drop = [f"DROP TRIGGER {index}_{event}" for event in ('insert', 'delete', 'update')] + [f"DROP TABLE {index}"]
+    return migrations.RunSQL(create, drop)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnose', '0004_diagnosisjob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['doctor', 'appointment_datetime'], name='diagnose_ap_doctor__0f0c66_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['appointment_datetime'], name='diagnose_ap_appoint_791d6c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bill',
+            index=models.Index(fields=['payment_status'], name='diagnose_bi_payment_cae484_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bill',
+            index=models.Index(fields=['payment_status', 'issue_date'], name='diagnose_bi_payment_923f3e_idx'),
+        ),
+        # ?search= on /patients/ and /medical-data/ (diagnose.filtering.FullTextSearchFilter).
+        fts_index('diagnose_patient', 'patient_id', ['first_name', 'last_name', 'phone']),
+        fts_index('diagnose_medicaldata', 'record_id', ['medical_notes']),
+    ]
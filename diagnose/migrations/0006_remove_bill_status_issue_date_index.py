@@ -0,0 +1,17 @@
+# Generated by Django 5.1.1 on 2026-10-18 14:33
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnose', '0005_search_and_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='bill',
+            name='diagnose_bi_payment_923f3e_idx',
+        ),
+    ]
@@ -0,0 +1,39 @@
+from collections import Counter
+
+from django.db import migrations
+
+# File fields whose files live in content-addressed storage.
+STORED_FILE_FIELDS = {
+    'MedicalData': ('left_fundus', 'right_fundus'),
+    'Patient': ('personal_photo',),
+}
+
+
+def backfill_stored_blobs(apps, schema_editor):
+    """Create the StoredBlob rows of files referenced by records but stored before reference counting."""
+    from diagnose.storage import content_storage
+
+    StoredBlob = apps.get_model('diagnose', 'StoredBlob')
+    references = Counter()
+    for model_name, fields in STORED_FILE_FIELDS.items():
+        model = apps.get_model('diagnose', model_name)
+        for names in model.objects.values_list(*fields).iterator():
+            references.update(name for name in names if name)
+
+    storage = content_storage()
+    tracked = set(StoredBlob.objects.values_list('name', flat=True))
+    StoredBlob.objects.bulk_create(
+        [StoredBlob(name=name, size=storage.size(name) if storage.exists(name) else 0, ref_count=count)
+         for name, count in references.items() if name not in tracked],
+        batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnose', '0006_remove_bill_status_issue_date_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_stored_blobs, migrations.RunPython.noop),
+    ]
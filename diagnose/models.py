@@ -1,5 +1,7 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
 from django.utils import timezone
+from .storage import content_storage
  
 def getFullDisease(a1, a2, a3, a4):
     return {
@@ -20,6 +22,24 @@ class Doctor(models.Model):
         return f"{self.first_name} {self.last_name}"
 
 
+DEFAULT_DOCTOR_ID = 1
+
+_default_doctor = None
+
+
+def default_doctor():
+    """The doctor new records are attributed to, fetched once per process (signals.py drops it when it changes)."""
+    global _default_doctor
+    if _default_doctor is None:
+        _default_doctor = Doctor.objects.get(doctor_id=DEFAULT_DOCTOR_ID)
+    return _default_doctor
+
+
+def forget_default_doctor():
+    global _default_doctor
+    _default_doctor = None
+
+
 class Diagnose(models.Model):
     diagnose_id = models.AutoField(primary_key=True)
     complete_diagnosis = models.TextField()
@@ -50,7 +70,7 @@ class Patient(models.Model):
     address = models.TextField()
     phone = models.CharField(max_length=15)
     insurance_info = models.CharField(max_length=100)
-    personal_photo = models.ImageField(upload_to='patient_photos/', blank=True, null=True)
+    personal_photo = models.ImageField(upload_to='patient_photos/', storage=content_storage, blank=True, null=True)
     contact_info = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     #Edit 3) add "related_name" to make it easier to access related data.
@@ -73,6 +93,12 @@ class Appointment(models.Model):
         """ to ensure that a patient and doctor cannot have multiple 
            appointments at the same time and that each appointment can only have one bill."""
         unique_together = ('patient', 'doctor', 'appointment_datetime')    
+        # ?doctor= with an ?after=/?before= range, and the range alone, which also serves
+        # MedicalData's ?date= through the record's appointment.
+        indexes = [
+            models.Index(fields=['doctor', 'appointment_datetime']),
+            models.Index(fields=['appointment_datetime']),
+        ]
 
 
 class MedicalData(models.Model):
@@ -82,36 +108,39 @@ class MedicalData(models.Model):
     appointment_date = models.OneToOneField(Appointment, on_delete=models.CASCADE, blank=True, null=True)
     diagnose = models.OneToOneField(Diagnose, on_delete=models.CASCADE, blank=True, null=True)
     
-    left_fundus = models.ImageField(upload_to='fundus_images/', blank=True, null=True)
-    right_fundus = models.ImageField(upload_to='fundus_images/', blank=True, null=True)
+    left_fundus = models.ImageField(upload_to='fundus_images/', storage=content_storage, blank=True, null=True)
+    right_fundus = models.ImageField(upload_to='fundus_images/', storage=content_storage, blank=True, null=True)
     left_diagnostic = models.CharField(max_length=255)
     right_diagnostic = models.CharField(max_length=255)
     medical_notes = models.TextField(blank=True, null=True)
 
 
     def save(self, *args, **kwargs):
-        # Check if an appointment needs to be created
-        if not self.appointment_date:
-            self.appointment_date = Appointment.objects.create(
-                patient=self.patient,
-                doctor=self.doctor,
-                appointment_datetime=timezone.now()  # Current datetime
-            )
-
-        # Check if a diagnose needs to be created
-        if not self.diagnose:
-            # Call the getDisease function using parameters from MedicalData instance
-            diagnosis_result = getFullDisease(self.left_fundus, self.right_fundus, self.left_diagnostic, self.right_diagnostic)
-            
-            # Create Diagnose object from getDisease output
-            self.diagnose = Diagnose.objects.create(
-                complete_diagnosis=diagnosis_result['complete_diagnosis'],
-                confidence_score=diagnosis_result['confidence_score'],
-                diagnosis_notes=" "
-            )
-
-        # Call the original save method to save the instance with the linked Appointment and Diagnose
-        super().save(*args, **kwargs)
+        # Call the getDisease function using parameters from MedicalData instance
+        diagnosis_result = None if self.diagnose else getFullDisease(
+            self.left_fundus, self.right_fundus, self.left_diagnostic, self.right_diagnostic)
+
+        # The three rows are written in one transaction, so one write lock (see DATABASES) covers them.
+        with transaction.atomic():
+            # Check if an appointment needs to be created
+            if not self.appointment_date:
+                self.appointment_date = Appointment.objects.create(
+                    patient=self.patient,
+                    doctor=self.doctor,
+                    appointment_datetime=timezone.now()  # Current datetime
+                )
+
+            # Check if a diagnose needs to be created
+            if diagnosis_result is not None:
+                # Create Diagnose object from getDisease output
+                self.diagnose = Diagnose.objects.create(
+                    complete_diagnosis=diagnosis_result['complete_diagnosis'],
+                    confidence_score=diagnosis_result['confidence_score'],
+                    diagnosis_notes=" "
+                )
+
+            # Call the original save method to save the instance with the linked Appointment and Diagnose
+            super().save(*args, **kwargs)
 
     def __str__(self):
         return f"Medical Record {self.record_id} for {self.patient.first_name} {self.patient.last_name}"
@@ -139,10 +168,78 @@ class Bill(models.Model):
     payment_status = models.CharField(max_length=50)
     payment_method = models.CharField(max_length=50)
 
+    class Meta:
+        # ?payment_status=, newest first (the index ends in the rowid).
+        indexes = [
+            models.Index(fields=['payment_status']),
+        ]
+
     def __str__(self):
         return f"Bill {self.bill_id} - ${self.amount}"
 
 
+class DiagnosisJob(models.Model):
+    """An asynchronous diagnosis of one MedicalData record, processed by `manage.py run_diagnosis_worker`."""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+    FINISHED = (DONE, FAILED)
 
+    job_id = models.AutoField(primary_key=True)
+    record = models.ForeignKey(MedicalData, on_delete=models.CASCADE, related_name='diagnosis_jobs')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
 
+    class Meta:
+        # The worker polls for the oldest pending job.
+        indexes = [models.Index(fields=['status', 'created_at'])]
+
+    def __str__(self):
+        return f"Diagnosis job {self.job_id} ({self.status}) for Record {self.record_id}"
 
+
+class StoredBlob(models.Model):
+    """A file in content-addressed storage and the number of records that reference it."""
+    name = models.CharField(max_length=255, primary_key=True)
+    size = models.BigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} refs)"
+
+    # Both lock the row (on SQLite, the IMMEDIATE transaction mode takes the database write lock), so
+    # call them inside the transaction that also writes or removes the file; see ContentAddressedStorage.
+
+    @classmethod
+    def acquire(cls, name, size):
+        blob = cls.objects.select_for_update().filter(name=name).first()
+        if blob is None:
+            blob, _ = cls.objects.get_or_create(name=name, defaults={'size': size})
+        cls.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+
+    @classmethod
+    def release(cls, name):
+        """
+        Drop one reference. Returns True when nothing references the file any more, and None
+        for a file no StoredBlob tracks, whose references are unknown.
+        """
+        blob = cls.objects.select_for_update().filter(name=name).first()
+        if blob is None:
+            return None
+        if blob.ref_count > 1:
+            cls.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') - 1)
+            return False
+        blob.delete()
+        return True
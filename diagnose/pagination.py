@@ -0,0 +1,16 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+# Keyset Pagination
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination on the primary key, newest first.
+
+    Each page is `WHERE pk < <last pk seen> ORDER BY pk DESC LIMIT n`, an index range scan,
+    so page 10,000 costs the same as page 1 and rows inserted meanwhile never shift a page.
+    """
+    ordering = '-pk'
+    page_size = settings.DIAGNOSE_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.DIAGNOSE_MAX_PAGE_SIZE
@@ -0,0 +1,105 @@
+"""
+Response caching for the read side of the diagnose viewsets.
+
+Each model has a generation: the time.time_ns() of its last change, kept in
+DIAGNOSE_GENERATION_CACHE and bumped by the post_save/post_delete signals in signals.py (and explicitly by code that
+writes with update()/bulk_create()/bulk_update(), which send no signals). A cached
+response is keyed by its absolute URL, its format and the generations of the models it
+reads, so a write makes every older entry unreachable instead of having to find and delete it.
+
+The same generations give every response an ETag and a Last-Modified date, so a client
+that revalidates gets a 304 without the view touching the database or a serializer.
+
+Generations must be shared by every process that writes (the web server, the diagnosis worker,
+management commands), or a write elsewhere never reaches the server's entries; responses need
+not be, since a new generation makes every process's older entries unreachable.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+
+def response_cache():
+    return caches[settings.DIAGNOSE_RESPONSE_CACHE]
+
+
+def generation_cache():
+    return caches[settings.DIAGNOSE_GENERATION_CACHE]
+
+
+def generation_key(model):
+    return f"diagnose:generation:{model._meta.label_lower}"
+
+
+def generations(models):
+    """Current generation of each model; a model without one (new, or evicted) starts one now."""
+    cache = generation_cache()
+    keys = [generation_key(model) for model in models]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            now = time.time_ns()
+            cache.add(key, now, timeout=None)
+            found[key] = cache.get(key) or now
+    return [found[key] for key in keys]
+
+
+def bump(*models):
+    """Mark `models` as changed, once the surrounding transaction (if any) commits."""
+    def apply():
+        now = time.time_ns()
+        generation_cache().set_many({generation_key(model): now for model in models}, timeout=None)
+
+    transaction.on_commit(apply)
+
+
+# Cached Response Mixin
+class CachedResponseMixin:
+    """
+    Serves list and retrieve from the response cache, with ETag/Last-Modified revalidation.
+    `cache_models` lists every model whose rows the responses are built from.
+    Only JSON responses are stored; the browsable API embeds per-user forms and CSRF tokens.
+    """
+    cache_models = ()
+
+    def list(self, request, *args, **kwargs):
+        return self.cached(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached(super().retrieve, request, *args, **kwargs)
+
+    def cached(self, handler, request, *args, **kwargs):
+        versions = generations(self.cache_models)
+        fingerprint = "|".join([request.build_absolute_uri(), request.accepted_renderer.format,
+                                *map(str, versions)])
+        digest = hashlib.sha256(fingerprint.encode()).hexdigest()
+        headers = {'ETag': f'"{digest[:32]}"', 'Last-Modified': http_date(max(versions) // 10 ** 9),
+                   'Cache-Control': 'no-cache'}
+
+        not_modified = get_conditional_response(request._request, etag=headers['ETag'],
+                                                last_modified=max(versions) // 10 ** 9)
+        if not_modified is not None:
+            for header, value in headers.items():
+                not_modified[header] = value
+            return not_modified
+
+        cacheable = request.accepted_renderer.format == 'json'
+        key = f"diagnose:response:{digest}"
+        hit = response_cache().get(key) if cacheable else None
+        if hit is not None:
+            content, content_type = hit
+            return HttpResponse(content, content_type=content_type, headers=headers)
+
+        response = handler(request, *args, **kwargs)
+        for header, value in headers.items():
+            response[header] = value
+        if cacheable and response.status_code == 200:
+            response.add_post_render_callback(lambda rendered: response_cache().set(
+                key, (rendered.content, rendered['Content-Type']), settings.DIAGNOSE_RESPONSE_CACHE_TIMEOUT))
+        return response
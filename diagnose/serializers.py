@@ -1,6 +1,7 @@
-from .models import Doctor, Patient, Appointment, Bill, MedicalData, Diagnose, TreatmentPlan
+from .models import Doctor, Patient, Appointment, Bill, MedicalData, Diagnose, TreatmentPlan, DiagnosisJob
 from rest_framework import serializers
 from datetime import date
+from .derivatives import THUMBNAIL, PREVIEW, derived_url
 
 
 """
@@ -19,6 +20,19 @@ from datetime import date
 
  """
 
+class DerivativeURLField(serializers.ReadOnlyField):
+    """URL of a thumbnail or preview of an image field; null until it has been generated."""
+
+    def __init__(self, suffix, **kwargs):
+        self.suffix = suffix
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        url = derived_url(value, self.suffix)
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if url and request else url
+
+
 class DoctorSerializer(serializers.ModelSerializer):
     class Meta:
         model = Doctor
@@ -29,6 +43,8 @@ class PatientSerializer(serializers.ModelSerializer):
 
     doctor = serializers.PrimaryKeyRelatedField(read_only=True)  # Embed detailed doctor data
     age = serializers.SerializerMethodField()
+    personal_photo_thumbnail = DerivativeURLField(THUMBNAIL, source='personal_photo')
+    personal_photo_preview = DerivativeURLField(PREVIEW, source='personal_photo')
 
     class Meta:
         model = Patient
@@ -36,26 +52,48 @@ class PatientSerializer(serializers.ModelSerializer):
             'patient_id', 'first_name', 'last_name', 'birthday', 'gender',
             'address', 'phone', 'insurance_info', 'personal_photo', 
             'contact_info', 'created_at', 'doctor', 'age',
+            'personal_photo_thumbnail', 'personal_photo_preview',
         ]
 
         read_only_fields = ['patient_id', 'doctor', 'created_at', ]
+        sparse_field_sources = {'age': ['birthday']}
 
     def get_age(self, obj):
         return date.today().year - obj.birthday.year
 
 
 class MedicalDataSerializer(serializers.ModelSerializer):
+    left_fundus_thumbnail = DerivativeURLField(THUMBNAIL, source='left_fundus')
+    left_fundus_preview = DerivativeURLField(PREVIEW, source='left_fundus')
+    right_fundus_thumbnail = DerivativeURLField(THUMBNAIL, source='right_fundus')
+    right_fundus_preview = DerivativeURLField(PREVIEW, source='right_fundus')
+
     class Meta:
         model = MedicalData
         fields = [
             'record_id', 'patient', 'left_fundus', 'right_fundus', 
             'left_diagnostic', 'right_diagnostic', 
             'doctor', 'medical_notes', 'diagnose',
+            'left_fundus_thumbnail', 'left_fundus_preview', 'right_fundus_thumbnail', 'right_fundus_preview',
         ]
 
         read_only_fields = ['record_id', 'doctor', 'left_diagnostic', 'right_diagnostic','appointment_date']
 
 
+class DiagnosisJobSerializer(serializers.ModelSerializer):
+    left_diagnostic = serializers.CharField(source='record.left_diagnostic', read_only=True)
+    right_diagnostic = serializers.CharField(source='record.right_diagnostic', read_only=True)
+    diagnose = serializers.PrimaryKeyRelatedField(source='record.diagnose', read_only=True)
+
+    class Meta:
+        model = DiagnosisJob
+        fields = [
+            'job_id', 'record', 'status', 'attempts', 'error', 'created_at', 'started_at', 'finished_at',
+            'left_diagnostic', 'right_diagnostic', 'diagnose',
+        ]
+        read_only_fields = fields
+
+
 class AppointmentSerializer(serializers.ModelSerializer):
     
     doctor = serializers.PrimaryKeyRelatedField(read_only=True)  # Embed detailed doctor data
@@ -69,12 +107,15 @@ class AppointmentSerializer(serializers.ModelSerializer):
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
-        representation['appointment_datetime'] = instance.appointment_datetime.strftime('%Y-%m-%d %H:%M')
+        if 'appointment_datetime' in representation:
+            representation['appointment_datetime'] = instance.appointment_datetime.strftime('%Y-%m-%d %H:%M')
         return representation
 
 
 class TreatmentPlanSerializer(serializers.ModelSerializer):
     doctor = serializers.PrimaryKeyRelatedField(read_only=True)  # Embed detailed doctor data
+    # Choices in the browsable API are labelled with MedicalData.__str__, which reads the patient.
+    record = serializers.PrimaryKeyRelatedField(queryset=MedicalData.objects.select_related('patient'))
 
     class Meta:
         model = TreatmentPlan
@@ -96,6 +137,8 @@ class DiagnoseSerializer(serializers.ModelSerializer):
 
 class BillSerializer(serializers.ModelSerializer):
     doctor = serializers.PrimaryKeyRelatedField(read_only=True)  # Embed detailed doctor data
+    # Choices in the browsable API are labelled with Appointment.__str__, which reads the patient.
+    appointment = serializers.PrimaryKeyRelatedField(queryset=Appointment.objects.select_related('patient'))
 
     class Meta:
         model = Bill
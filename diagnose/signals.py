@@ -0,0 +1,86 @@
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import derivatives, response_cache
+from .models import (Doctor, Patient, Appointment, Bill, MedicalData, Diagnose, TreatmentPlan,
+                     forget_default_doctor)
+from .storage import release_files
+
+# File fields stored in content-addressed storage, per model.
+STORED_FILE_FIELDS = {
+    MedicalData: ('left_fundus', 'right_fundus'),
+    Patient: ('personal_photo',),
+}
+
+# Derivatives generated for those files: only fundus images go through a model.
+STORED_FILE_DERIVATIVES = {
+    MedicalData: derivatives.DERIVATIVES,
+    Patient: derivatives.PHOTO_DERIVATIVES,
+}
+
+
+@receiver(pre_save, sender=MedicalData)
+@receiver(pre_save, sender=Patient)
+def remember_replaced_files(sender, instance, **kwargs):
+    instance._replaced_files = []
+    if instance.pk is None:
+        return
+    fields = STORED_FILE_FIELDS[sender]
+    previous = sender.objects.filter(pk=instance.pk).values(*fields).first() or {}
+    for field, name in previous.items():
+        current = getattr(instance, field)
+        # A fresh upload takes a new reference even when its bytes match the old file.
+        if name and (not current._committed or current.name != name):
+            instance._replaced_files.append(name)
+
+
+@receiver(post_save, sender=MedicalData)
+@receiver(post_save, sender=Patient)
+def release_replaced_files(sender, instance, **kwargs):
+    release_files(getattr(instance, '_replaced_files', []))
+
+
+@receiver(post_save, sender=MedicalData)
+@receiver(post_save, sender=Patient)
+def generate_derivatives(sender, instance, update_fields=None, **kwargs):
+    fields = [field for field in STORED_FILE_FIELDS[sender] if update_fields is None or field in update_fields]
+    names = [getattr(instance, field).name for field in fields]
+    if any(names):
+        transaction.on_commit(lambda: derivatives.schedule(names, STORED_FILE_DERIVATIVES[sender]))
+
+
+@receiver(post_delete, sender=MedicalData)
+@receiver(post_delete, sender=Patient)
+def release_deleted_files(sender, instance, **kwargs):
+    release_files(getattr(instance, field).name for field in STORED_FILE_FIELDS[sender])
+
+
+@receiver(post_save, sender=Doctor)
+@receiver(post_delete, sender=Doctor)
+def drop_cached_default_doctor(sender, **kwargs):
+    forget_default_doctor()
+
+
+# Models behind cached responses; see response_cache.py.
+CACHED_MODELS = (Doctor, Patient, Appointment, Bill, MedicalData, Diagnose, TreatmentPlan)
+
+
+def nulled_on_delete(model):
+    """Models whose rows deleting a `model` row rewrites with update() (on_delete=SET_NULL), which sends no signals."""
+    return tuple(relation.related_model for relation in model._meta.related_objects
+                 if relation.on_delete in (models.SET_NULL, models.SET_DEFAULT))
+
+
+def invalidate_cached_responses(sender, **kwargs):
+    response_cache.bump(sender)
+
+
+def invalidate_deleted_responses(sender, **kwargs):
+    response_cache.bump(sender, *nulled_on_delete(sender))
+
+
+for model in CACHED_MODELS:
+    post_save.connect(invalidate_cached_responses, sender=model, dispatch_uid=f'response-cache-save-{model.__name__}')
+    post_delete.connect(invalidate_deleted_responses, sender=model,
+                        dispatch_uid=f'response-cache-delete-{model.__name__}')
@@ -0,0 +1,104 @@
+import hashlib
+import os
+import posixpath
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File storage that names every file after the SHA-256 of its bytes.
+
+    An upload to `fundus_images/Eye1.jpg` is stored as `fundus_images/ab/cd/abcd....jpg`,
+    so re-uploading the same bytes reuses the existing file instead of writing a new copy.
+    StoredBlob rows count how many records point at each file; delete() only removes the
+    file once the last reference is released, together with any files derived from it.
+    Files without a StoredBlob row (stored before rows existed and not backfilled) are kept.
+
+    Taking a reference and writing the file, or dropping the last reference and removing
+    the file, each happen in one transaction holding the StoredBlob row lock, so a delete
+    cannot remove a file that a concurrent save of the same bytes has just found in place.
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, **kwargs):
+        # Names are derived from content, so "overwriting" only ever rewrites identical bytes.
+        kwargs.setdefault("allow_overwrite", True)
+        super().__init__(**kwargs)
+
+    def content_name(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks(self.chunk_size):
+            digest.update(chunk)
+        digest = digest.hexdigest()
+        extension = posixpath.splitext(name)[1].lower()
+        return posixpath.join(posixpath.dirname(name), digest[:2], digest[2:4], digest + extension)
+
+    def _save(self, name, content):
+        from .models import StoredBlob
+
+        name = self.content_name(name, content)
+        with transaction.atomic():
+            StoredBlob.acquire(name, content.size)
+            if not self.exists(name):
+                # Streams the upload in chunks, or moves it if it is already a temporary file.
+                name = super()._save(name, content)
+        return name
+
+    def delete(self, name):
+        from .derivatives import DERIVATIVES
+        from .models import StoredBlob
+
+        with transaction.atomic():
+            if not StoredBlob.release(name):
+                return
+            super().delete(name)
+            # The same bytes uploaded as .jpg and as .png are two blobs sharing one set of derived
+            # files (derived names drop the extension); those go with the last of them.
+            stem = posixpath.splitext(name)[0]
+            if not StoredBlob.objects.filter(name__startswith=stem + '.').exists():
+                for suffix in DERIVATIVES:
+                    super().delete(self.derived_name(name, suffix))
+
+    def derived_name(self, name, suffix):
+        """`fundus_images/ab/cd/abcd....jpg` -> `fundus_images/ab/cd/abcd....<suffix>`."""
+        return f"{posixpath.splitext(name)[0]}.{suffix}"
+
+    def save_derived(self, name, suffix, data):
+        """
+        Store `data` as a file derived from `name` (a thumbnail, say). Derived files are not
+        reference-counted; they live and die with their original. Written to a temp file and
+        renamed, so readers never see a partial file.
+        """
+        derived = self.derived_name(name, suffix)
+        path = self.path(derived)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.derived-')
+        with os.fdopen(fd, 'wb') as derived_file:
+            derived_file.write(data)
+        # mkstemp creates 0600 files; match what FileSystemStorage would have written.
+        os.chmod(tmp_path, self.file_permissions_mode or 0o644)
+        os.replace(tmp_path, path)
+        return derived
+
+
+_content_storage = None
+
+
+def content_storage():
+    """The shared ContentAddressedStorage (a callable, so migrations store a reference rather than an instance)."""
+    global _content_storage
+    if _content_storage is None:
+        _content_storage = ContentAddressedStorage()
+    return _content_storage
+
+
+def release_files(names):
+    """Drop one reference to each stored file once the surrounding transaction commits."""
+    names = [name for name in names if name]
+    if names:
+        storage = content_storage()
+        transaction.on_commit(lambda: [storage.delete(name) for name in names])
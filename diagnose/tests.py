@@ -1,3 +1,1470 @@
-from django.test import TestCase
+import argparse
+import importlib.util
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from datetime import date, datetime, timedelta
+from unittest import mock
 
-# Create your tests here.
+import cv2
+import numpy as np
+from benchmarks import suite
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from django.test import TestCase, override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.test import APIClient
+
+from .classifier.classifier_component import EyesModel, ModelLoaderFactory
+from .classifier.fused import FusedEnsemble
+from .classifier.prediction_cache import CacheLookup, PredictionCache
+from .classifier.registry import ModelRegistry
+from .classifier import preprocessingStrategy
+from .classifier.preprocessingStrategy import CataractPreprocessing, GlaucomaPreprocessing
+from .classifier.preprocessing_graph import PreprocessingGraph
+from .classifier.process_pool import ProcessPoolDiagnoser, WorkerTimeoutError
+from .classifier.scheduler import InferenceScheduler
+from . import async_views, derivatives, views
+from .derivatives import DERIVATIVES
+from .fieldsets import model_columns
+from .ingestion import decode_bytes, decode_file, decode_image, jpeg_size, reduction_for
+from .jobs import PENDING_DIAGNOSTIC, claim_next_job, requeue_stale_jobs, run_job
+from .management.commands import rediagnose
+from .response_cache import response_cache
+from .serializers import DiagnosisJobSerializer, PatientSerializer
+from .storage import ContentAddressedStorage, content_storage
+from .models import (Doctor, Patient, Appointment, Bill, MedicalData, Diagnose, TreatmentPlan, DiagnosisJob, StoredBlob,
+                     default_doctor)
+
+# Queries allowed per GET, by router prefix: JSON list and detail, and the browsable API's list
+# page, whose forms label related-field choices with __str__. Budgets hold for a page of any size:
+# an endpoint that issues one more query per row fails as soon as the page grows.
+QUERY_BUDGETS = {
+    'doctors': {'list': 1, 'detail': 1, 'browsable': 1},
+    'patients': {'list': 1, 'detail': 1, 'browsable': 1},
+    'appointments': {'list': 1, 'detail': 1, 'browsable': 2},
+    'bills': {'list': 1, 'detail': 1, 'browsable': 2},
+    'medical-data': {'list': 1, 'detail': 1, 'browsable': 3},
+    'diagnoses': {'list': 1, 'detail': 1, 'browsable': 1},
+    'treatment-plans': {'list': 1, 'detail': 1, 'browsable': 2},
+    'jobs': {'list': 1, 'detail': 1, 'browsable': 1},
+}
+
+
+def create_exams(count, offset=0):
+    """`count` doctors and patients, each patient with an exam (record, appointment, diagnose), a bill,
+    a treatment plan, a diagnosis job and a second appointment."""
+    doctor = default_doctor()
+    for i in range(offset, offset + count):
+        Doctor.objects.create(first_name="D", last_name=str(i), specialty="eye", phone="0", email=f"d{i}@example.com")
+        patient = Patient.objects.create(first_name="P", last_name=str(i), birthday="1970-01-01", gender="O",
+                                         address="-", phone="0", insurance_info="-", contact_info="-",
+                                         doctor=doctor)
+        record = MedicalData.objects.create(patient=patient, doctor=doctor, left_diagnostic="Normal",
+                                            right_diagnostic="Normal")
+        Bill.objects.create(appointment=record.appointment_date, amount=10, payment_status="paid",
+                            payment_method="cash")
+        TreatmentPlan.objects.create(record=record, medication="-", dose="-", daily_activities="-")
+        DiagnosisJob.objects.create(record=record)
+        Appointment.objects.create(patient=patient, doctor=doctor,
+                                   appointment_datetime=timezone.now() + timedelta(days=1))
+
+
+class QueryBudgetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Doctor.objects.create(doctor_id=1, first_name="D", last_name="D", specialty="eye", phone="0",
+                              email="d@example.com")
+
+    def setUp(self):
+        self.client = APIClient()
+        response_cache().clear()
+
+    def count_queries(self, url, **headers):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, **headers)
+        self.assertEqual(response.status_code, 200, url)
+        return len(queries), response
+
+    def assert_within_budget(self, rows):
+        for prefix, budget in QUERY_BUDGETS.items():
+            with self.subTest(endpoint=prefix, rows=rows):
+                count, response = self.count_queries(f'/diagnose/{prefix}/?page_size=500')
+                self.assertGreaterEqual(len(response.data['results']), rows)
+                self.assertLessEqual(count, budget['list'], f"GET /diagnose/{prefix}/ ran {count} queries")
+                pk = next(iter(response.data['results'][0].values()))
+                count, _ = self.count_queries(f'/diagnose/{prefix}/{pk}/')
+                self.assertLessEqual(count, budget['detail'], f"GET /diagnose/{prefix}/{pk}/ ran {count} queries")
+                count, _ = self.count_queries(f'/diagnose/{prefix}/?page_size=500', HTTP_ACCEPT='text/html')
+                self.assertLessEqual(count, budget['browsable'], f"Browsable /diagnose/{prefix}/ ran {count} queries")
+
+    def test_budgets_hold_as_rows_grow(self):
+        create_exams(3)
+        self.assert_within_budget(rows=3)
+        with self.captureOnCommitCallbacks(execute=True):
+            create_exams(30, offset=3)
+        self.assert_within_budget(rows=30)
+
+    def test_sparse_fields_stay_within_budget(self):
+        create_exams(10)
+        count, response = self.count_queries('/diagnose/medical-data/?fields=record_id,patient,left_diagnostic')
+        self.assertEqual(set(response.data['results'][0]), {'record_id', 'patient', 'left_diagnostic'})
+        self.assertLessEqual(count, QUERY_BUDGETS['medical-data']['list'])
+
+    def test_default_doctor_is_cached(self):
+        default_doctor()
+        with self.assertNumQueries(0):
+            default_doctor()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/diagnose/appointments/', {
+                'patient': Patient.objects.create(first_name="P", last_name="P", birthday="1970-01-01",
+                                                  gender="O", address="-", phone="0", insurance_info="-",
+                                                  contact_info="-").pk,
+                'appointment_datetime': timezone.now().isoformat()})
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertFalse(any('FROM "diagnose_doctor"' in query['sql'] for query in queries.captured_queries))
+
+    def test_default_doctor_cache_follows_updates(self):
+        doctor = Doctor.objects.get(pk=default_doctor().pk)
+        doctor.first_name = "Changed"
+        doctor.save()
+        self.assertEqual(default_doctor().first_name, "Changed")
+
+
+# What run_diagnosis_worker or rediagnose do after writing, in a process of their own.
+BUMP_IN_ANOTHER_PROCESS = """
+import django
+django.setup()
+from django.db import connection
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+connection.settings_dict['NAME'] = ':memory:'
+from diagnose import response_cache
+from diagnose.models import Diagnose
+response_cache.bump(Diagnose)
+"""
+
+
+class ResponseCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Doctor.objects.create(doctor_id=1, first_name="D", last_name="D", specialty="eye", phone="0",
+                              email="d@example.com")
+
+    def setUp(self):
+        self.client = APIClient()
+        response_cache().clear()
+
+    def test_repeated_get_is_served_from_cache(self):
+        first = self.client.get('/diagnose/doctors/')
+        with self.assertNumQueries(0):
+            second = self.client.get('/diagnose/doctors/')
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['ETag'], first['ETag'])
+
+    def test_if_none_match_gets_304(self):
+        etag = self.client.get('/diagnose/doctors/1/')['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get('/diagnose/doctors/1/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+
+    def test_writes_invalidate(self):
+        etag = self.client.get('/diagnose/doctors/1/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch('/diagnose/doctors/1/', {'first_name': "Changed"})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get('/diagnose/doctors/1/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['first_name'], "Changed")
+
+    def test_writes_in_other_processes_invalidate(self):
+        Diagnose.objects.create(complete_diagnosis="Pending", confidence_score=0)
+        etag = self.client.get('/diagnose/diagnoses/')['ETag']
+        subprocess.run([sys.executable, '-c', BUMP_IN_ANOTHER_PROCESS], cwd=settings.BASE_DIR, check=True)
+        response = self.client.get('/diagnose/diagnoses/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_deleting_a_doctor_invalidates_the_rows_it_nulls(self):
+        doctor = Doctor.objects.create(first_name="O", last_name="O", specialty="eye", phone="0",
+                                       email="o@example.com")
+        patient = Patient.objects.create(first_name="P", last_name="P", birthday="1970-01-01", gender="O",
+                                         address="-", phone="0", insurance_info="-", contact_info="-", doctor=doctor)
+        # Seen by another doctor, so deleting `doctor` does not cascade to the record's appointment.
+        appointment = Appointment.objects.create(patient=patient, doctor=default_doctor(),
+                                                 appointment_datetime=timezone.now())
+        record = MedicalData.objects.create(patient=patient, doctor=doctor, appointment_date=appointment,
+                                            left_diagnostic="Normal", right_diagnostic="Normal")
+        urls = [f'/diagnose/patients/{patient.pk}/', f'/diagnose/medical-data/{record.pk}/']
+        etags = [self.client.get(url)['ETag'] for url in urls]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/diagnose/doctors/{doctor.pk}/')
+        for url, etag in zip(urls, etags):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertIsNone(response.data['doctor'])
+
+    def test_other_models_keep_their_entries(self):
+        self.client.get('/diagnose/doctors/')
+        with self.captureOnCommitCallbacks(execute=True):
+            Patient.objects.create(first_name="P", last_name="P", birthday="1970-01-01", gender="O", address="-",
+                                   phone="0", insurance_info="-", contact_info="-")
+        with self.assertNumQueries(0):
+            self.client.get('/diagnose/doctors/')
+
+
+class FilteringTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = Doctor.objects.create(doctor_id=1, first_name="D", last_name="D", specialty="eye", phone="0",
+                                           email="d@example.com")
+        cls.other = Doctor.objects.create(first_name="O", last_name="O", specialty="eye", phone="0",
+                                          email="o@example.com")
+        cls.smith = Patient.objects.create(first_name="Anna", last_name="Smith", birthday="1970-01-01", gender="F",
+                                           address="-", phone="0612-345", insurance_info="-", contact_info="-")
+        cls.jones = Patient.objects.create(first_name="Bob", last_name="Jones", birthday="1970-01-01", gender="M",
+                                           address="-", phone="0799-000", insurance_info="-", contact_info="-")
+        cls.day = timezone.make_aware(datetime(2026, 3, 2, 9, 30))
+        for patient, doctor, offset in [(cls.smith, cls.doctor, 0), (cls.smith, cls.other, 1), (cls.jones, cls.doctor, 2)]:
+            appointment = Appointment.objects.create(patient=patient, doctor=doctor,
+                                                     appointment_datetime=cls.day + timedelta(days=offset))
+            record = MedicalData.objects.create(patient=patient, doctor=doctor, appointment_date=appointment,
+                                                left_diagnostic="Normal", right_diagnostic="Normal",
+                                                medical_notes=f"Follow-up for {patient.last_name}, intraocular pressure")
+            Bill.objects.create(appointment=appointment, amount=10, payment_method="cash",
+                                payment_status="paid" if offset else "pending")
+
+    def setUp(self):
+        self.client = APIClient()
+        response_cache().clear()
+
+    def ids(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.data)
+        return [next(iter(row.values())) for row in response.data['results']]
+
+    def test_appointments_by_doctor_and_range(self):
+        ids = self.ids(f'/diagnose/appointments/?doctor={self.doctor.pk}&after=2026-03-02&before=2026-03-05')
+        self.assertEqual(len(ids), 2)
+        ids = self.ids(f'/diagnose/appointments/?doctor={self.doctor.pk}&after=2026-03-03')
+        self.assertEqual(ids, list(Appointment.objects.filter(patient=self.jones).values_list('pk', flat=True)))
+
+    def test_appointments_ignore_ordering(self):
+        # Cursor pages are keyed on pk alone; ordering on a non-unique field would repeat or skip rows.
+        response = self.client.get('/diagnose/appointments/?ordering=appointment_datetime&page_size=2')
+        ids = [row['appointment_id'] for row in response.data['results']]
+        response = self.client.get(response.data['next'])
+        ids += [row['appointment_id'] for row in response.data['results']]
+        self.assertEqual(ids, sorted(Appointment.objects.values_list('pk', flat=True), reverse=True)[:len(ids)])
+
+    def test_medical_data_by_patient_and_date(self):
+        self.assertEqual(len(self.ids(f'/diagnose/medical-data/?patient={self.smith.pk}')), 2)
+        ids = self.ids(f'/diagnose/medical-data/?patient={self.smith.pk}&date=2026-03-03')
+        self.assertEqual(ids, list(MedicalData.objects.filter(doctor=self.other).values_list('pk', flat=True)))
+
+    def test_bills_by_payment_status(self):
+        self.assertEqual(len(self.ids('/diagnose/bills/?payment_status=paid')), 2)
+        self.assertEqual(len(self.ids('/diagnose/bills/?payment_status=pending')), 1)
+
+    def test_invalid_values_are_rejected(self):
+        for url in ['/diagnose/appointments/?doctor=abc', '/diagnose/appointments/?after=yesterday',
+                    '/diagnose/medical-data/?date=2026-13-01']:
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 400)
+
+    def test_patient_search(self):
+        self.assertEqual(self.ids('/diagnose/patients/?search=smi'), [self.smith.pk])
+        self.assertEqual(self.ids('/diagnose/patients/?search=anna 0612'), [self.smith.pk])
+        self.assertEqual(self.ids('/diagnose/patients/?search="*'), [])
+        self.assertEqual(self.ids('/diagnose/patients/?search=bob smith'), [])
+
+    def test_search_index_follows_writes(self):
+        self.jones.last_name = "Jonas"
+        self.jones.save()
+        self.assertEqual(self.ids('/diagnose/patients/?search=jones'), [])
+        self.assertEqual(self.ids('/diagnose/patients/?search=jonas'), [self.jones.pk])
+        self.smith.delete()
+        self.assertEqual(self.ids('/diagnose/patients/?search=smith'), [])
+
+    def test_medical_notes_search(self):
+        self.assertEqual(len(self.ids('/diagnose/medical-data/?search=intraocular')), 3)
+        self.assertEqual(len(self.ids(f'/diagnose/medical-data/?search=pressure jones&patient={self.jones.pk}')), 1)
+
+
+class TimelineTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = Doctor.objects.create(doctor_id=1, first_name="D", last_name="D", specialty="eye", phone="0",
+                                           email="d@example.com")
+        cls.patient = Patient.objects.create(first_name="P", last_name="P", birthday="1970-01-01", gender="O",
+                                             address="-", phone="0", insurance_info="-", contact_info="-")
+        cls.start = timezone.make_aware(datetime(2026, 1, 5, 9, 0))
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def add_history(self, visits, offset=0):
+        """`visits` days of history: on even days an exam with a bill (and every fourth a treatment
+        plan), on odd days an appointment without a record."""
+        for day in range(offset, offset + visits):
+            appointment = Appointment.objects.create(patient=self.patient, doctor=self.doctor,
+                                                     appointment_datetime=self.start + timedelta(days=day))
+            if day % 2:
+                continue
+            record = MedicalData.objects.create(patient=self.patient, doctor=self.doctor, appointment_date=appointment,
+                                                left_diagnostic="Normal", right_diagnostic="Normal")
+            Bill.objects.create(appointment=appointment, amount=10, payment_status="paid", payment_method="cash")
+            if day % 4 == 0:
+                TreatmentPlan.objects.create(record=record, medication="-", dose="-", daily_activities="-")
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(b''.join(response.streaming_content))
+
+    def url(self, **params):
+        query = '&'.join(f'{name}={value}' for name, value in params.items())
+        return f'/diagnose/patients/{self.patient.pk}/timeline/?{query}'
+
+    def test_entries_are_merged_newest_first(self):
+        self.add_history(4)
+        page = self.get(self.url())
+        self.assertEqual([(entry['type'], entry['at'][:10]) for entry in page['results']], [
+            ('appointment', '2026-01-08'),
+            ('bill', '2026-01-07'), ('medical_data', '2026-01-07'),
+            ('appointment', '2026-01-06'),
+            ('bill', '2026-01-05'), ('medical_data', '2026-01-05'),
+        ])
+        exam = page['results'][-1]
+        self.assertEqual(exam['diagnose']['confidence_score'], '0.94')
+        self.assertEqual(exam['treatment_plan']['medication'], "-")
+        self.assertIsNone(page['results'][2]['treatment_plan'])
+        self.assertEqual(page['patient']['patient_id'], self.patient.pk)
+        self.assertIsNone(page['next'])
+
+    def test_query_count_does_not_grow_with_history(self):
+        self.add_history(4)
+        with CaptureQueriesContext(connection) as short:
+            self.get(self.url(page_size=500))
+        self.add_history(40, offset=4)
+        with CaptureQueriesContext(connection) as long:
+            self.assertEqual(len(self.get(self.url(page_size=500))['results']), 66)
+        self.assertEqual(len(short), len(long))
+        self.assertLessEqual(len(long), 4)
+
+    def test_pages_cover_the_history_once(self):
+        self.add_history(9)
+        everything = self.get(self.url())['results']
+        seen, url = [], self.url(page_size=4)
+        while url:
+            page = self.get(url)
+            self.assertLessEqual(len(page['results']), 4)
+            seen.extend(page['results'])
+            url = page['next']
+        self.assertEqual(seen, everything)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get(self.url(cursor='bm9wZQ==')).status_code, 400)
+
+
+class SparseFieldsetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Doctor.objects.create(doctor_id=1, first_name="D", last_name="D", specialty="eye", phone="0",
+                              email="d@example.com")
+        create_exams(3)
+
+    def setUp(self):
+        self.client = APIClient()
+        response_cache().clear()
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data['results'], [query['sql'] for query in queries.captured_queries]
+
+    def test_model_columns(self):
+        patients = PatientSerializer()
+        self.assertEqual(model_columns(patients, ['first_name']), ['first_name', 'patient_id'])
+        self.assertEqual(model_columns(patients, ['age']), ['birthday', 'patient_id'])
+        self.assertEqual(model_columns(patients, ['personal_photo_thumbnail']), ['patient_id', 'personal_photo'])
+        self.assertEqual(model_columns(DiagnosisJobSerializer(), ['left_diagnostic']), ['job_id', 'record'])
+
+        class WholeObject(PatientSerializer):
+            summary = serializers.CharField(source='*', read_only=True)
+
+            class Meta(PatientSerializer.Meta):
+                fields = PatientSerializer.Meta.fields + ['summary']
+
+        self.assertIsNone(model_columns(WholeObject(), ['first_name', 'summary']))
+
+    def test_only_the_needed_columns_are_loaded(self):
+        results, queries = self.get('/diagnose/patients/?fields=patient_id,age')
+        self.assertEqual(len(queries), 1)
+        self.assertIn('"diagnose_patient"."birthday"', queries[0])
+        self.assertNotIn('"diagnose_patient"."address"', queries[0])
+        self.assertEqual({tuple(result) for result in results}, {('patient_id', 'age')})
+        self.assertEqual(results[0]['age'], date.today().year - 1970)
+
+    def test_derived_fields_load_their_source(self):
+        results, queries = self.get('/diagnose/patients/?fields=personal_photo_thumbnail')
+        self.assertEqual(len(queries), 1)
+        self.assertIn('"diagnose_patient"."personal_photo"', queries[0])
+        self.assertEqual(set(results[0]), {'personal_photo_thumbnail'})
+
+    def test_related_sources_do_not_add_queries(self):
+        results, queries = self.get('/diagnose/jobs/?fields=job_id,left_diagnostic')
+        self.assertLessEqual(len(queries), QUERY_BUDGETS['jobs']['list'])
+        self.assertEqual([result['left_diagnostic'] for result in results], ["Normal"] * 3)
+
+    def test_unknown_fields_are_rejected(self):
+        response = self.client.get('/diagnose/patients/?fields=first_name,password')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('password', response.data['fields'][0])
+
+    def test_writes_ignore_fields(self):
+        response = self.client.post('/diagnose/patients/?fields=patient_id', {
+            'first_name': "P", 'last_name': "New", 'birthday': "1980-01-01", 'gender': "O", 'address': "-",
+            'phone': "0", 'insurance_info': "-", 'contact_info': "-"})
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data['last_name'], "New")
+
+
+class SQLiteSettingsTests(TestCase):
+    """The DATABASES options, on a database file of their own (the test database is in memory,
+    which cannot use WAL)."""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'db.sqlite3')
+
+    def connect(self):
+        wrapper = SQLiteDatabaseWrapper({**connection.settings_dict, 'NAME': self.path}, alias='sqlite-settings')
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def test_pragmas_are_applied(self):
+        with self.connect().cursor() as cursor:
+            for name, value in settings.DIAGNOSE_SQLITE_PRAGMAS.items():
+                with self.subTest(pragma=name):
+                    cursor.execute(f'PRAGMA {name}')
+                    current = cursor.fetchone()[0]
+                    if name == 'synchronous':
+                        self.assertEqual(current, 1)  # NORMAL
+                    elif name == 'temp_store':
+                        self.assertEqual(current, 2)  # MEMORY
+                    else:
+                        self.assertEqual(str(current).upper(), str(value).upper())
+
+    def test_transactions_take_the_write_lock_up_front(self):
+        wrapper, statements = self.connect(), []
+        wrapper.cursor().execute('CREATE TABLE counter (value integer)')
+        wrapper.connection.set_trace_callback(statements.append)
+        with mock.patch('django.db.transaction.get_connection', return_value=wrapper), transaction.atomic():
+            wrapper.cursor().execute('INSERT INTO counter VALUES (1)')
+        self.assertEqual(statements, ['BEGIN IMMEDIATE', 'INSERT INTO counter VALUES (1)', 'COMMIT'])
+
+    def test_writers_wait_for_the_lock(self):
+        holder, waiter = self.connect(), self.connect()
+        with holder.cursor() as cursor:
+            cursor.execute('CREATE TABLE counter (value integer)')
+        locked = threading.Event()
+
+        def hold_lock():
+            holder.inc_thread_sharing()
+            try:
+                with holder.cursor() as cursor:
+                    cursor.execute('BEGIN IMMEDIATE')
+                    cursor.execute('INSERT INTO counter VALUES (1)')
+                    locked.set()
+                    time.sleep(0.3)
+                    cursor.execute('COMMIT')
+            finally:
+                holder.dec_thread_sharing()
+
+        with ThreadPoolExecutor(1) as executor:
+            held = executor.submit(hold_lock)
+            self.assertTrue(locked.wait(5))
+            with waiter.cursor() as cursor:
+                cursor.execute('BEGIN IMMEDIATE')
+                cursor.execute('INSERT INTO counter VALUES (2)')
+                cursor.execute('COMMIT')
+                cursor.execute('SELECT value FROM counter ORDER BY value')
+                self.assertEqual(cursor.fetchall(), [(1,), (2,)])
+            held.result()
+
+
+class ContentAddressedStorageTests(TestCase):
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.location)
+        self.storage = ContentAddressedStorage(location=self.location)
+
+    def test_delete_keeps_same_digest_blob_with_other_extension(self):
+        jpg = self.storage.save('fundus_images/Eye1.jpg', ContentFile(b'same bytes'))
+        png = self.storage.save('fundus_images/Eye1.png', ContentFile(b'same bytes'))
+        derived = [self.storage.save_derived(jpg, suffix, b'derived') for suffix in DERIVATIVES]
+        self.assertEqual(jpg[:-4], png[:-4])
+
+        self.storage.delete(jpg)
+        self.assertFalse(self.storage.exists(jpg))
+        self.assertTrue(self.storage.exists(png))
+        self.assertTrue(all(self.storage.exists(name) for name in derived))
+
+        self.storage.delete(png)
+        self.assertFalse(self.storage.exists(png))
+        self.assertFalse(any(self.storage.exists(name) for name in derived))
+
+    def test_same_bytes_are_stored_once_until_the_last_reference_goes(self):
+        first = self.storage.save('fundus_images/Eye1.jpg', ContentFile(b'same bytes'))
+        second = self.storage.save('fundus_images/Eye2.jpg', ContentFile(b'same bytes'))
+        self.assertEqual(first, second)
+        self.assertEqual(StoredBlob.objects.get(name=first).ref_count, 2)
+        self.assertEqual(len(os.listdir(os.path.dirname(self.storage.path(first)))), 1)
+
+        self.storage.delete(first)
+        self.assertTrue(self.storage.exists(first))
+        self.assertEqual(StoredBlob.objects.get(name=first).ref_count, 1)
+        self.storage.delete(first)
+        self.assertFalse(self.storage.exists(first))
+        self.assertFalse(StoredBlob.objects.filter(name=first).exists())
+
+    def test_untracked_legacy_files_are_kept(self):
+        legacy = FileSystemStorage(location=self.location).save('fundus_images/legacy.jpg', ContentFile(b'old'))
+        self.storage.delete(legacy)
+        self.assertTrue(self.storage.exists(legacy))
+
+    def test_saving_a_file_a_delete_removed_writes_it_again(self):
+        name = self.storage.save('fundus_images/Eye1.jpg', ContentFile(b'bytes'))
+        self.storage.delete(name)
+        self.assertEqual(self.storage.save('fundus_images/Eye1.jpg', ContentFile(b'bytes')), name)
+        self.assertTrue(self.storage.exists(name))
+        self.assertEqual(StoredBlob.objects.get(name=name).ref_count, 1)
+
+
+class StoredBlobBackfillTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Doctor.objects.create(doctor_id=1, first_name="D", last_name="D", specialty="eye", phone="0",
+                              email="d@example.com")
+
+    def test_backfill_counts_references_of_untracked_files(self):
+        use_temporary_media_root(self)
+        legacy = FileSystemStorage().save('fundus_images/legacy.jpg', ContentFile(b'old'))
+        tracked = content_storage().save('patient_photos/photo.jpg', ContentFile(b'new'))
+        patient = create_patient(personal_photo=tracked)
+        MedicalData.objects.create(patient=patient, doctor=default_doctor(), left_fundus=legacy, right_fundus=legacy)
+        MedicalData.objects.create(patient=patient, doctor=default_doctor(), left_fundus=legacy)
+
+        backfill = importlib.import_module('diagnose.migrations.0007_backfill_storedblob').backfill_stored_blobs
+        backfill(django_apps, None)
+        self.assertEqual(StoredBlob.objects.get(name=legacy).ref_count, 3)
+        self.assertEqual(StoredBlob.objects.get(name=legacy).size, 3)
+        self.assertEqual(StoredBlob.objects.get(name=tracked).ref_count, 1)
+
+        content_storage().delete(legacy)
+        self.assertTrue(content_storage().exists(legacy))
+
+
+class DecodingTests(TestCase):
+    def test_reduction_for_keeps_the_model_input_covered(self):
+        self.assertEqual(reduction_for((2048, 1536)), 4)
+        self.assertEqual(reduction_for((1785, 1785)), 8)
+        self.assertEqual(reduction_for((1784, 1784)), 4)
+        self.assertEqual(reduction_for((300, 300)), 1)
+        self.assertEqual(reduction_for(None), 1)
+
+    def test_decode_bytes_decodes_jpegs_at_reduced_scale(self):
+        image = np.random.default_rng(0).integers(0, 256, (1536, 2048, 3), dtype=np.uint8)
+        jpeg = cv2.imencode('.jpg', image)[1].tobytes()
+        self.assertEqual(jpeg_size(jpeg), (2048, 1536))
+        self.assertEqual(decode_bytes(jpeg).shape, (384, 512, 3))
+        self.assertEqual(decode_bytes(jpeg, target=(2048, 1536)).shape, image.shape)
+        png = cv2.imencode('.png', image[:300, :400])[1].tobytes()
+        self.assertEqual(decode_bytes(png).shape, (300, 400, 3))
+
+    def test_undecodable_files_raise_value_error(self):
+        with tempfile.TemporaryFile() as image_file:
+            image_file.write(b'not an image')
+            image_file.flush()
+            with self.assertRaisesRegex(ValueError, 'Cannot decode image broken.jpg'):
+                decode_file(image_file, 'broken.jpg')
+
+
+def create_patient(**fields):
+    return Patient.objects.create(first_name="P", last_name="P", birthday="1970-01-01", gender="O", address="-",
+                                  phone="0", insurance_info="-", contact_info="-", doctor=default_doctor(), **fields)
+
+
+def use_temporary_media_root(test):
+    location = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, location)
+    media_root = test.settings(MEDIA_ROOT=location)
+    media_root.enable()
+    test.addCleanup(media_root.disable)
+
+
+def fundus_jpeg(seed=0):
+    image = np.random.default_rng(seed).integers(0, 256, (400, 600, 3), dtype=np.uint8)
+    return cv2.imencode('.jpg', image)[1].tobytes()
+
+
+class DerivativesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Doctor.objects.create(doctor_id=1, first_name="D", last_name="D", specialty="eye", phone="0",
+                              email="d@example.com")
+
+    def setUp(self):
+        use_temporary_media_root(self)
+        self.storage = content_storage()
+        self.jpeg = fundus_jpeg()
+
+    def derived(self, name):
+        return {suffix for suffix in DERIVATIVES if self.storage.exists(self.storage.derived_name(name, suffix))}
+
+    def test_inference_does_not_schedule_a_missing_model_input(self):
+        name = self.storage.save('fundus_images/eye.jpg', ContentFile(self.jpeg))
+        with mock.patch.object(derivatives, 'schedule') as schedule:
+            image = decode_image(MedicalData(left_fundus=name).left_fundus)
+        schedule.assert_not_called()
+        self.assertEqual(image.shape[2], 3)
+
+    def test_patient_photos_get_no_model_input(self):
+        with mock.patch.object(derivatives, 'schedule') as schedule:
+            with self.captureOnCommitCallbacks(execute=True):
+                create_patient(personal_photo=ContentFile(self.jpeg, name='photo.jpg'))
+        schedule.assert_called_once_with(mock.ANY, derivatives.PHOTO_DERIVATIVES)
+
+    def test_backfill_command_generates_missing_derivatives(self):
+        left = self.storage.save('fundus_images/left.jpg', ContentFile(self.jpeg))
+        right = self.storage.save('fundus_images/right.jpg', ContentFile(self.jpeg + b'\0'))
+        photo = self.storage.save('patient_photos/photo.jpg', ContentFile(self.jpeg + b'\0\0'))
+        patient = create_patient(personal_photo=photo)
+        MedicalData.objects.create(patient=patient, doctor=default_doctor(), left_fundus=left, right_fundus=right)
+        self.assertEqual(self.derived(left), set())
+
+        call_command('generate_derivatives', stdout=io.StringIO())
+        self.assertEqual(self.derived(left), set(DERIVATIVES))
+        self.assertEqual(self.derived(right), set(DERIVATIVES))
+        self.assertEqual(self.derived(photo), set(derivatives.PHOTO_DERIVATIVES))
+
+
+class StubDiagnoser:
+    """The part of Diagnoser that the scheduler and ProcessPoolDiagnoser use, without the singleton."""
+
+    def __init__(self, models, cache=None):
+        self.models = models
+        self.cache = cache
+        self.preprocessing = PreprocessingGraph()
+        self.executor = ThreadPoolExecutor(max_workers=len(models), thread_name_prefix='diagnose')
+
+    def executor_for(self, model):
+        return self.executor
+
+    def lookup(self, left_image, right_image):
+        return CacheLookup(self.models, self.cache, left_image, right_image)
+
+
+def load_stub_model(path):
+    return lambda batch: np.full((len(batch), 1), 0.5, dtype=np.float32)
+
+
+def stub_models():
+    """One stub model per preprocessing strategy, as the registry has."""
+    strategies = [strategy() for strategy in preprocessingStrategy.PreprocessingStrategy.__subclasses__()]
+    return [EyesModel(f'{type(strategy).__name__}.stub', strategy) for strategy in strategies]
+
+
+class EyesModelTests(TestCase):
+    def setUp(self):
+        self.batches = []
+
+        def load(path):
+            def infer(batch):
+                self.batches.append(batch.shape)
+                # Each image's first pixel, so the results show which eye went where.
+                return batch[:, :1, 0, 0].copy()
+            return infer
+
+        for patcher in (mock.patch.dict(ModelLoaderFactory.loaders, probe=load),
+                        mock.patch.dict(EyesModel._model_cache, clear=True)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.model = EyesModel('model.probe', CataractPreprocessing())
+
+    def exam(self, left, right):
+        return (np.full((300, 400, 3), left, dtype=np.uint8), np.full((300, 400, 3), right, dtype=np.uint8))
+
+    def test_diagnose_runs_both_eyes_in_one_call(self):
+        # Cataract preprocessing adds 50 to every pixel.
+        left_result, right_result = self.model.diagnose(*self.exam(10, 100))
+        self.assertEqual(self.batches, [(2, 224, 224, 3)])
+        self.assertEqual((left_result.tolist(), right_result.tolist()), ([60.0], [150.0]))
+
+    def test_diagnose_batch_keeps_each_exam_together(self):
+        results = self.model.diagnose_batch([self.exam(0, 1), self.exam(2, 3), self.exam(4, 5)])
+        self.assertEqual(self.batches, [(6, 224, 224, 3)])
+        self.assertEqual([(left.tolist(), right.tolist()) for left, right in results],
+                         [([50.0], [51.0]), ([52.0], [53.0]), ([54.0], [55.0])])
+
+
+class ReadinessTests(TestCase):
+    def setUp(self):
+        self.loads = []
+
+        def load(path):
+            self.loads.append(path)
+            return load_stub_model(path)
+
+        for patcher in (mock.patch.dict(ModelLoaderFactory.loaders, lazy=load),
+                        mock.patch.dict(EyesModel._model_cache, clear=True)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.registry = ModelRegistry()
+        for name in ('cataract', 'glaucoma'):
+            self.registry.register(name, EyesModel(f'{name}.lazy', CataractPreprocessing()))
+        patcher = mock.patch.object(views, 'registry', self.registry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_not_ready_until_warmed_up(self):
+        response = self.client.get('/diagnose/ready/')
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(response.json()['ready'])
+        self.assertEqual(response.json()['models']['cataract']['loaded'], False)
+        # Registering a model does not load it.
+        self.assertEqual(self.loads, [])
+
+        self.registry.warmup(background=False)
+        response = self.client.get('/diagnose/ready/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['ready'])
+        self.assertEqual(self.loads, ['cataract.lazy', 'glaucoma.lazy'])
+        status = response.json()['models']['glaucoma']
+        self.assertTrue(status['loaded'] and status['warmed_up'])
+        self.assertIsNotNone(status['warmup_seconds'])
+
+    def test_failed_warmup_is_reported(self):
+        self.registry.register('broken', EyesModel('broken.unknown', CataractPreprocessing()))
+        self.registry.warmup(background=False)
+        response = self.client.get('/diagnose/ready/')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['models']['broken']['error'], 'ValueError: Unsupported model format: unknown')
+        self.assertTrue(response.json()['models']['cataract']['warmed_up'])
+
+
+class ApplyBatchTests(TestCase):
+    def test_apply_batch_equals_apply_for_every_strategy(self):
+        rng = np.random.default_rng(0)
+        images = [rng.integers(0, 256, shape, dtype=np.uint8)
+                  for shape in [(300, 400, 3), (224, 224, 3), (97, 150, 3)]]
+        for strategy_class in preprocessingStrategy.PreprocessingStrategy.__subclasses__():
+            with self.subTest(strategy_class.__name__):
+                strategy = strategy_class()
+                expected = np.stack([strategy.apply(image) for image in images])
+                batch = strategy.apply_batch(images)
+                self.assertEqual(batch.dtype, expected.dtype)
+                np.testing.assert_array_equal(batch, expected)
+                # A reused buffer gives the same result.
+                out = strategy.allocate(len(images))
+                self.assertIs(strategy.apply_batch(images, out=out), out)
+                np.testing.assert_array_equal(out, expected)
+
+
+class PreprocessingOnceTests(TestCase):
+    """Every predictor resizes each eye once per exam, however many models share the resize."""
+
+    def setUp(self):
+        patcher = mock.patch.dict(ModelLoaderFactory.loaders, stub=load_stub_model)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.image = np.random.default_rng(0).integers(0, 256, (300, 400, 3), dtype=np.uint8)
+
+    def resizes(self, predictor):
+        with mock.patch.object(preprocessingStrategy.cv2, 'resize', wraps=cv2.resize) as resize:
+            results = predictor.predict(self.image, self.image)
+        self.assertEqual(len(results), len(predictor.diagnoser.models))
+        return resize.call_count
+
+    def test_scheduler(self):
+        scheduler = InferenceScheduler(StubDiagnoser(stub_models()), max_wait_ms=1)
+        self.addCleanup(scheduler.close)
+        self.assertEqual(self.resizes(scheduler), 2)
+
+    def test_process_pool(self):
+        pool = ProcessPoolDiagnoser(StubDiagnoser(stub_models()), workers=2, start_method='fork')
+        self.addCleanup(pool.close)
+        self.assertEqual(self.resizes(pool), 2)
+
+
+class SchedulerTests(TestCase):
+    def setUp(self):
+        self.threads = []
+
+        def load(path):
+            def infer(batch):
+                self.threads.append(threading.current_thread().name)
+                return np.full((len(batch), 1), 0.5, dtype=np.float32)
+            return infer
+
+        for patcher in (mock.patch.dict(ModelLoaderFactory.loaders, recording=load),
+                        # Loaded models are shared by path; each test records into its own list.
+                        mock.patch.dict(EyesModel._model_cache, clear=True)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.image = np.zeros((64, 64, 3), dtype=np.uint8)
+
+    def scheduler(self, **options):
+        models = [EyesModel('scheduled.recording', CataractPreprocessing())]
+        scheduler = InferenceScheduler(StubDiagnoser(models), **options)
+        self.addCleanup(scheduler.close)
+        return scheduler
+
+    def test_batches_run_on_the_diagnoser_executor(self):
+        self.scheduler(max_wait_ms=1).predict(self.image, self.image)
+        self.assertEqual(len(self.threads), 1)
+        self.assertTrue(self.threads[0].startswith('diagnose'), self.threads)
+
+    def test_concurrent_predictions_share_one_batch(self):
+        # A wait far longer than the test, so only a full batch flushes.
+        scheduler = self.scheduler(max_batch_size=4, max_wait_ms=60_000)
+        with ThreadPoolExecutor(max_workers=4) as callers:
+            results = list(callers.map(lambda _: scheduler.predict(self.image, self.image), range(4)))
+        self.assertEqual(len(results), 4)
+        self.assertEqual(len(self.threads), 1)
+        stats, = scheduler.stats().values()
+        self.assertEqual((stats['batches'], stats['requests']), (1, 4))
+        self.assertEqual(stats['flush_reasons'], {'max_batch_size': 1})
+
+    def test_lone_prediction_flushes_after_max_wait(self):
+        scheduler = self.scheduler(max_batch_size=4, max_wait_ms=100)
+        started = time.monotonic()
+        scheduler.predict(self.image, self.image)
+        self.assertGreaterEqual(time.monotonic() - started, 0.1)
+        stats, = scheduler.stats().values()
+        self.assertEqual((stats['batches'], stats['requests']), (1, 1))
+        self.assertEqual(stats['flush_reasons'], {'max_wait': 1})
+
+
+@unittest.skipUnless(importlib.util.find_spec('tensorflow'), "needs TensorFlow")
+class FusedEnsembleTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from benchmarks.synthetic import synthetic_model_dir
+
+        cls.directory = tempfile.mkdtemp()
+        paths = synthetic_model_dir(['cataract', 'glaucoma'], cls.directory)
+        cls.models = [EyesModel(paths['cataract'], CataractPreprocessing()),
+                      EyesModel(paths['glaucoma'], GlaucomaPreprocessing())]
+        rng = np.random.default_rng(0)
+        cls.batches = [model.strategy.apply_batch([rng.integers(0, 256, (300, 400, 3), dtype=np.uint8)
+                                                   for _ in range(2)])
+                       for model in cls.models]
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+        super().tearDownClass()
+
+    def assert_matches_the_models(self, ensemble):
+        for output, model, batch in zip(ensemble(self.batches), self.models, self.batches):
+            np.testing.assert_allclose(output, model._infer(batch), rtol=1e-5, atol=1e-6)
+
+    def test_fused_outputs_match_each_model(self):
+        self.assert_matches_the_models(FusedEnsemble.build(self.models))
+
+    def test_saved_graph_loads_only_for_its_models(self):
+        path = os.path.join(self.directory, 'fused')
+        FusedEnsemble.build(self.models).save(path)
+        self.assert_matches_the_models(FusedEnsemble.load(path, self.models))
+        with self.assertRaisesRegex(ValueError, 'export it again'):
+            FusedEnsemble.load(path, self.models[::-1])
+
+
+@unittest.skipUnless(all(importlib.util.find_spec(name) for name in ('tensorflow', 'onnxruntime', 'tf2onnx')),
+                     "needs TensorFlow, ONNX Runtime and tf2onnx")
+class OnnxBackendTests(TestCase):
+    def test_onnx_export_matches_keras(self):
+        from benchmarks.synthetic import build_synthetic_model
+        from .classifier.onnx_backend import export_keras_to_onnx
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        keras_model = EyesModel(build_synthetic_model(os.path.join(directory, 'model.h5')), CataractPreprocessing())
+        onnx_model = EyesModel(export_keras_to_onnx(keras_model.model, os.path.join(directory, 'model.onnx')),
+                               CataractPreprocessing())
+        rng = np.random.default_rng(0)
+        exams = [tuple(rng.integers(0, 256, (300, 400, 3), dtype=np.uint8) for _ in range(2)) for _ in range(3)]
+        for (keras_left, keras_right), (onnx_left, onnx_right) in zip(keras_model.diagnose_batch(exams),
+                                                                      onnx_model.diagnose_batch(exams)):
+            np.testing.assert_allclose(onnx_left, keras_left, rtol=1e-4, atol=1e-5)
+            np.testing.assert_allclose(onnx_right, keras_right, rtol=1e-4, atol=1e-5)
+
+
+def benchmark_report(**values):
+    """A suite report with `name=(value, better)` metrics."""
+    return {
+        'environment': {'created': "2026-01-01T00:00:00+00:00", 'commit': None, 'cpu_count': 1, 'tensorflow': "-"},
+        'results': {name: {'value': value, 'unit': "ms", 'better': better} for name, (value, better) in values.items()},
+    }
+
+
+class BenchmarkSuiteTests(TestCase):
+    def compare(self, baseline, current, threshold=0.1):
+        with redirect_stdout(io.StringIO()) as output:
+            status = suite.compare(baseline, current, threshold)
+        return status, output.getvalue()
+
+    def test_regressions_follow_the_direction_of_each_metric(self):
+        baseline = benchmark_report(latency=(10, "lower"), throughput=(100, "higher"))
+        self.assertEqual(self.compare(baseline, benchmark_report(latency=(8, "lower"), throughput=(120, "higher")))[0],
+                         0)
+        status, output = self.compare(baseline, benchmark_report(latency=(12, "lower"), throughput=(100, "higher")))
+        self.assertEqual(status, 1)
+        self.assertIn("1 regression(s)", output)
+        status, output = self.compare(baseline, benchmark_report(latency=(10, "lower"), throughput=(80, "higher")))
+        self.assertEqual(status, 1)
+        self.assertRegex(output, r"throughput .*REGRESSION")
+
+    def test_threshold(self):
+        baseline = benchmark_report(latency=(10, "lower"))
+        self.assertEqual(self.compare(baseline, benchmark_report(latency=(10.5, "lower")))[0], 0)
+        self.assertEqual(self.compare(baseline, benchmark_report(latency=(10.5, "lower")), threshold=0.01)[0], 1)
+
+    def test_new_and_missing_metrics_are_not_regressions(self):
+        status, output = self.compare(benchmark_report(old=(10, "lower")), benchmark_report(new=(10, "lower")))
+        self.assertEqual(status, 0)
+        self.assertRegex(output, r"\nnew .* new\n")
+        self.assertRegex(output, r"\nold .* missing\n")
+
+    @unittest.skipUnless(importlib.util.find_spec('tensorflow'), "needs TensorFlow")
+    def test_run_writes_a_report(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        output, baseline = os.path.join(directory, 'current.json'), os.path.join(directory, 'baseline.json')
+        with open(baseline, 'w') as file:
+            json.dump(benchmark_report(**{'decode/400x300/p50': (1e9, "lower")}), file)
+        args = argparse.Namespace(
+            output=output, baseline=baseline, threshold=0.1, groups=['decode', 'preprocess'], sizes=['400x300'],
+            batch_sizes=[2], concurrency=[1], repeat=1, exams=2, max_workers=1, model_concurrency=1, max_wait_ms=1,
+            models_dir=directory)
+        with redirect_stdout(io.StringIO()):
+            self.assertEqual(suite.run(args), 0)
+        with open(output) as file:
+            report = json.load(file)
+        self.assertEqual(report['environment']['args']['groups'], ['decode', 'preprocess'])
+        self.assertEqual(report['results']['decode/400x300/p50']['better'], "lower")
+        self.assertEqual(report['results']['decode/400x300/throughput']['better'], "higher")
+        self.assertIn('preprocess/cataract/batch2', report['results'])
+        self.assertFalse(any(name.startswith(('predict/', 'end_to_end/')) for name in report['results']))
+
+
+class PredictionCacheTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.calls = 0
+
+        def load(path):
+            def infer(batch):
+                self.calls += 1
+                return np.full((len(batch), 1), 0.5, dtype=np.float32)
+            return infer
+
+        for patcher in (mock.patch.dict(ModelLoaderFactory.loaders, counting=load),
+                        mock.patch.dict(EyesModel._model_cache, clear=True)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.path = os.path.join(self.directory, 'model.counting')
+        self.write_model(b'weights v1')
+        self.image = np.zeros((64, 64, 3), dtype=np.uint8)
+
+    def write_model(self, data):
+        with open(self.path, 'wb') as model_file:
+            model_file.write(data)
+
+    def predict(self, cache):
+        """One exam through a freshly constructed model, as after a restart."""
+        model = EyesModel(self.path, CataractPreprocessing())
+        model.warmup()
+        self.calls = 0
+        scheduler = InferenceScheduler(StubDiagnoser([model], cache), max_wait_ms=1)
+        self.addCleanup(scheduler.close)
+        return scheduler.predict(self.image, self.image)
+
+    def test_hit_skips_the_model(self):
+        cache = PredictionCache()
+        first = self.predict(cache)
+        self.assertEqual(self.calls, 1)
+        np.testing.assert_equal(self.predict(cache), first)
+        self.assertEqual(self.calls, 0)
+        self.assertEqual(cache.stats()['hits'], 2)
+
+    def test_new_model_version_misses(self):
+        cache = PredictionCache()
+        self.predict(cache)
+        EyesModel._model_cache.clear()
+        self.write_model(b'weights v2, retrained')
+        self.predict(cache)
+        self.assertEqual(self.calls, 1)
+
+    def test_missing_model_file_is_not_cached(self):
+        model = EyesModel(os.path.join(self.directory, 'missing.counting'), CataractPreprocessing())
+        self.assertIsNone(model.version)
+        lookup = CacheLookup([model], PredictionCache(), self.image, self.image)
+        lookup.store(model, (np.array([0.5]), np.array([0.5])))
+        self.assertEqual(lookup.cache.stats()['entries'], 0)
+
+    def test_disk_tier_round_trips(self):
+        path = os.path.join(self.directory, 'predictions.sqlite3')
+        value = np.array([[0.25, 0.75]], dtype=np.float32)
+        PredictionCache(path=path).put('key', value)
+        cache = PredictionCache(path=path)
+        np.testing.assert_array_equal(cache.get('key'), value)
+        self.assertEqual(cache.stats()['disk_hits'], 1)
+        self.assertIsNone(cache.get('other'))
+
+
+class ProcessPoolTests(TestCase):
+    def test_one_failing_model_fails_the_exam_after_every_task_is_answered(self):
+        models = [EyesModel('cataract.stub', CataractPreprocessing()),
+                  EyesModel('missing.unknown', CataractPreprocessing()),
+                  EyesModel('glaucoma.stub', CataractPreprocessing())]
+        for model in models:
+            model._version = 'test'
+        cache = PredictionCache()
+        image = np.zeros((64, 64, 3), dtype=np.uint8)
+        # Forked workers inherit the stub loader.
+        with mock.patch.dict(ModelLoaderFactory.loaders, stub=load_stub_model):
+            pool = ProcessPoolDiagnoser(StubDiagnoser(models, cache), workers=2, start_method='fork')
+            self.addCleanup(pool.close)
+            with self.assertRaisesRegex(RuntimeError, 'Unsupported model format: unknown'):
+                pool.predict(image, image)
+            self.assertEqual(pool.stats()['inflight'], 0)
+            # The models that did answer are kept.
+            self.assertEqual([result is not None for result in pool.diagnoser.lookup(image, image).results],
+                             [True, False, True])
+
+            # The workers survive and go on serving exams.
+            with self.assertRaisesRegex(RuntimeError, 'Unsupported model format: unknown'):
+                pool.predict(image[:32], image[:32])
+        self.assertEqual(pool.stats()['restarts'], 0)
+
+    def test_unanswered_exam_times_out_and_restarts_its_worker(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        hang = os.path.join(directory, 'hang')
+
+        def load_hanging(path):
+            def infer(batch):
+                # Real exams hang while the marker file exists; warmup's dummy exam does not.
+                while batch.max() > 100 and os.path.exists(hang):
+                    time.sleep(0.05)
+                return np.full((len(batch), 1), 0.5, dtype=np.float32)
+            return infer
+
+        image = np.full((64, 64, 3), 255, dtype=np.uint8)
+        with mock.patch.dict(ModelLoaderFactory.loaders, hanging=load_hanging):
+            pool = ProcessPoolDiagnoser(StubDiagnoser([EyesModel('model.hanging', CataractPreprocessing())]),
+                                        workers=1, start_method='fork', task_timeout=0.5)
+            self.addCleanup(pool.close)
+            open(hang, 'w').close()
+            with self.assertRaises(WorkerTimeoutError):
+                pool.predict(image, image)
+            self.assertEqual(pool.stats()['restarts'], 1)
+            self.assertEqual(pool.stats()['inflight'], 0)
+
+            os.remove(hang)
+            self.assertEqual(len(pool.predict(image, image)), 1)
+
+
+class RediagnoseTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Doctor.objects.create(doctor_id=1, first_name="D", last_name="D", specialty="eye", phone="0",
+                              email="d@example.com")
+
+    def setUp(self):
+        create_exams(3)
+        self.records = list(MedicalData.objects.order_by('record_id'))
+        for record, name in zip(self.records, ['a.jpg', 'bad.jpg', 'c.jpg']):
+            MedicalData.objects.filter(pk=record.pk).update(left_fundus=name, right_fundus=name)
+        self.checkpoint = os.path.join(tempfile.mkdtemp(), 'checkpoint.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.checkpoint))
+
+    def run_command(self, broken, **options):
+        def decode_image(field_file):
+            if field_file.name in broken:
+                raise ValueError("cannot decode")
+            return np.zeros((8, 8, 3), dtype=np.uint8)
+
+        results = [(np.array([0.9]), np.array([0.1]))] * len(list(rediagnose.registry))
+        with mock.patch.object(rediagnose.registry, 'warmup'), \
+                mock.patch.object(rediagnose, 'decode_image', decode_image), \
+                mock.patch.object(rediagnose.predictor, 'predict', return_value=results) as predict:
+            call_command('rediagnose', checkpoint=self.checkpoint, workers=2, stdout=io.StringIO(),
+                         stderr=io.StringIO(), **options)
+        with open(self.checkpoint) as checkpoint_file:
+            return predict.call_count, json.load(checkpoint_file)
+
+    def test_failed_records_are_retried_on_resume(self):
+        first, failed, last = self.records
+        calls, checkpoint = self.run_command(broken={'bad.jpg'})
+        self.assertEqual(calls, 2)
+        self.assertEqual(checkpoint, {'last_record_id': last.pk, 'failed_record_ids': [failed.pk]})
+        self.assertEqual(MedicalData.objects.get(pk=failed.pk).left_diagnostic, 'Normal')
+
+        calls, checkpoint = self.run_command(broken=set())
+        self.assertEqual(calls, 1)
+        self.assertEqual(checkpoint, {'last_record_id': last.pk, 'failed_record_ids': []})
+        self.assertNotEqual(MedicalData.objects.get(pk=failed.pk).left_diagnostic, 'Normal')
+
+    def test_records_and_retries_are_read_a_page_at_a_time(self):
+        def record_selects(queries, condition):
+            lookup = f'"diagnose_medicaldata"."record_id" {condition}'
+            return [query['sql'] for query in queries if query['sql'].startswith('SELECT') and lookup in query['sql']]
+
+        with CaptureQueriesContext(connection) as queries:
+            _, checkpoint = self.run_command(broken={'a.jpg', 'bad.jpg', 'c.jpg'}, chunk_size=2)
+        self.assertEqual(checkpoint['failed_record_ids'], [record.pk for record in self.records])
+        # A full page of two, then a short page that ends the walk.
+        self.assertEqual(len(record_selects(queries, '>')), 2)
+
+        with CaptureQueriesContext(connection) as queries:
+            calls, checkpoint = self.run_command(broken=set(), chunk_size=2)
+        self.assertEqual((calls, checkpoint['failed_record_ids']), (3, []))
+        self.assertEqual(len(record_selects(queries, 'IN')), 2)
+
+
+class JobQueueTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Doctor.objects.create(doctor_id=1, first_name="D", last_name="D", specialty="eye", phone="0",
+                              email="d@example.com")
+
+    def setUp(self):
+        use_temporary_media_root(self)
+
+    def upload(self):
+        """An async-mode upload through the viewset; returns the response."""
+        return self.client.post('/diagnose/medical-data/?async=1', {
+            'patient': create_patient().pk,
+            'left_fundus': SimpleUploadedFile('left.jpg', fundus_jpeg(1), content_type='image/jpeg'),
+            'right_fundus': SimpleUploadedFile('right.jpg', fundus_jpeg(2), content_type='image/jpeg'),
+        })
+
+    def stub_predictor(self, **options):
+        predictor = mock.Mock(**options)
+        predictor.predict.return_value = [(np.array([0.9]), np.array([0.1]))]
+        return predictor
+
+    def test_upload_returns_202_with_location(self):
+        response = self.upload()
+        self.assertEqual(response.status_code, 202, response.content)
+        job = DiagnosisJob.objects.get(pk=response.json()['job_id'])
+        self.assertEqual(response['Location'], response.json()['status_url'])
+        self.assertTrue(response['Location'].endswith(f'/diagnose/jobs/{job.pk}/'))
+        self.assertEqual((job.status, job.record.left_diagnostic), (DiagnosisJob.PENDING, PENDING_DIAGNOSTIC))
+
+    def test_run_job_stores_the_diagnosis(self):
+        self.upload()
+        job = claim_next_job()
+        self.assertEqual((job.status, job.attempts), (DiagnosisJob.RUNNING, 1))
+        self.assertIsNone(claim_next_job())
+
+        run_job(job, self.stub_predictor(), ['cataract'])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), (DiagnosisJob.DONE, None))
+        record = MedicalData.objects.get(pk=job.record_id)
+        self.assertEqual((record.left_diagnostic, record.right_diagnostic), ("cataract", "Normal"))
+        self.assertEqual(record.diagnose.complete_diagnosis, "Left eye: cataract. Right eye: Normal.")
+
+    def test_run_job_records_the_failure(self):
+        self.upload()
+        job = claim_next_job()
+        run_job(job, self.stub_predictor(**{'predict.side_effect': ValueError("bad image")}), ['cataract'])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), (DiagnosisJob.FAILED, "ValueError: bad image"))
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual(MedicalData.objects.get(pk=job.record_id).left_diagnostic, PENDING_DIAGNOSTIC)
+
+    @override_settings(DIAGNOSE_JOB_SYNC_MAX_WAIT_SECONDS=0.2, DIAGNOSE_JOB_POLL_INTERVAL=0.01)
+    def test_wait_times_out_at_the_sync_cap(self):
+        job = DiagnosisJob.objects.get(pk=self.upload().json()['job_id'])
+        started = time.monotonic()
+        response = self.client.get(f'/diagnose/jobs/{job.pk}/?wait=60')
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(response.json()['status'], DiagnosisJob.PENDING)
+        self.assertEqual(self.client.get(f'/diagnose/jobs/{job.pk}/?wait=soon').status_code, 400)
+
+    @override_settings(DIAGNOSE_JOB_MAX_WAIT_SECONDS=0.2, DIAGNOSE_JOB_POLL_INTERVAL=0.01)
+    def test_async_wait_times_out(self):
+        job = DiagnosisJob.objects.get(pk=self.upload().json()['job_id'])
+        started = time.monotonic()
+        response = self.client.get(f'/diagnose/async/jobs/{job.pk}/?wait=60')
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(response.json()['status'], DiagnosisJob.PENDING)
+        self.assertEqual(response.json()['record'], job.record_id)
+        self.assertEqual(self.client.get('/diagnose/async/jobs/9999/').status_code, 404)
+
+    def crash_worker(self):
+        """Claim the next job and leave it running, as a worker that dies mid-job does."""
+        job = claim_next_job()
+        DiagnosisJob.objects.filter(pk=job.pk).update(started_at=timezone.now() - timedelta(hours=1))
+        return job
+
+    @override_settings(DIAGNOSE_JOB_MAX_ATTEMPTS=2)
+    def test_stale_job_fails_at_max_attempts(self):
+        create_exams(1)
+        job = self.crash_worker()
+        self.assertEqual(requeue_stale_jobs(timedelta(minutes=10)), (1, 0))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (DiagnosisJob.PENDING, 1))
+
+        self.assertEqual(self.crash_worker().pk, job.pk)
+        self.assertEqual(requeue_stale_jobs(timedelta(minutes=10)), (0, 1))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (DiagnosisJob.FAILED, 2))
+        self.assertIn("2 attempts", job.error)
+        self.assertIsNotNone(job.finished_at)
+        self.assertIsNone(claim_next_job())
+
+
+class AsyncMedicalDataTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Doctor.objects.create(doctor_id=1, first_name="D", last_name="D", specialty="eye", phone="0",
+                              email="d@example.com")
+
+    def setUp(self):
+        use_temporary_media_root(self)
+        self.patient = create_patient()
+        predictor = mock.Mock()
+        predictor.predict.return_value = [(np.array([0.9]), np.array([0.1]))] * len(async_views.MODEL_NAMES)
+        patcher = mock.patch.object(async_views, 'predictor', predictor)
+        self.predictor = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def upload(self, query='', **fields):
+        data = {'patient': self.patient.pk, 'medical_notes': 'notes',
+                'left_fundus': SimpleUploadedFile('left.jpg', fundus_jpeg(1), content_type='image/jpeg'),
+                'right_fundus': SimpleUploadedFile('right.jpg', fundus_jpeg(2), content_type='image/jpeg')}
+        data.update(fields)
+        return self.client.post('/diagnose/async/medical-data/' + query,
+                                {name: value for name, value in data.items() if value is not None})
+
+    def test_create_diagnoses_and_returns_201(self):
+        response = self.upload()
+        self.assertEqual(response.status_code, 201, response.content)
+        record = MedicalData.objects.get(pk=response.json()['record_id'])
+        self.assertEqual((record.left_diagnostic, record.right_diagnostic),
+                         (", ".join(async_views.MODEL_NAMES), "Normal"))
+        self.assertEqual(record.medical_notes, 'notes')
+        self.assertIsNotNone(record.diagnose)
+        self.predictor.predict.assert_called_once()
+
+    def test_async_jobs_return_202_with_location(self):
+        response = self.upload(query='?async=1')
+        self.assertEqual(response.status_code, 202, response.content)
+        job = DiagnosisJob.objects.get(pk=response.json()['job_id'])
+        self.assertEqual(response['Location'], response.json()['status_url'])
+        self.assertTrue(response['Location'].endswith(f'/diagnose/async/jobs/{job.pk}/'))
+        self.assertEqual(job.record.left_diagnostic, PENDING_DIAGNOSTIC)
+        self.predictor.predict.assert_not_called()
+
+    def test_invalid_upload_returns_400_through_the_serializer(self):
+        response = self.upload(patient=9999, right_fundus=None,
+                               left_fundus=SimpleUploadedFile('left.jpg', b'not an image', content_type='image/jpeg'))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()), {'patient', 'left_fundus', 'right_fundus'})
+        self.assertFalse(MedicalData.objects.exists())
+        self.predictor.predict.assert_not_called()
+
+
+class MedicalDataViewSetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Doctor.objects.create(doctor_id=1, first_name="D", last_name="D", specialty="eye", phone="0",
+                              email="d@example.com")
+
+    def setUp(self):
+        use_temporary_media_root(self)
+        self.patient = create_patient()
+        predictor = mock.Mock()
+        predictor.predict.return_value = [(np.array([0.9]), np.array([0.1]))] * len(views.MODEL_NAMES)
+        patcher = mock.patch.object(views, 'predictor', predictor)
+        self.predictor = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def images(self, seed=1):
+        return {'left_fundus': SimpleUploadedFile('left.jpg', fundus_jpeg(seed), content_type='image/jpeg'),
+                'right_fundus': SimpleUploadedFile('right.jpg', fundus_jpeg(seed + 1), content_type='image/jpeg')}
+
+    def test_create_runs_the_predictor(self):
+        response = self.client.post('/diagnose/medical-data/', {'patient': self.patient.pk, **self.images()})
+        self.assertEqual(response.status_code, 201, response.content)
+        record = MedicalData.objects.get(pk=response.json()['record_id'])
+        self.assertEqual((record.left_diagnostic, record.right_diagnostic), (", ".join(views.MODEL_NAMES), "Normal"))
+        self.assertTrue(record.diagnose.complete_diagnosis.endswith("Right eye: Normal."))
+        self.predictor.predict.assert_called_once()
+
+    def test_create_without_images_returns_400(self):
+        response = self.client.post('/diagnose/medical-data/', {'patient': self.patient.pk})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(MedicalData.objects.exists())
+
+    def test_update_rediagnoses_new_images_only(self):
+        record_id = self.client.post('/diagnose/medical-data/',
+                                     {'patient': self.patient.pk, **self.images()}).json()['record_id']
+        diagnose_id = MedicalData.objects.get(pk=record_id).diagnose_id
+        url = f'/diagnose/medical-data/{record_id}/'
+
+        self.predictor.predict.return_value = [(np.array([0.1]), np.array([0.9]))] * len(views.MODEL_NAMES)
+        response = self.client.patch(url, encode_multipart(BOUNDARY, self.images(seed=3)),
+                                     content_type=MULTIPART_CONTENT)
+        self.assertEqual(response.status_code, 200, response.content)
+        record = MedicalData.objects.get(pk=record_id)
+        self.assertEqual((record.left_diagnostic, record.diagnose_id), ("Normal", diagnose_id))
+        self.assertTrue(record.diagnose.complete_diagnosis.startswith("Left eye: Normal."))
+
+        response = self.client.patch(url, {'medical_notes': 'seen'}, content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.predictor.predict.call_count, 2)
+        self.assertEqual(MedicalData.objects.get(pk=record_id).left_diagnostic, "Normal")
+
+    def test_readiness_reports_scheduler_stats(self):
+        response = self.client.get('/diagnose/ready/')
+        self.assertEqual(response.json()['scheduler'], views.scheduler.stats())
+
+
+class BulkIngestTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Doctor.objects.create(doctor_id=1, first_name="D", last_name="D", specialty="eye", phone="0",
+                              email="d@example.com")
+
+    def setUp(self):
+        use_temporary_media_root(self)
+        self.patients = [create_patient(), create_patient()]
+        predictor = mock.Mock()
+        predictor.predict.return_value = [(np.array([0.9]), np.array([0.1]))] * len(views.MODEL_NAMES)
+        patcher = mock.patch.object(views, 'predictor', predictor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        first, second = (patient.pk for patient in self.patients)
+        self.manifest = [
+            {'patient': first, 'left': 'a/l.jpg', 'right': 'a/r.jpg', 'medical_notes': 'first'},
+            {'patient': second, 'left': 'b/l.jpg', 'right': 'broken.jpg'},
+            {'patient': 9999, 'left': 'a/l.jpg', 'right': 'a/r.jpg'},
+            {'patient': first, 'left': 'b/l.jpg', 'right': 'a/r.jpg'},
+            {'patient': second, 'left': 'missing.jpg', 'right': 'a/r.jpg'},
+        ]
+        self.members = {'a/l.jpg': fundus_jpeg(1), 'a/r.jpg': fundus_jpeg(2), 'b/l.jpg': fundus_jpeg(3),
+                        'broken.jpg': b'not an image'}
+
+    def zip_archive(self, manifest=True):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zip_file:
+            if manifest:
+                zip_file.writestr('manifest.json', json.dumps(self.manifest))
+            for name, data in self.members.items():
+                zip_file.writestr(name, data)
+        return SimpleUploadedFile('exams.zip', archive.getvalue())
+
+    def tar_archive(self):
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode='w:gz') as tar_file:
+            for name, data in self.members.items():
+                member = tarfile.TarInfo(name)
+                member.size = len(data)
+                tar_file.addfile(member, io.BytesIO(data))
+        return SimpleUploadedFile('exams.tar.gz', archive.getvalue())
+
+    def csv_manifest(self):
+        rows = "".join(f"{entry['patient']},{entry['left']},{entry['right']}\n" for entry in self.manifest)
+        return "patient,left,right\n" + rows
+
+    def ingest(self, **data):
+        with self.captureOnCommitCallbacks(execute=True), mock.patch.object(derivatives, 'schedule'):
+            response = self.client.post('/diagnose/medical-data/bulk/', data)
+            self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+            return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def assert_ingested(self, lines):
+        *results, summary = lines
+        # Tar exams are stored as both images arrive, so chunks need not follow the manifest.
+        results.sort(key=lambda result: result['index'])
+        self.assertEqual([result['status'] for result in results], ['created', 'error', 'error', 'error', 'error'])
+        self.assertIn('Cannot decode image broken.jpg', results[1]['error'])
+        self.assertEqual(results[2]['error'], 'Unknown patient 9999')
+        self.assertIn('Duplicate exam', results[3]['error'])
+        self.assertEqual(results[4]['error'], 'Not in archive: missing.jpg')
+        self.assertEqual(summary, {'summary': {'created': 1, 'failed': 4}})
+        record = MedicalData.objects.get(pk=results[0]['record_id'])
+        self.assertEqual(record.patient, self.patients[0])
+        self.assertEqual(float(record.diagnose.confidence_score), results[0]['confidence_score'])
+        self.assertEqual(set(StoredBlob.objects.values_list('name', flat=True)),
+                         {record.left_fundus.name, record.right_fundus.name})
+
+    @override_settings(DIAGNOSE_BULK_CHUNK_SIZE=2)
+    def test_zip_with_manifest_in_the_archive(self):
+        self.assert_ingested(self.ingest(archive=self.zip_archive()))
+
+    @override_settings(DIAGNOSE_BULK_CHUNK_SIZE=2)
+    def test_tar_with_manifest_field(self):
+        self.manifest[0]['medical_notes'] = None
+        self.assert_ingested(self.ingest(archive=self.tar_archive(), manifest=self.csv_manifest()))
+
+    def test_bad_manifests(self):
+        response = self.client.post('/diagnose/medical-data/bulk/', {'archive': self.zip_archive(),
+                                                                      'manifest': '[{"patient": 1}]'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('needs patient, left and right', response.json()['manifest'][0])
+
+        lines = self.ingest(archive=self.zip_archive(manifest=False))
+        self.assertEqual(lines[0], {'status': 'error', 'error': (
+            "No manifest field and no manifest.json/manifest.csv in the archive")})
+        self.assertEqual(lines[-1], {'summary': {'created': 0, 'failed': 1}})
+
+    def test_failed_chunk_releases_its_files(self):
+        with mock.patch.object(MedicalData.objects, 'bulk_create', side_effect=RuntimeError("disk full")):
+            lines = self.ingest(archive=self.zip_archive())
+        self.assertEqual(lines[0]['error'], "RuntimeError: disk full")
+        self.assertEqual(lines[-1], {'summary': {'created': 0, 'failed': 5}})
+        self.assertFalse(MedicalData.objects.exists())
+        self.assertFalse(StoredBlob.objects.exists())
+        self.assertEqual([files for _, _, files in os.walk(settings.MEDIA_ROOT) if files], [])
@@ -0,0 +1,148 @@
+"""
+A patient's history as one chronological stream, newest first: appointments without a
+medical record, medical records (with their appointment, Diagnose and TreatmentPlan), and
+bills, placed right after the appointment they bill for.
+
+A page costs four queries however long the history is: the patient, then one per kind,
+each already ordered and limited to the page size, merged in Python. The cursor is the
+position (time, kind, id) of the last entry sent, and every query resumes strictly after it.
+"""
+import base64
+import heapq
+import itertools
+import json
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import Appointment, Bill, MedicalData
+from .serializers import (PatientSerializer, AppointmentSerializer, MedicalDataSerializer, DiagnoseSerializer,
+                          TreatmentPlanSerializer, BillSerializer)
+
+# Each kind has its own rank, so positions are unique; at equal times the higher rank comes first
+# (a bill before the exam it bills for).
+APPOINTMENT = 'appointment'
+MEDICAL_DATA = 'medical_data'
+BILL = 'bill'
+
+RANKS = {APPOINTMENT: 0, MEDICAL_DATA: 1, BILL: 2}
+
+
+def sources(patient):
+    """Per kind: the patient's rows newest first, and the time field they are ordered by."""
+    return {
+        APPOINTMENT: (Appointment.objects.filter(patient=patient, medicaldata__isnull=True),
+                      'appointment_datetime'),
+        MEDICAL_DATA: (MedicalData.objects.filter(patient=patient, appointment_date__isnull=False)
+                       .select_related('appointment_date', 'diagnose', 'treatmentplan'),
+                       'appointment_date__appointment_datetime'),
+        BILL: (Bill.objects.filter(appointment__patient=patient).select_related('appointment'),
+               'appointment__appointment_datetime'),
+    }
+
+
+def time_of(kind, instance):
+    if kind == APPOINTMENT:
+        return instance.appointment_datetime
+    if kind == MEDICAL_DATA:
+        return instance.appointment_date.appointment_datetime
+    return instance.appointment.appointment_datetime
+
+
+def page_size(value):
+    """?page_size= capped at DIAGNOSE_TIMELINE_MAX_PAGE_SIZE; anything but a positive integer means the default."""
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        size = 0
+    if size <= 0:
+        return settings.DIAGNOSE_TIMELINE_PAGE_SIZE
+    return min(size, settings.DIAGNOSE_TIMELINE_MAX_PAGE_SIZE)
+
+
+def encode_cursor(position):
+    moment, rank, pk = position
+    return base64.urlsafe_b64encode(f"{moment.isoformat()}|{rank}|{pk}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        moment, rank, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        moment, rank, pk = parse_datetime(moment), int(rank), int(pk)
+    except (ValueError, UnicodeError):
+        moment = None
+    if moment is None:
+        raise ValidationError({'cursor': ['Invalid cursor.']})
+    return moment, rank, pk
+
+
+def after(queryset, time_field, rank, position):
+    """Rows of `queryset` (of rank `rank`) that come after `position` in newest-first order."""
+    moment, cursor_rank, pk = position
+    if rank < cursor_rank:
+        return queryset.filter(**{f'{time_field}__lte': moment})
+    if rank > cursor_rank:
+        return queryset.filter(**{f'{time_field}__lt': moment})
+    return queryset.filter(Q(**{f'{time_field}__lt': moment}) | Q(**{time_field: moment, 'pk__lt': pk}))
+
+
+def positioned(kind, rows):
+    for row in rows:
+        yield (time_of(kind, row), RANKS[kind], row.pk), kind, row
+
+
+def entries(patient, size, cursor=None):
+    """
+    (position, kind, instance) entries after `cursor`, newest first: one page of `size` and,
+    if there is more, the first entry of the next. Rows are read with .iterator(), so a page
+    is never held whole.
+    """
+    streams = []
+    for kind, (queryset, time_field) in sources(patient).items():
+        rank = RANKS[kind]
+        if cursor is not None:
+            queryset = after(queryset, time_field, rank, cursor)
+        streams.append(positioned(kind, queryset.order_by(f'-{time_field}', '-pk')[:size + 1].iterator()))
+    merged = heapq.merge(*streams, key=lambda entry: entry[0], reverse=True)
+    return itertools.islice(merged, size + 1)
+
+
+class TimelineRenderer:
+    """JSON for one timeline page, produced piece by piece for a StreamingHttpResponse."""
+
+    def __init__(self, context):
+        self.context = context
+        self.serializers = {
+            APPOINTMENT: AppointmentSerializer(context=context),
+            MEDICAL_DATA: MedicalDataSerializer(context=context),
+            BILL: BillSerializer(context=context),
+        }
+        self.diagnose = DiagnoseSerializer(context=context)
+        self.treatment_plan = TreatmentPlanSerializer(context=context)
+
+    def dumps(self, data):
+        return json.dumps(data, cls=JSONEncoder, ensure_ascii=False)
+
+    def entry(self, kind, instance, moment):
+        data = {'type': kind, 'at': moment, kind: self.serializers[kind].to_representation(instance)}
+        if kind == MEDICAL_DATA:
+            data['appointment'] = self.serializers[APPOINTMENT].to_representation(instance.appointment_date)
+            data['diagnose'] = self.diagnose.to_representation(instance.diagnose) if instance.diagnose else None
+            plan = getattr(instance, 'treatmentplan', None)
+            data['treatment_plan'] = self.treatment_plan.to_representation(plan) if plan else None
+        return data
+
+    def render(self, patient, page, size, next_url):
+        """`page` is from entries(); `next_url(position)` links the page after `position`."""
+        yield '{"patient": ' + self.dumps(PatientSerializer(patient, context=self.context).data) + ', "results": ['
+        last = next_position = None
+        for count, (position, kind, instance) in enumerate(page):
+            if count == size:
+                next_position = last
+                break
+            yield (', ' if last else '') + self.dumps(self.entry(kind, instance, position[0]))
+            last = position
+        yield '], "next": ' + self.dumps(next_url(next_position) if next_position else None) + '}'
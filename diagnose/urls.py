@@ -1,8 +1,10 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import ( DoctorViewSet, PatientViewSet, AppointmentViewSet, 
-                        BillViewSet, MedicalDataViewSet, DiagnoseViewSet, TreatmentPlanViewSet
+                        BillViewSet, MedicalDataViewSet, DiagnoseViewSet, TreatmentPlanViewSet,
+                        ReadinessView, DiagnosisJobViewSet,
 )
+from .async_views import medical_data_create, diagnose_images, diagnosis_job_detail
 
 router = DefaultRouter()
 router.register(r'doctors', DoctorViewSet)
@@ -12,7 +14,12 @@ router.register(r'bills', BillViewSet)
 router.register(r'medical-data', MedicalDataViewSet)
 router.register(r'diagnoses', DiagnoseViewSet)
 router.register(r'treatment-plans', TreatmentPlanViewSet)
+router.register(r'jobs', DiagnosisJobViewSet)
 
 urlpatterns = [
+    path('ready/', ReadinessView.as_view(), name='ready'),
+    path('async/medical-data/', medical_data_create, name='async-medical-data'),
+    path('async/diagnose/', diagnose_images, name='async-diagnose'),
+    path('async/jobs/<int:pk>/', diagnosis_job_detail, name='async-diagnosis-job'),
     path('', include(router.urls)),
 ]
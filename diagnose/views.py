@@ -1,178 +1,370 @@
 from rest_framework import viewsets
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework import status, filters, viewsets
-from .models import Doctor, Patient, Appointment, Bill, MedicalData, Diagnose, TreatmentPlan
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.reverse import reverse
+from rest_framework.utils.urls import replace_query_param
+from django.conf import settings
+from django.db import transaction
+from django.http import StreamingHttpResponse
+import json
+import time
+from .models import (Doctor, Patient, Appointment, Bill, MedicalData, Diagnose, TreatmentPlan, DiagnosisJob,
+                     default_doctor)
 from .serializers import (DoctorSerializer, PatientSerializer,  AppointmentSerializer,
-                                BillSerializer, MedicalDataSerializer,  DiagnoseSerializer, TreatmentPlanSerializer, )
+                                BillSerializer, MedicalDataSerializer,  DiagnoseSerializer, TreatmentPlanSerializer,
+                                DiagnosisJobSerializer, )
+from .jobs import enqueue, PENDING_DIAGNOSTIC
+from .bulk import ManifestError, read_manifest, ingest
+from .ingestion import decode_upload
+from .fieldsets import SparseFieldsetMixin
+from . import response_cache
+from .response_cache import CachedResponseMixin
+from .filtering import QueryParamFilterBackend, FullTextSearchFilter
+from .timeline import TimelineRenderer, entries, page_size, encode_cursor, decode_cursor
 
 
-from .classifier.classifier_component import EyesModel, Diagnoser
+from .classifier.classifier_component import EyesModel, Diagnoser, configure_tensorflow_threads
+from .classifier.report import DiagnosisReport
+from .classifier.scheduler import InferenceScheduler
+from .classifier.prediction_cache import PredictionCache
+from .classifier.registry import ModelRegistry
+from .classifier.process_pool import ProcessPoolDiagnoser
+from .classifier.onnx_backend import configure_onnx_runtime
 from .classifier.preprocessingStrategy import ( CataractPreprocessing, DiabetesPreprocessing, GlaucomaPreprocessing,
                                                      HypertensionPreprocessing, PathologicalMyopiaPreprocessing, AgeIssuesPreprocessing)
 
-diagnoser = Diagnoser()
-diagnoser.add_model(EyesModel("cataract.h5", CataractPreprocessing()))
-diagnoser.add_model(EyesModel("diabetes.h5", DiabetesPreprocessing()))
-diagnoser.add_model(EyesModel("glaucoma.h5", GlaucomaPreprocessing()))
-diagnoser.add_model(EyesModel("hypertension.h5", HypertensionPreprocessing()))
-diagnoser.add_model(EyesModel("myopia.h5", PathologicalMyopiaPreprocessing()))
-diagnoser.add_model(EyesModel("age.h5", AgeIssuesPreprocessing()))
-
-"""
-remaind: add  predictions = diagnoser.predict(left_image_data, right_image_data)
-in the MedicalData ViewSet instate of classification = getPartialDisease(left_fundus, right_fundus) 
-but we before do that we should to modify formal 'predictions' and make it as 'classification' to serialize it to db and response
-
-we may need import this here or in classifier's files:
-from django.db import models
-from django.core.files.storage import default_storage
-from rest_framework.views import APIView
-from rest_framework.parsers import MultiPartParser, FormParser
-import tensorflow as tf
-import numpy as np
-import os
-from abc import ABC, abstractmethod
+# Models load on first use or during the background warmup started by backend/wsgi.py and asgi.py,
+# so importing this module does not load TensorFlow.
+configure_tensorflow_threads(intra_op=settings.DIAGNOSE_TF_INTRA_OP_THREADS,
+                             inter_op=settings.DIAGNOSE_TF_INTER_OP_THREADS)
+
+
+configure_onnx_runtime(optimization_level=settings.DIAGNOSE_ONNX_OPTIMIZATION_LEVEL,
+                       intra_op_threads=settings.DIAGNOSE_ONNX_INTRA_OP_THREADS,
+                       inter_op_threads=settings.DIAGNOSE_ONNX_INTER_OP_THREADS)
+
+
+def model_path(name, default):
+    # The file extension picks the backend (.h5, .pb, .tflite, .onnx), so each model can use the fastest one.
+    return settings.DIAGNOSE_MODEL_PATHS.get(name, default)
 
-import threading
-from django.core.files.uploadedfile import InMemoryUploadedFile
-from .utils import ModelLoaderFactory, PreprocessingFactory
 
+def model_options(name):
+    return {'max_concurrency': settings.DIAGNOSE_MODEL_CONCURRENCY,
+            'dedicated_threads': settings.DIAGNOSE_DEDICATED_THREADS.get(name, 0)}
 
-"""
 
+registry = ModelRegistry()
+registry.register("cataract", EyesModel(model_path("cataract", "cataract.h5"), CataractPreprocessing(), **model_options("cataract")))
+registry.register("diabetes", EyesModel(model_path("diabetes", "diabetes.h5"), DiabetesPreprocessing(), **model_options("diabetes")))
+registry.register("glaucoma", EyesModel(model_path("glaucoma", "glaucoma.h5"), GlaucomaPreprocessing(), **model_options("glaucoma")))
+registry.register("hypertension", EyesModel(model_path("hypertension", "hypertension.h5"), HypertensionPreprocessing(), **model_options("hypertension")))
+registry.register("myopia", EyesModel(model_path("myopia", "myopia.h5"), PathologicalMyopiaPreprocessing(), **model_options("myopia")))
+registry.register("age", EyesModel(model_path("age", "age.h5"), AgeIssuesPreprocessing(), **model_options("age")))
 
+# Re-uploads of the same image return cached per-model results without running the models.
+diagnoser = Diagnoser(cache=PredictionCache(max_entries=settings.DIAGNOSE_CACHE_MAX_ENTRIES,
+                                            path=settings.DIAGNOSE_CACHE_PATH),
+                      max_workers=settings.DIAGNOSE_MAX_WORKERS,
+                      fused=settings.DIAGNOSE_FUSED,
+                      fused_path=settings.DIAGNOSE_FUSED_PATH)
+for model in registry:
+    diagnoser.add_model(model)
+
+# Concurrent requests share batches through the scheduler; it has the same predict() API as the diagnoser.
+scheduler = InferenceScheduler(diagnoser,
+                               max_batch_size=settings.DIAGNOSE_BATCH_MAX_SIZE,
+                               max_wait_ms=settings.DIAGNOSE_BATCH_MAX_WAIT_MS)
+
+# Fused mode already runs every model in one call per exam, which the per-model scheduler queues
+# and worker processes would split up again, so requests go straight to the diagnoser.
+# "process" mode runs the models in a pool of worker processes instead (started on first use).
+if diagnoser.fused:
+    predictor = diagnoser
+elif settings.DIAGNOSE_EXECUTION_MODE == 'process':
+    predictor = ProcessPoolDiagnoser(diagnoser, workers=settings.DIAGNOSE_PROCESS_WORKERS,
+                                     task_timeout=settings.DIAGNOSE_PROCESS_TASK_TIMEOUT)
+else:
+    predictor = scheduler
+
+MODEL_NAMES = [name for name, _ in registry.items()]
+
+
+# Readiness
+class ReadinessView(APIView):
+    """
+    Reports whether every diagnose model is loaded and warmed up, with per-model timings,
+    and the batching scheduler's per-model statistics. Returns 503 until all models are ready.
+    """
+
+    def get(self, request):
+        ready = registry.ready
+        return Response({'ready': ready, 'models': registry.status(), 'scheduler': scheduler.stats()},
+                        status=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE)
 
-def getPartialDisease(a1,a2):
-    return {
-        'left_diagnostic' : 'Happy',
-        'right_diagnostic': 'Sad',
-    }
 
 # Doctor ViewSet
-class DoctorViewSet(viewsets.ModelViewSet):
+class DoctorViewSet(CachedResponseMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     """
     ViewSet for viewing and editing Doctor instances.
     """
     queryset = Doctor.objects.all()
     serializer_class = DoctorSerializer
+    cache_models = (Doctor,)
         
     def get_queryset(self):
-        return self.queryset
+        return self.queryset.all()
 
 
 # Patient ViewSet
-class PatientViewSet(viewsets.ModelViewSet):
+class PatientViewSet(CachedResponseMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     """
     ViewSet for viewing and editing Patient instances.
+
+    ?search= matches words of the first name, last name or phone by prefix.
     """
     queryset = Patient.objects.all()
     serializer_class = PatientSerializer
+    cache_models = (Patient,)
+    filter_backends = [FullTextSearchFilter]
+    search_index = 'diagnose_patient_fts'
     
     def get_queryset(self):
-        return self.queryset
+        return self.queryset.all()
 
     def perform_create(self, serializer):
-        serializer.validated_data['doctor'] = Doctor.objects.get(doctor_id=1)
+        serializer.validated_data['doctor'] = default_doctor()
         serializer.save()
     
     def perform_update(self, serializer):
-        serializer.validated_data['doctor'] = Doctor.objects.get(doctor_id=1)
+        serializer.validated_data['doctor'] = default_doctor()
         serializer.save()
+
+    @action(detail=True, methods=['get'])
+    def timeline(self, request, pk=None):
+        """
+        GET /diagnose/patients/{id}/timeline/: the patient's appointments, medical records (with
+        diagnose and treatment plan) and bills newest first (see diagnose/timeline.py), streamed in
+        pages of ?page_size= entries; `next` links the following page.
+        """
+        patient = self.get_object()
+        size = page_size(request.query_params.get('page_size'))
+        cursor = request.query_params.get('cursor')
+        page = entries(patient, size, decode_cursor(cursor) if cursor else None)
+
+        def next_url(position):
+            return replace_query_param(request.build_absolute_uri(), 'cursor', encode_cursor(position))
+
+        renderer = TimelineRenderer(self.get_serializer_context())
+        return StreamingHttpResponse(renderer.render(patient, page, size, next_url), content_type='application/json')
     
 
 # Appointment ViewSet
-class AppointmentViewSet(viewsets.ModelViewSet):
+class AppointmentViewSet(CachedResponseMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     """
     ViewSet for viewing and editing Appointment instances.
+
+    Filter with ?doctor=, ?patient= and an ?after=/?before= range (ISO dates or datetimes).
     """
     queryset = Appointment.objects.all()
     serializer_class = AppointmentSerializer
+    cache_models = (Appointment,)
+    filter_backends = [QueryParamFilterBackend]
+    filter_params = {'doctor': 'doctor', 'patient': 'patient',
+                     'after': 'appointment_datetime__gte', 'before': 'appointment_datetime__lt'}
     
     def get_queryset(self):
-        return self.queryset
+        return self.queryset.all()
 
     def perform_create(self, serializer):
-        serializer.validated_data['doctor'] = Doctor.objects.get(doctor_id=1)
+        serializer.validated_data['doctor'] = default_doctor()
         serializer.save()
     
     def perform_update(self, serializer):
-        serializer.validated_data['doctor'] = Doctor.objects.get(doctor_id=1)
+        serializer.validated_data['doctor'] = default_doctor()
         serializer.save()
 
 # Bill ViewSet
-class BillViewSet(viewsets.ModelViewSet):
+class BillViewSet(CachedResponseMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     """
     ViewSet for viewing and editing Bill instances.
+
+    Filter with ?payment_status=.
     """
     queryset = Bill.objects.all()
     serializer_class = BillSerializer
+    cache_models = (Bill,)
+    filter_backends = [QueryParamFilterBackend]
+    filter_params = {'payment_status': 'payment_status'}
         
     def get_queryset(self):
-        return self.queryset
+        return self.queryset.all()
+
+
+def use_async_jobs(request):
+    # ?async=1 / ?async=0 overrides the DIAGNOSE_ASYNC_JOBS default per request.
+    value = request.GET.get('async')
+    if value is None:
+        return settings.DIAGNOSE_ASYNC_JOBS
+    return value.lower() in ('1', 'true', 'yes')
 
 
 # MedicalData ViewSet
-class MedicalDataViewSet(viewsets.ModelViewSet):
+class MedicalDataViewSet(CachedResponseMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     """
     ViewSet for viewing and editing MedicalData instances.
+
+    In async mode, uploads are stored with pending diagnostics and answered with
+    202 Accepted and a diagnosis job to poll at /diagnose/jobs/{job_id}/.
+
+    Filter with ?patient= and the appointment's ?date=, or an ?after=/?before= range;
+    ?search= matches words of the medical notes by prefix.
     """
     queryset = MedicalData.objects.all()
     serializer_class = MedicalDataSerializer
+    # ?date=/?after=/?before= read the records' appointments.
+    cache_models = (MedicalData, Appointment)
+    filter_backends = [QueryParamFilterBackend, FullTextSearchFilter]
+    filter_params = {'patient': 'patient', 'date': 'appointment_date__appointment_datetime__date',
+                     'after': 'appointment_date__appointment_datetime__gte',
+                     'before': 'appointment_date__appointment_datetime__lt'}
+    search_index = 'diagnose_medicaldata_fts'
 
     def get_queryset(self):
-        return self.queryset
+        return self.queryset.all()
+
+    def create(self, request, *args, **kwargs):
+        if not use_async_jobs(request):
+            return super().create(request, *args, **kwargs)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return self._enqueue_diagnosis(serializer)
+
+    def update(self, request, *args, **kwargs):
+        if not use_async_jobs(request):
+            return super().update(request, *args, **kwargs)
+        serializer = self.get_serializer(self.get_object(), data=request.data, partial=kwargs.pop('partial', False))
+        serializer.is_valid(raise_exception=True)
+        return self._enqueue_diagnosis(serializer)
+
+    def _enqueue_diagnosis(self, serializer):
+        if not (self.request.data.get("left_fundus") and self.request.data.get("right_fundus")):
+            return Response({'detail': 'Both left_fundus and right_fundus are required.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        with transaction.atomic():
+            record = serializer.save(doctor=default_doctor(),
+                                     left_diagnostic=PENDING_DIAGNOSTIC, right_diagnostic=PENDING_DIAGNOSTIC)
+            job = enqueue(record)
+        status_url = reverse('diagnosisjob-detail', args=[job.job_id], request=self.request)
+        return Response({'job_id': job.job_id, 'record_id': record.record_id, 'status': job.status,
+                         'status_url': status_url},
+                        status=status.HTTP_202_ACCEPTED, headers={'Location': status_url})
+
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk(self, request):
+        """
+        POST /diagnose/medical-data/bulk/ with an `archive` (zip or tar of fundus images) and a
+        `manifest` (see diagnose/bulk.py). Streams one NDJSON line per exam, then a summary line.
+        """
+        archive = request.FILES.get('archive')
+        if archive is None:
+            return Response({'archive': ['This field is required.']}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            entries = read_manifest(request.data['manifest']) if request.data.get('manifest') else None
+        except ManifestError as exc:
+            return Response({'manifest': [str(exc)]}, status=status.HTTP_400_BAD_REQUEST)
+        results = ingest(archive, entries, predictor, MODEL_NAMES,
+                         default_doctor(), chunk_size=settings.DIAGNOSE_BULK_CHUNK_SIZE)
+        return StreamingHttpResponse((json.dumps(result) + "\n" for result in results),
+                                     content_type='application/x-ndjson')
 
     def perform_create(self, serializer):
-        left_fundus = self.request.data.get("left_fundus")
-        right_fundus = self.request.data.get("right_fundus")
-
-        if left_fundus and right_fundus:
-            
-            classification = getPartialDisease(left_fundus, right_fundus)
-            # Update validated data with classification and pneumonia status
-            serializer.validated_data['doctor'] = Doctor.objects.get(doctor_id=1)
-            serializer.validated_data['left_diagnostic'] = classification['left_diagnostic']
-            serializer.validated_data['right_diagnostic'] = classification['right_diagnostic']
-        
-            serializer.save()
-        
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        self._diagnose_and_save(serializer)
 
     def perform_update(self, serializer):
-        left_fundus = self.request.data.get("left_fundus")
-        right_fundus = self.request.data.get("right_fundus")
-
-        if left_fundus and right_fundus:
-            
-            classification = getPartialDisease(left_fundus, right_fundus)
-            # Update validated data with classification and pneumonia status
-            serializer.validated_data['doctor'] = Doctor.objects.get(doctor_id=1)
-            serializer.validated_data['left_diagnostic'] = classification['left_diagnostic']
-            serializer.validated_data['right_diagnostic'] = classification['right_diagnostic']
-        
-            serializer.save()
-        
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        self._diagnose_and_save(serializer)
+
+    def _diagnose_and_save(self, serializer):
+        """Run new fundus images through `predictor` and save the record with its diagnostics and Diagnose."""
+        left_fundus = serializer.validated_data.get("left_fundus")
+        right_fundus = serializer.validated_data.get("right_fundus")
+        if not (left_fundus and right_fundus):
+            if serializer.instance is None:
+                raise ValidationError({'detail': 'Both left_fundus and right_fundus are required.'})
+            # Edits that keep the images keep their diagnosis.
+            serializer.save(doctor=default_doctor())
+            return
+
+        try:
+            report = DiagnosisReport(MODEL_NAMES, predictor.predict(decode_upload(left_fundus),
+                                                                    decode_upload(right_fundus)))
+        except ValueError as exc:
+            raise ValidationError({'detail': str(exc)})
+        diagnose_id = serializer.instance.diagnose_id if serializer.instance else None
+        with transaction.atomic():
+            if diagnose_id:
+                Diagnose.objects.filter(pk=diagnose_id).update(complete_diagnosis=report.complete_diagnosis,
+                                                               confidence_score=report.confidence_score)
+                response_cache.bump(Diagnose)
+            else:
+                serializer.validated_data['diagnose'] = Diagnose.objects.create(
+                    complete_diagnosis=report.complete_diagnosis, confidence_score=report.confidence_score,
+                    diagnosis_notes=" ")
+            serializer.save(doctor=default_doctor(),
+                            left_diagnostic=report.left_diagnostic, right_diagnostic=report.right_diagnostic)
 
 # Diagnose ViewSet
-class DiagnoseViewSet(viewsets.ModelViewSet):
+class DiagnoseViewSet(CachedResponseMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     """
     ViewSet for viewing and editing Diagnose instances.
     """
     queryset = Diagnose.objects.all()
     serializer_class = DiagnoseSerializer
+    cache_models = (Diagnose,)
 
     def get_queryset(self):
-        return self.queryset
+        return self.queryset.all()
 
     
 # TreatmentPlan ViewSet
-class TreatmentPlanViewSet(viewsets.ModelViewSet):
+class TreatmentPlanViewSet(CachedResponseMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     """
     ViewSet for viewing and editing TreatmentPlan instances.
     """
     queryset = TreatmentPlan.objects.all()
     serializer_class = TreatmentPlanSerializer
+    cache_models = (TreatmentPlan,)
     
     def get_queryset(self):
-        return self.queryset
+        return self.queryset.all()
+
+
+# DiagnosisJob ViewSet
+class DiagnosisJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Status of asynchronous diagnosis jobs.
+
+    GET /diagnose/jobs/{id}/?wait=<seconds> holds the response until the job finishes or the
+    wait runs out. It sleeps on a request thread, so the wait is capped by the short
+    DIAGNOSE_JOB_SYNC_MAX_WAIT_SECONDS; long waits go to /diagnose/async/jobs/{id}/.
+    """
+    queryset = DiagnosisJob.objects.select_related('record')
+    serializer_class = DiagnosisJobSerializer
+
+    def get_queryset(self):
+        return self.queryset.all()
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            wait = float(request.query_params.get('wait', 0))
+        except ValueError:
+            raise ValidationError({'wait': 'Must be a number of seconds.'})
+        deadline = time.monotonic() + min(max(wait, 0), settings.DIAGNOSE_JOB_SYNC_MAX_WAIT_SECONDS)
+        job = self.get_object()
+        while job.status not in DiagnosisJob.FINISHED and time.monotonic() < deadline:
+            time.sleep(settings.DIAGNOSE_JOB_POLL_INTERVAL)
+            job = self.get_object()
+        return Response(self.get_serializer(job).data)